@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# bench_bills.py
+#  
+#  Copyright 2014 Manu Varkey <manuvarkey@gmail.com>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  
+
+"""Benchmark of evaluation of bills
+
+    Builds a project with a large schedule and a chain of bills, and times
+    Bill.update on the per item path against the numpy array path after
+    checking that both give the same values. Requires numpy.
+    Usage: python benchmarks/bench_bills.py [schedule items] [bills]
+"""
+
+import os, sys, random, timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'cmbcompanion'))
+sys.path.insert(0, ROOT)
+
+from cmbcompanion import data, misc
+
+
+def make_datamodel(count, bills, items_per_bill=50, seed=2):
+    """Returns data model with count schedule items and a chain of bills of steel items"""
+    rand = random.Random(seed)
+    datamodel = data.datamodel.DataModel()
+    units = ['cum', 'sqm', 'each', 'kg', 'nos', 'm']
+    rows = [[str(i // 10 + 1) + '.' + str(i % 10), 'Item ' + str(i), rand.choice(units),
+             str(round(rand.uniform(10, 5000), 2)),
+             str(rand.choice([rand.randint(1, 500), round(rand.uniform(1, 500), 3)])), '',
+             str(rand.choice([30, 20, 0]))] for i in range(count)]
+    datamodel.schedule.set_model(rows)
+    itemnos = datamodel.schedule.get_itemnos()
+    cmb = data.measurement.Cmb(['CMB 1', []])
+    measurement = data.measurement.Measurement(['01/01/2016', []])
+    cmb.append_item(measurement)
+    datamodel.cmbs.append(cmb)
+    for i in range(bills * items_per_bill):
+        item = data.measurement.MeasurementItemCustom(None, 'civil_steel_table_lengths')
+        values = ['bar', str(rand.randint(1, 9)), '2', '1.5', '2*3', '', '0', '4/2', '1+1'] + [''] * 7
+        item.append_record(data.measurement.RecordCustom(values, item.cust_funcs, item.total_func_item, item.columntypes))
+        for index in range(len(item.itemnos)):
+            item.itemnos[index] = rand.choice(itemnos)
+        measurement.append_item(item)
+    for bill_no in range(bills):
+        bill = data.bill.Bill()
+        bill.data.title = 'Bill ' + str(bill_no + 1)
+        bill.data.mitems = [[0, 0, i] for i in range(bill_no * items_per_bill, (bill_no + 1) * items_per_bill)]
+        bill.data.prev_bill = bill_no - 1 if bill_no else None
+        datamodel.bills.append(bill)
+    datamodel.update(full=True)
+    return datamodel
+
+def get_bill_values(datamodel):
+    """Returns values of all bills along with their types"""
+    values = []
+    for bill in datamodel.bills:
+        items = [[(itemno, type(value).__name__, value) for itemno, value in sorted(dict(item_values).items())]
+                 for item_values in [bill.item_total_qty, bill.item_normal_qty, bill.item_excess_qty,
+                                     bill.item_normal_amount, bill.item_excess_amount]]
+        values.append([bill.bill_total_amount, bill.bill_since_prev_amount] + items)
+    return values
+
+def measure(func, repeat=5):
+    """Returns best time in ms of func"""
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+def main():
+    if misc.numpy is None:
+        sys.exit('numpy not installed')
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    bills = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    datamodel = make_datamodel(count, bills)
+    numpy = misc.numpy
+    
+    def update_bills(arrays=None):
+        for bill in datamodel.bills:
+            bill.update(datamodel.schedule, datamodel.nodes, datamodel.bills, arrays)
+            
+    # Per item path
+    misc.numpy = None
+    datamodel.bill_engine.arrays = None
+    datamodel.update(full=True)
+    values = get_bill_values(datamodel)
+    time_loop = measure(update_bills) / bills
+    time_full_loop = measure(lambda: datamodel.update(full=True))
+    # Array path
+    misc.numpy = numpy
+    datamodel.update(full=True)
+    if get_bill_values(datamodel) != values:
+        sys.exit('Array and per item evaluation differ')
+    arrays = data.bill.ScheduleArrays(datamodel.schedule)
+    time_arrays = measure(lambda: update_bills(arrays)) / bills
+    time_full_arrays = measure(lambda: datamodel.update(full=True))
+    time_schedule = measure(lambda: data.bill.ScheduleArrays(datamodel.schedule))
+    
+    excess = sum(1 for bill in datamodel.bills for itemno in datamodel.schedule.get_itemnos()
+                 if bill.item_excess_qty[itemno] > 0)
+    print('Schedule items ' + str(count) + ', bills ' + str(bills) + ', items in excess ' + str(excess))
+    print('Per bill (ms): per item {:.2f}, arrays {:.2f}'.format(time_loop, time_arrays))
+    print('Schedule arrays (ms): {:.2f}'.format(time_schedule))
+    print('Full update (ms): per item {:.1f}, arrays {:.1f}'.format(time_full_loop, time_full_arrays))
+
+if __name__ == '__main__':
+    main()
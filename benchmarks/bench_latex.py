@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# bench_latex.py
+#  
+#  Copyright 2014 Manu Varkey <manuvarkey@gmail.com>
+#  
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#  
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#  
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#  
+#  
+
+"""Benchmark of escaping of latex special charachters
+
+    Compares misc.clean_latex, with and without its memo, against the
+    chain of str.replace calls it replaced, on numeric cells and on
+    schedule descriptions. Usage: python benchmarks/bench_latex.py [count]
+"""
+
+import os, sys, random, timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'cmbcompanion'))
+sys.path.insert(0, ROOT)
+
+from cmbcompanion import misc
+
+
+def clean_latex_replace(text):
+    """Replace special charachters with latex commands using a chain of replacements"""
+    for splchar, replspelchar in zip(['\\', '#', '$', '%', '^', '&', '_', '{', '}', '~', '\n'],
+                                     ['\\textbackslash ', '\\# ', '\\$ ', '\\% ', '\\textasciicircum ', '\\& ', '\\_ ',
+                                      '\\{ ', '\\} ', '\\textasciitilde ', '\\newline ']):
+        text = text.replace(splchar, replspelchar)
+    return text
+
+def make_values(count, seed=1):
+    """Returns numeric cells and descriptions, repeated as in a CMB"""
+    rand = random.Random(seed)
+    numbers = [str(rand.choice([rand.randint(1, 100), round(rand.uniform(0.1, 100), 3)])) for i in range(count // 10 or 1)]
+    words = ['concrete', 'M20', '40mm', 'of', 'and', 'in', 'R&B', '1:2:4', '50%', 'pipe_line', '#', 'cum', 'kg']
+    descriptions = [' '.join(rand.choice(words) for j in range(rand.randint(20, 60))) for i in range(count // 20 or 1)]
+    return ([rand.choice(numbers) for i in range(count)],
+            [rand.choice(descriptions) for i in range(count)])
+
+def measure(func, values, repeat=5):
+    """Returns best time in ms of applying func to all values"""
+    return min(timeit.repeat(lambda: [func(value) for value in values], number=1, repeat=repeat)) * 1000
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    numbers, descriptions = make_values(count)
+    # Outputs must match replacement chain
+    for value in numbers + descriptions:
+        assert misc.clean_latex(value) == clean_latex_replace(value)
+    print('Escaping ' + str(count) + ' values (ms)')
+    print('{:<16}{:>16}{:>10}{:>16}'.format('', 'replace chain', 'regex', 'regex + memo'))
+    for name, values in [('numeric cells', numbers), ('descriptions', descriptions)]:
+        misc.clean_latex.cache_clear()
+        times = [measure(clean_latex_replace, values), measure(misc.clean_latex.__wrapped__, values),
+                 measure(misc.clean_latex, values)]
+        print('{:<16}{:>16.2f}{:>10.2f}{:>16.2f}'.format(name, *times))
+
+if __name__ == '__main__':
+    main()
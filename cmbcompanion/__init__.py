@@ -22,10 +22,10 @@
 #  
 #  
 
-import logging, tempfile, sys, os, flask, json
+import logging, tempfile, sys, os, time, flask, json, threading, collections, contextlib, types
 from flask_socketio import SocketIO
 
-from . import data, misc, undo
+from . import data, misc, undo, jobs
 
 # Get logger object
 log = logging.getLogger()
@@ -47,6 +47,11 @@ class Project:
         for item_code in misc.global_vars:
             self.project_settings[item_code] = ''
         self.global_settings = {'project_path':'', 'current_page' : '/'}
+        self.lock = threading.RLock()  # Held while a request works on project
+        self.users = 0  # Number of requests using project, evicted only if zero
+        self.session_filename = None  # File saved on eviction, opened on next use
+        self.measitem_edits = []  # Queued cell edits of measitem as (node id of item, (row, column, value))
+        self.measitem_edits_scheduled = False  # Whether queued edits are due to be applied
         
         # Update undo/redo system
         self.stack = undo.Stack()
@@ -68,7 +73,7 @@ class Project:
                 log.info('Plugin loaded - ' + module_name)
             except ImportError:
                 log.error('Error Loading plugin - ' + module_name)
-        self.global_settings['module_group'] = zip(module_names, module_desc)
+        self.global_settings['module_group'] = list(zip(module_names, module_desc))
         
     def open_project(self, filename):
         # Get filename and set project as active
@@ -109,6 +114,89 @@ class Project:
         return True
 
 
+    def save_session(self, filename):
+        """Save project along with session state to file
+        
+            Session state covers the open file, current page and the
+            measurement item being edited. Undo history is not saved.
+        """
+        self.apply_measitem_edits()
+        session = dict()
+        session['project_path'] = self.global_settings['project_path']
+        session['current_page'] = self.global_settings['current_page']
+        if 'measitem' in self.global_settings:
+            session['measitem_path'] = self.global_settings['measitem_path']
+            if self.global_settings['measitem'].is_modified():
+                session['measitem'] = self.global_settings['measitem'].get_item().get_model()
+        data = [misc.PROJECT_FILE_VER, self.datamodel.get_model(), self.project_settings, session]
+        with open(filename, 'w') as fileobj:
+            json.dump(data, fileobj)
+        log.info('save_session - Session saved - ' + filename)
+        
+    def open_session(self, filename):
+        """Open project along with session state saved by save_session"""
+        try:
+            with open(filename, 'r') as fileobj:
+                data_loaded = json.load(fileobj)
+            self.datamodel.set_model(data_loaded[1])
+            self.project_settings = data_loaded[2]
+            session = data_loaded[3]
+            self.global_settings['project_path'] = session['project_path']
+            self.global_settings['current_page'] = session['current_page']
+            if 'measitem_path' in session:
+                path = session['measitem_path']
+                item = self.datamodel.cmbs[path[0]][path[1]][path[2]]
+                edited = None
+                if session.get('measitem', [None])[0] == 'MeasurementItemCustom':
+                    model = session['measitem']
+                    edited = data.measurement.MeasurementItemCustom(model[1], model[1][5])
+                self.global_settings['measitem_path'] = path
+                self.global_settings['measitem'] = data.measurement.MeasurementItemEdit(item, edited)
+        except:
+            log.exception('open_session - Error parsing session file - ' + filename)
+            return False
+        log.info('open_session - Session opened - ' + filename)
+        return True
+
+    def queue_measitem_edit(self, edit):
+        """Queue cell edit of measurement item being edited
+        
+            Arguments:
+                edit: Cell edit as (row, column, value)
+        """
+        node_id = getattr(self.global_settings['measitem'].original, 'node_id', None)
+        self.measitem_edits.append((node_id, edit))
+
+    def apply_measitem_edits(self):
+        """Apply queued cell edits to measurement item being edited
+        
+            Edits queued for an item other than the one being edited, or for
+            an item removed from the data model since, are dropped.
+        
+            Returns:
+                Sorted list of rows modified
+        """
+        edits = self.measitem_edits
+        self.measitem_edits = []
+        if not edits or 'measitem' not in self.global_settings:
+            return []
+        edit_session = self.global_settings['measitem']
+        node_id = getattr(edit_session.original, 'node_id', None)
+        if node_id is None or self.datamodel.nodes.get(node_id) is not edit_session.original:
+            log.warning('apply_measitem_edits - Item edited removed, edits dropped - ' + str(len(edits)))
+            return []
+        length = edit_session.get_item().length()
+        valid = [edit for edit_node_id, edit in edits if edit_node_id == node_id and edit[0] < length]
+        if len(valid) < len(edits):
+            log.warning('apply_measitem_edits - Edits of other items dropped - ' + str(len(edits) - len(valid)))
+        if valid:
+            return edit_session.get_writable().set_values(valid)
+        return []
+
+    def get_settings_view(self):
+        """Returns read only view of global settings for templates"""
+        return types.MappingProxyType(self.global_settings)
+
     def undo(self):
         """Undo action from stack"""
         log.info('Undo:' + str(self.stack.undotext()))
@@ -123,8 +211,148 @@ class Project:
         self.stack.redo()
         self.datamodel.update()
 
-# Create main data object
-project = Project()
+class ProjectRegistry:
+    """Stores projects of all sessions
+    
+        Projects are kept in memory in least recently used order. When more
+        than max_projects are open, idle projects are saved to disk and
+        opened again on next use. Files are read and written holding only
+        the lock of the project concerned, so that requests of other
+        sessions are not held up. Saved files not opened again within
+        lifetime seconds are removed.
+    """
+    
+    def __init__(self, folder, max_projects, lifetime):
+        self.folder = folder
+        self.max_projects = max_projects
+        self.lifetime = lifetime
+        self.projects = collections.OrderedDict()  # Session id mapped to project
+        self.evicting = dict()  # Session id mapped to project being saved to disk
+        self.lock = threading.Lock()  # Guards projects and evicting
+        self.remove_expired()
+        
+    def get_session_filename(self, session_id):
+        """Returns filename of evicted project of session"""
+        return os.path.join(self.folder, session_id + '.session')
+    
+    def get_project_filename(self, session_id):
+        """Returns filename of uploaded project file of session"""
+        return os.path.join(self.folder, session_id + '.proj')
+        
+    @contextlib.contextmanager
+    def session(self, session_id):
+        """Context manager yielding project of session with its lock held
+        
+            The undo stack of the project is set as the stack of the
+            calling thread.
+        """
+        with self.lock:
+            project = self.projects.get(session_id)
+            if project is None:
+                # Take back project if being evicted, else open new one
+                project = self.evicting.pop(session_id, None)
+                if project is None:
+                    project = Project()
+                    filename = self.get_session_filename(session_id)
+                    if os.path.exists(filename):
+                        project.session_filename = filename
+                    log.info('ProjectRegistry - session - Project opened - ' + session_id)
+                self.projects[session_id] = project
+            else:
+                self.projects.move_to_end(session_id)
+            project.users += 1
+            evicted = self.select_evicted()
+        try:
+            self.evict(evicted)
+            with project.lock:
+                # Open project saved on eviction by first request to use it
+                if project.session_filename is not None:
+                    project.open_session(project.session_filename)
+                    self.remove_file(project.session_filename)
+                    project.session_filename = None
+                undo.setstack(project.stack)
+                yield project
+        finally:
+            with self.lock:
+                project.users -= 1
+                
+    def select_evicted(self):
+        """Move least recently used idle projects beyond max_projects to evicting, called with lock held
+        
+            Returns:
+                List of (session_id, project) to be passed to evict()
+        """
+        idle = [session_id for session_id, project in self.projects.items() if project.users == 0]
+        evicted = []
+        for session_id in idle[0:max(len(self.projects) - self.max_projects, 0)]:
+            project = self.projects.pop(session_id)
+            self.evicting[session_id] = project
+            evicted.append((session_id, project))
+        return evicted
+        
+    def evict(self, evicted):
+        """Save projects selected by select_evicted() to disk, called without lock held"""
+        for session_id, project in evicted:
+            filename = self.get_session_filename(session_id)
+            with project.lock:
+                with self.lock:
+                    reclaimed = self.evicting.get(session_id) is not project
+                # Project not opened from disk yet needs no saving
+                if not reclaimed and project.session_filename is None:
+                    try:
+                        project.save_session(filename)
+                    except OSError:
+                        log.exception('ProjectRegistry - evict - Error saving project - ' + session_id)
+                        with self.lock:
+                            if self.evicting.get(session_id) is project:
+                                del self.evicting[session_id]
+                                self.projects[session_id] = project
+                                self.projects.move_to_end(session_id, last=False)
+                        continue
+                with self.lock:
+                    if self.evicting.get(session_id) is project:
+                        del self.evicting[session_id]
+                        log.info('ProjectRegistry - evict - Project evicted - ' + session_id)
+                    else:
+                        reclaimed = True
+                # Project taken back in use while being saved, file not needed
+                if reclaimed and project.session_filename is None:
+                    self.remove_file(filename)
+        if evicted:
+            self.remove_expired()
+            
+    def remove_expired(self):
+        """Remove saved projects not opened again within lifetime"""
+        expiry = time.time() - self.lifetime
+        try:
+            filenames = os.listdir(self.folder)
+        except OSError:
+            return
+        for filename in filenames:
+            if filename.endswith('.session'):
+                filename = os.path.join(self.folder, filename)
+                try:
+                    if os.path.getmtime(filename) < expiry:
+                        os.remove(filename)
+                        log.info('ProjectRegistry - remove_expired - Session file removed - ' + filename)
+                except OSError:
+                    pass
+                    
+    def remove_file(self, filename):
+        """Remove file if existing"""
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+# Create registry of projects of all sessions
+projects = ProjectRegistry(app.config['UPLOAD_FOLDER'], app.config['MAX_OPEN_PROJECTS'],
+                           app.config['SESSION_FILE_LIFETIME'])
+
+# Create queue of render jobs, job status is sent to all clients of session
+misc.set_global_platform_vars()
+render_jobs = jobs.JobQueue(app.config['UPLOAD_FOLDER'], app.config['RENDER_WORKERS'], app.config['MAX_RENDER_JOBS'],
+                            lambda job: socketio.emit('render_job_status', job.get_status(), to=job.session_id))
 
 from . import views
 
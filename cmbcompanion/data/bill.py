@@ -22,7 +22,7 @@
 #
 #
 
-import copy, math, logging
+import copy, math, logging, collections, collections.abc
 
 from ..openpyxl import Workbook, load_workbook, worksheet
 from ..openpyxl.styles import Alignment, Font
@@ -44,7 +44,7 @@ class BillData:
         self.title = ''
         self.bill_date = ''
         self.starting_page = 1
-        self.mitems = []  # for storing paths to billed measurement items [cmb][measurement][Meas Item]
+        self.mitems = []  # Ids of billed measurement items, positional paths [cmb, measurement, item] in saved model
         self.item_part_percentage = dict()  # part rate for exess rate items
         self.item_excess_part_percentage = dict()  # part rate for exess rate items
         self.item_excess_rates = dict()  # list of excess rates above excess_percentage
@@ -85,6 +85,166 @@ class BillData:
             self.bill_type = model[1][12]
 
 
+class ScheduleArrays:
+    """Values of schedule items held in numpy arrays indexed by position of itemno"""
+    
+    def __init__(self, schedule):
+        """Read values from schedule, requires numpy
+        
+            Arguments:
+                schedule: Schedule of data model
+        """
+        numpy = misc.numpy
+        self.itemnos = schedule.get_itemnos()  # Itemnos in order of schedule
+        self.index = {itemno: position for position, itemno in enumerate(self.itemnos)}  # Itemno mapped to position
+        items = [schedule[itemno] for itemno in self.itemnos]
+        count = len(items)
+        self.qty = numpy.fromiter((item.qty for item in items), 'float64', count)
+        self.rate = numpy.fromiter((item.rate for item in items), 'float64', count)
+        self.excess_rate_percent = numpy.fromiter((item.excess_rate_percent for item in items), 'float64', count)
+        self.int_unit = numpy.fromiter((item.unit.lower() in misc.INT_ITEMS for item in items), 'bool', count)
+        
+    def get_values(self, values):
+        """Returns numpy array of values of dictionary keyed by itemno"""
+        return misc.numpy.fromiter((values[itemno] for itemno in self.itemnos), 'float64', len(self.itemnos))
+        
+        
+class ItemValues(collections.abc.MutableMapping):
+    """Dictionary view of values of items held in a numpy array
+    
+        Values are returned as int or float, as evaluated by Bill.evaluate_item.
+    """
+    
+    def __init__(self, arrays, values, integer):
+        self.itemnos = arrays.itemnos  # Itemnos in order of arrays
+        self.index = arrays.index  # Itemno mapped to position in arrays
+        self.values = values  # numpy float array of values
+        self.integer = integer  # numpy bool array marking integer values
+        
+    def __getitem__(self, itemno):
+        position = self.index[itemno]
+        value = self.values[position]
+        return int(value) if self.integer[position] else float(value)
+        
+    def __setitem__(self, itemno, value):
+        position = self.index[itemno]
+        self.values[position] = value
+        self.integer[position] = isinstance(value, int)
+        
+    def __delitem__(self, itemno):
+        raise TypeError('ItemValues - Items can not be removed')
+        
+    def __contains__(self, itemno):
+        return itemno in self.index
+        
+    def __iter__(self):
+        return iter(self.index)
+        
+    def __len__(self):
+        return len(self.index)
+        
+    def get_nonzero(self):
+        """Returns itemnos having non zero values"""
+        return [self.itemnos[position] for position in misc.numpy.nonzero(self.values)[0]]
+        
+    def sum(self):
+        """Returns sum of values as summed in order of itemnos"""
+        return misc.sequential_sum(self.values, self.integer)
+        
+        
+class BillEngine:
+    """Evaluates bills in topological order of their previous bill references
+    
+        Derived values of a bill depend on the cumulative quantities of its
+        previous bill. Bills are evaluated after the bill they carry forward
+        from, and derived values of other bills are retained as is.
+    """
+    
+    def __init__(self):
+        self.prev_bills = None  # Previous bill of each bill when graph was built
+        self.order = []  # Rows of bills in topological order
+        self.successors = dict()  # Row of bill mapped to rows of bills carrying forward from it
+        self.arrays = None  # ScheduleArrays for vectorised evaluation, None if numpy not available
+        
+    def build(self, bills):
+        """Build dependency graph of bills"""
+        self.prev_bills = [bill.data.prev_bill for bill in bills]
+        self.successors = collections.defaultdict(list)
+        indegree = [0] * len(bills)
+        for row, prev_row in enumerate(self.prev_bills):
+            if prev_row is not None:
+                self.successors[prev_row].append(row)
+                indegree[row] += 1
+        queue = collections.deque(row for row, count in enumerate(indegree) if count == 0)
+        self.order = []
+        while queue:
+            row = queue.popleft()
+            self.order.append(row)
+            for successor in self.successors[row]:
+                indegree[successor] -= 1
+                if indegree[successor] == 0:
+                    queue.append(successor)
+        # Bills in a cycle of previous bill references are evaluated in list order
+        if len(self.order) < len(bills):
+            cyclic = [row for row, count in enumerate(indegree) if count > 0]
+            log.warning('BillEngine - build - Cyclic previous bill references - ' + str(cyclic))
+            self.order += cyclic
+            
+    def get_successors(self, rows):
+        """Returns set of rows along with rows of all bills depending on them"""
+        rows = set(rows)
+        queue = list(rows)
+        while queue:
+            for successor in self.successors.get(queue.pop(), []):
+                if successor not in rows:
+                    rows.add(successor)
+                    queue.append(successor)
+        return rows
+        
+    def update(self, schedule, nodes, bills, rows=None):
+        """Update changed bills and carry changes forward to their successors
+        
+            Changed bills are rebuilt. Successors only reevaluate items having
+            total qty changed in their previous bill.
+        
+            Arguments:
+                schedule: Schedule of data model
+                nodes: datamodel.NodeIndex for looking up billed items
+                bills: List of bills of data model
+                rows: Rows of changed bills, all bills updated if None
+            Returns:
+                Set of rows of updated bills
+        """
+        if self.prev_bills != [bill.data.prev_bill for bill in bills]:
+            self.build(bills)
+        # Schedule values are read afresh on a full update
+        if misc.numpy is not None and (rows is None or self.arrays is None
+                                       or self.arrays.itemnos is not schedule.get_itemnos()):
+            self.arrays = ScheduleArrays(schedule)
+        if rows is None:
+            rows = set(range(len(bills)))
+        successors = self.get_successors(rows)
+        changed = dict()  # Row mapped to item numbers having total qty changed
+        for row in self.order:
+            bill = bills[row]
+            if row in rows:
+                total_qty = bill.item_total_qty
+                bill.update(schedule, nodes, bills, self.arrays)
+                changed[row] = self.get_changed(total_qty, bill.item_total_qty)
+            elif row in successors:
+                changed[row] = bill.update_carried(schedule, changed.get(bill.data.prev_bill, set()))
+        return successors
+        
+    def get_changed(self, total_qty, total_qty_new):
+        """Returns set of itemnos having different total qtys"""
+        if isinstance(total_qty, ItemValues) and isinstance(total_qty_new, ItemValues) \
+           and total_qty.index is total_qty_new.index:
+            positions = misc.numpy.nonzero(total_qty.values != total_qty_new.values)[0]
+            return set(total_qty.itemnos[position] for position in positions)
+        changed = set(itemno for itemno, qty in total_qty_new.items() if total_qty.get(itemno) != qty)
+        return changed | (set(total_qty) - set(total_qty_new))
+
+
 class Bill:
     """Class for storing bill of work"""
     
@@ -93,18 +253,20 @@ class Bill:
         if model is not None:
             self.data.set_model(model)
         # Derived data
-        self.item_cmb_ref = dict()  # cmb references of items b/f
-        self.item_paths = dict()
-        self.item_qty = dict()  # qtys of items b/f
+        self.item_cmb_ref = dict()  # cmb references of items b/f, only for measured items
+        self.item_paths = dict()  # paths of qtys of items b/f, only for measured items
+        self.item_qty = dict()  # qtys of items b/f, only for measured items
         self.item_normal_qty = dict()  # list of excess qty above excess_percentage
         self.item_normal_amount = dict()  # total item amount for qty at normal rate
         self.item_excess_qty = dict()  # qty at excess rate
         self.item_excess_amount = dict()  # amounts for qty at excess rate
+        self.item_total_qty = dict()  # total qtys of items upto this bill
 
         self.prev_bill = None  # prev_bill data object
         self.cmb_ref = set()  # set containing refered cmbs
         self.bill_total_amount = 0  # total amount of work done uptodate
         self.bill_since_prev_amount = 0  # since previous amount of work done
+        self.nodes = None  # Node index of data model for resolving paths of billed items
 
     def clear(self, clear_all = False):
         """Clear bill data
@@ -117,13 +279,14 @@ class Bill:
         if clear_all:
             self.data = BillData(self.data.bill_type)
         # Derived data
-        self.item_cmb_ref = dict()  # cmb references of items b/f
-        self.item_paths = dict()
-        self.item_qty = dict()  # qtys of items b/f
+        self.item_cmb_ref = dict()  # cmb references of items b/f, only for measured items
+        self.item_paths = dict()  # paths of qtys of items b/f, only for measured items
+        self.item_qty = dict()  # qtys of items b/f, only for measured items
         self.item_normal_qty = dict()  # list of excess qty above excess_percentage
         self.item_normal_amount = dict()  # total item amount for qty at normal rate
         self.item_excess_qty = dict()  # qty at excess rate
         self.item_excess_amount = dict()  # amounts for qty at excess rate
+        self.item_total_qty = dict()  # total qtys of items upto this bill
 
         self.prev_bill = None  # prev_bill data object
         self.cmb_ref = set()  # set containing refered cmbs
@@ -139,16 +302,25 @@ class Bill:
         self.data.set_model(model)
     
     def get_billed_items(self):
-        """Return paths to billed items"""
+        """Return ids of billed items"""
         return self.data.mitems
 
-    def update(self, schedule, cmbs, bills):
-        """Update bill data structures from other objects"""
+    def update(self, schedule, nodes, bills, arrays=None):
+        """Update bill data structures from other objects
+        
+            Arguments:
+                schedule: Schedule of data model
+                nodes: datamodel.NodeIndex for looking up billed items
+                bills: List of bills of data model
+                arrays: Optional ScheduleArrays of schedule, items are
+                        evaluated as array operations if given
+        """
         
         # Get required datas
         itemnos = schedule.get_itemnos()
         # Clear all derived structures
         self.clear()
+        self.nodes = nodes
         
         # If bill is a normal bill
         if self.data.bill_type == misc.BILL_NORMAL:
@@ -158,10 +330,8 @@ class Bill:
             else:
                 self.prev_bill = None
             # Initialise bill dictionaries
+            valid_itemnos = arrays.index if arrays is not None and arrays.itemnos is itemnos else set(itemnos)
             for itemno in itemnos:
-                self.item_cmb_ref[itemno] = []
-                self.item_paths[itemno] = []
-                self.item_qty[itemno] = []
                 if itemno not in self.data.item_part_percentage:
                     self.data.item_part_percentage[itemno] = 100
                     self.data.item_excess_part_percentage[itemno] = 100
@@ -169,66 +339,156 @@ class Bill:
 
             # Fill in values from Prev Bill
             if self.prev_bill is not None:
-                for itemno in itemnos:
-                    item_qty = sum(self.prev_bill.item_qty[itemno])
+                prev_qty = self.prev_bill.item_total_qty
+                if isinstance(prev_qty, ItemValues) and prev_qty.itemnos is itemnos:
+                    carried = [(itemno, prev_qty[itemno]) for itemno in prev_qty.get_nonzero()]
+                else:
+                    carried = [(itemno, prev_qty.get(itemno, 0)) for itemno in itemnos]
+                for itemno, item_qty in carried:
                     if item_qty != 0:
-                        self.item_cmb_ref[itemno].append(-1)  # use -1 as marker for prev abstract
-                        self.item_paths[itemno].append([self.data.prev_bill, itemno])
-                        self.item_qty[itemno].append(item_qty)  # add total qty from previous bill
+                        self.item_cmb_ref[itemno] = [-1]  # use -1 as marker for prev abstract
+                        self.item_paths[itemno] = [[self.data.prev_bill, itemno]]
+                        self.item_qty[itemno] = [item_qty]  # add total qty from previous bill
             # Fill in values from measurement items
             for mitem in self.data.mitems:
-                item = cmbs[mitem[0]][mitem[1]][mitem[2]]
+                item = nodes.get(mitem)
                 if not isinstance(item, measurement.MeasurementItemHeading):
+                    cmb_no = nodes.get_path(mitem)[0]
                     for count, (itemno, item_qty) in enumerate(zip(item.itemnos, item.get_total())):
                         # Only add if itemno is valid
-                        if itemno in itemnos:
-                            self.item_cmb_ref[itemno].append(mitem[0])
-                            self.item_paths[itemno].append(mitem + [count])
-                            self.item_qty[itemno].append(item_qty)
+                        if itemno in valid_itemnos:
+                            self.item_cmb_ref.setdefault(itemno, []).append(cmb_no)
+                            self.item_paths.setdefault(itemno, []).append([mitem, count])  # Id of item and index of itemno
+                            self.item_qty.setdefault(itemno, []).append(item_qty)
                         elif itemno is not None:
-                            log.warning('Bill - Item No ' + str([itemno, mitem]) + ' not found, not updating in bill')
+                            log.warning('Bill - Item No ' + str([itemno, nodes.get_path(mitem)]) + ' not found, not updating in bill')
 
             # Evaluate remaining variables from above data
-            for itemno in itemnos:
-                # If item measured, calculate values
-                item = schedule[itemno]
-                # Determine total qty
-                total_qty = sum(self.item_qty[itemno])
-                # Determine items above and at normal rates
-                if total_qty > (item.qty * (1 + 0.01 * item.excess_rate_percent)):
-                    if item.unit.lower() in misc.INT_ITEMS:
-                        self.item_normal_qty[itemno] = math.floor(item.qty * (1 + 0.01 * item.excess_rate_percent))
-                    else:
-                        self.item_normal_qty[itemno] = round(item.qty * (1 + 0.01 * item.excess_rate_percent), 2)
-                    self.item_excess_qty[itemno] = total_qty - self.item_normal_qty[itemno]
-                else:
-                    self.item_normal_qty[itemno] = total_qty
-                    self.item_excess_qty[itemno] = 0
-                # Determine amounts
-                self.item_normal_amount[itemno] = round(
-                    self.item_normal_qty[itemno] * self.data.item_part_percentage[itemno] * 0.01 *
-                    schedule[itemno].rate, 2)
-                self.item_excess_amount[itemno] = round(
-                    self.item_excess_qty[itemno] * self.data.item_excess_part_percentage[itemno] * 0.01 *
-                    self.data.item_excess_rates[itemno], 2)
-                # Update cmbs refered to by the bill
-                self.cmb_ref = self.cmb_ref | set(self.item_cmb_ref[itemno])  # Add any unique cmb (find union)
-
-            # Evaluate total
-            self.bill_total_amount = round(sum(self.item_normal_amount.values()) + sum(self.item_excess_amount.values()), 2)
-            if self.prev_bill is not None:
-                self.bill_since_prev_amount = round(self.bill_total_amount - self.prev_bill.bill_total_amount, 2)
+            if arrays is not None and arrays.itemnos is itemnos:
+                self.evaluate_items(arrays)
             else:
-                self.bill_since_prev_amount = self.bill_total_amount
+                for itemno in itemnos:
+                    self.evaluate_item(schedule, itemno)
+            self.cmb_ref = set().union(*self.item_cmb_ref.values())  # Add any unique cmb (find union)
+            self.evaluate_total()
         
         # If bill is a Custom bill
         elif self.data.bill_type == misc.BILL_CUSTOM:
             self.item_qty = self.data.item_qty
             self.item_normal_amount = self.data.item_normal_amount
             self.item_excess_amount = self.data.item_excess_amount
+            self.item_total_qty = {itemno: sum(item_qty) for itemno, item_qty in self.item_qty.items()}
             self.bill_total_amount = round(sum(self.data.item_normal_amount.values()) + sum(self.data.item_excess_amount.values()), 2)
             self.bill_since_prev_amount = self.bill_total_amount
 
+    def update_carried(self, schedule, itemnos):
+        """Update values of items carried forward from previous bill
+        
+            Arguments:
+                schedule: Schedule of data model
+                itemnos: Item numbers having total qty changed in previous bill
+            Returns:
+                Set of item numbers having total qty changed in this bill
+        """
+        changed = set()
+        if self.data.bill_type == misc.BILL_NORMAL and self.prev_bill is not None:
+            for itemno in itemnos:
+                if itemno not in self.item_total_qty:
+                    continue
+                # Remove carried forward values and add them afresh
+                if self.item_cmb_ref.get(itemno, [None])[0] == -1:
+                    del self.item_cmb_ref[itemno][0]
+                    del self.item_paths[itemno][0]
+                    del self.item_qty[itemno][0]
+                item_qty = self.prev_bill.item_total_qty.get(itemno, 0)
+                if item_qty != 0:
+                    self.item_cmb_ref.setdefault(itemno, []).insert(0, -1)
+                    self.item_paths.setdefault(itemno, []).insert(0, [self.data.prev_bill, itemno])
+                    self.item_qty.setdefault(itemno, []).insert(0, item_qty)
+                elif itemno in self.item_qty and not self.item_qty[itemno]:
+                    del self.item_cmb_ref[itemno]
+                    del self.item_paths[itemno]
+                    del self.item_qty[itemno]
+                total_qty = self.item_total_qty[itemno]
+                self.evaluate_item(schedule, itemno)
+                if self.item_total_qty[itemno] != total_qty:
+                    changed.add(itemno)
+            self.cmb_ref = set().union(*self.item_cmb_ref.values())
+            self.evaluate_total()
+        return changed
+        
+    def evaluate_item(self, schedule, itemno):
+        """Evaluate quantities and amounts of an item from its billed qtys"""
+        item = schedule[itemno]
+        # Determine total qty
+        total_qty = sum(self.item_qty.get(itemno, []))
+        self.item_total_qty[itemno] = total_qty
+        # Determine items above and at normal rates
+        if total_qty > (item.qty * (1 + 0.01 * item.excess_rate_percent)):
+            if item.unit.lower() in misc.INT_ITEMS:
+                self.item_normal_qty[itemno] = math.floor(item.qty * (1 + 0.01 * item.excess_rate_percent))
+            else:
+                self.item_normal_qty[itemno] = round(item.qty * (1 + 0.01 * item.excess_rate_percent), 2)
+            self.item_excess_qty[itemno] = total_qty - self.item_normal_qty[itemno]
+        else:
+            self.item_normal_qty[itemno] = total_qty
+            self.item_excess_qty[itemno] = 0
+        # Determine amounts
+        self.item_normal_amount[itemno] = round(
+            self.item_normal_qty[itemno] * self.data.item_part_percentage[itemno] * 0.01 *
+            item.rate, 2)
+        self.item_excess_amount[itemno] = round(
+            self.item_excess_qty[itemno] * self.data.item_excess_part_percentage[itemno] * 0.01 *
+            self.data.item_excess_rates[itemno], 2)
+            
+    def evaluate_items(self, arrays):
+        """Evaluate quantities and amounts of all items as array operations
+        
+            Gives the same values as evaluate_item for every itemno, held
+            in ItemValues views.
+        
+            Arguments:
+                arrays: ScheduleArrays of schedule
+        """
+        numpy = misc.numpy
+        count = len(arrays.itemnos)
+        # Determine total qty
+        total_qty = numpy.zeros(count)
+        total_integer = numpy.ones(count, 'bool')
+        for itemno, item_qty in self.item_qty.items():
+            if item_qty:
+                total = sum(item_qty)
+                position = arrays.index[itemno]
+                total_qty[position] = total
+                total_integer[position] = isinstance(total, int)
+        # Determine items above and at normal rates
+        limit = arrays.qty * (1 + 0.01 * arrays.excess_rate_percent)
+        excess = total_qty > limit
+        normal_qty = numpy.where(excess, numpy.where(arrays.int_unit, numpy.floor(limit), misc.round_array(limit, 2)), total_qty)
+        normal_integer = numpy.where(excess, arrays.int_unit, total_integer)
+        excess_qty = numpy.where(excess, total_qty - normal_qty, 0)
+        excess_integer = numpy.where(excess, total_integer & arrays.int_unit, True)
+        # Determine amounts
+        normal_amount = misc.round_array(normal_qty * arrays.get_values(self.data.item_part_percentage) * 0.01 *
+                                         arrays.rate, 2)
+        excess_amount = misc.round_array(excess_qty * arrays.get_values(self.data.item_excess_part_percentage) * 0.01 *
+                                         arrays.get_values(self.data.item_excess_rates), 2)
+        self.item_total_qty = ItemValues(arrays, total_qty, total_integer)
+        self.item_normal_qty = ItemValues(arrays, normal_qty, normal_integer)
+        self.item_excess_qty = ItemValues(arrays, excess_qty, excess_integer)
+        self.item_normal_amount = ItemValues(arrays, normal_amount, numpy.zeros(count, 'bool'))
+        self.item_excess_amount = ItemValues(arrays, excess_amount, numpy.zeros(count, 'bool'))
+            
+    def evaluate_total(self):
+        """Evaluate total amount of bill and amount since previous bill"""
+        def get_sum(values):
+            return values.sum() if isinstance(values, ItemValues) else sum(values.values())
+        self.bill_total_amount = round(get_sum(self.item_normal_amount) + get_sum(self.item_excess_amount), 2)
+        if self.prev_bill is not None:
+            self.bill_since_prev_amount = round(self.bill_total_amount - self.prev_bill.bill_total_amount, 2)
+        else:
+            self.bill_since_prev_amount = self.bill_total_amount
+
     def get_latex_buffer(self, thisbillpath, schedule):
         """Return abstract latex buffer"""
         # Main latex buffer
@@ -255,6 +515,11 @@ class Bill:
             bill_local_vars['$cmbbillprevamount$'] = '0'
         bill_local_vars['$cmbbillsinceprevamount$'] = str(self.bill_since_prev_amount)
         
+        # Item templates
+        template_item = misc.get_latex_template(misc.abs_path('latex', 'abstractitem.tex'))
+        template_record = misc.get_latex_template(misc.abs_path('latex', 'abstractitemelement.tex'))
+        latex_items = []  # Rendered items
+        
         # Loop over each item in schedule
         for itemno in itemnos:
             # If item measured, include in bill
@@ -272,7 +537,7 @@ class Bill:
                     excess_flag = '\iffalse'
                 
                 # Include records of each item to bill
-                latex_records = misc.LatexFile()
+                latex_records = []
                 for qty_item, cmb_ref, item_path in zip(qty_items, cmb_refs, item_paths):
                     if qty_item != 0:
                         # Setup variables
@@ -280,7 +545,7 @@ class Bill:
                         item_record_vars['$cmbqtybf$'] = str(qty_item)
                         item_record_vars['$cmbunit$'] = str(item.unit)
                         if cmb_ref != -1:  # if not prev abstract
-                            path_str = str([item_path[0], item_path[1], item_path[2]]) + ':' + str(item_path[3] + 1)
+                            path_str = str(self.nodes.get_path(item_path[0])) + ':' + str(item_path[1] + 1)
                             item_record_vars['$cmbbf$'] = 'ref:meas:' + path_str
                             item_record_vars['$cmblabel$'] = 'ref:abs:' + path_str
                             item_record_vars['$cmbnormalbillflag$'] = 'iftrue'
@@ -294,13 +559,8 @@ class Bill:
                                 item_record_vars['$cmblabel$'] = ''
                                 item_record_vars['$cmbnormalbillflag$'] = 'iffalse'
 
-                        # Read in latex records to buffer
-                        latex_record = misc.LatexFile()
-                        latex_record.add_suffix_from_file(misc.abs_path('latex', 'abstractitemelement.tex'))
-                        # Make item substitutions in buffer
-                        latex_record.replace_and_clean(item_record_vars)
-                        # Add to master buffer
-                        latex_records += latex_record
+                        # Render record template with item substitutions
+                        latex_records.append('\n\n' + template_record.render(item_record_vars))
 
                 # Add all values to substitution dict
                 item_local_vars['$cmbitemno$'] = str(item.itemno)
@@ -321,15 +581,14 @@ class Bill:
                 item_local_vars['$cmbabslabel$'] = 'ref:abs:abs:' + str(thisbillpath + [itemno])
 
                 item_local_vars_vanilla['$cmbexcessflag$'] = excess_flag
-                item_local_vars_vanilla['$cmbrecords$'] = latex_records.latex_buffer
+                item_local_vars_vanilla['$cmbrecords$'] = ''.join(latex_records)
 
-                # Write entries
-                latex_buffer.add_suffix_from_file(misc.abs_path('latex', 'abstractitem.tex')) # Read item template
-                # Make item substitutions
-                latex_buffer.replace_and_clean(item_local_vars)
-                latex_buffer.replace(item_local_vars_vanilla)
+                # Render item template with item substitutions
+                latex_items.append(template_item.render(item_local_vars, item_local_vars_vanilla))
 
-        # Add abstract end latex block
+        # Add items and abstract end latex block
+        if latex_items:
+            latex_buffer += misc.LatexFile('\n'.join(latex_items))
         latex_buffer.add_suffix_from_file(misc.abs_path('latex', 'endabstract.tex'))
         latex_buffer.replace_and_clean(bill_local_vars)
         
@@ -357,6 +616,10 @@ class Bill:
             bill_local_vars['$cmbbillprevamount$'] = '0'
         bill_local_vars['$cmbbillsinceprevamount$'] = str(self.bill_since_prev_amount)
         
+        # Item template
+        template_item = misc.get_latex_template(misc.abs_path('latex', 'billitem.tex'))
+        latex_items = []  # Rendered items
+        
         # Write each item to bill
         for itemno in itemnos:
             # If item measured, include in bill
@@ -404,12 +667,12 @@ class Bill:
 
                 item_local_vars_vanilla['$cmbexcessflag$'] = excess_flag
                 
-                # Write entries
-                latex_buffer.add_suffix_from_file(misc.abs_path('latex', 'billitem.tex')) # read item template
-                # Make item substitutions
-                latex_buffer.replace_and_clean(item_local_vars)
-                latex_buffer.replace(item_local_vars_vanilla)
+                # Render item template with item substitutions
+                latex_items.append(template_item.render(item_local_vars, item_local_vars_vanilla))
 
+        # Add items
+        if latex_items:
+            latex_buffer += misc.LatexFile('\n'.join(latex_items))
         # Read suffix
         latex_buffer.add_suffix_from_file(misc.abs_path('latex', 'endbill.tex'))
         # Make replacements
@@ -443,9 +706,9 @@ class Bill:
             sheet.cell(row=count+2, column=15).value = item.excess_rate_percent
             
             # Fill in values for measured items
-            if item.itemno in self.item_qty:
+            if item.itemno in self.item_total_qty:
                 itemno = item.itemno
-                sheet.cell(row=count+2, column=4).value = sum(self.item_qty[itemno])
+                sheet.cell(row=count+2, column=4).value = self.item_total_qty[itemno]
                 sheet.cell(row=count+2, column=5).value = self.item_normal_qty[itemno]
                 sheet.cell(row=count+2, column=6).value = self.item_excess_qty[itemno]
                 sheet.cell(row=count+2, column=8).value = round(self.data.item_part_percentage[itemno] *
@@ -498,11 +761,11 @@ class Bill:
                 sheet2.cell(row=count+rowend+1, column=4).value = item.unit
                 sheet2.cell(row=count+rowend+1, column=5).value = item.qty
                 # Fill in values for measured items
-                if item.itemno in self.item_qty:
+                if item.itemno in self.item_total_qty:
                     itemno = item.itemno
-                    percent_dev = round((sum(self.item_qty[itemno]) - item.qty)/item.qty*100,2) if item.qty != 0 else 0
-                    sheet2.cell(row=count+rowend+1, column=6).value = sum(self.item_qty[itemno])
-                    sheet2.cell(row=count+rowend+1, column=7).value = sum(self.item_qty[itemno]) - item.qty
+                    percent_dev = round((self.item_total_qty[itemno] - item.qty)/item.qty*100,2) if item.qty != 0 else 0
+                    sheet2.cell(row=count+rowend+1, column=6).value = self.item_total_qty[itemno]
+                    sheet2.cell(row=count+rowend+1, column=7).value = self.item_total_qty[itemno] - item.qty
                     if self.item_normal_qty[itemno]-item.qty > 0:
                         sheet2.cell(row=count+rowend+1, column=9).value = self.item_normal_qty[itemno] - item.qty
                     if self.item_excess_qty[itemno] > 0:
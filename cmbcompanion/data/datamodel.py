@@ -22,11 +22,11 @@
 #  
 #  
 
-import os.path, copy, logging
+import os.path, copy, logging, itertools, collections
 
 # local files import
 from .. import misc, undo
-from undo import undoable
+from ..undo import undoable
 from . import schedule, measurement, bill
 
 # Setup logger object
@@ -43,7 +43,18 @@ class DataModel:
         self.bills = []
         # Derived data
         self.lock_state = LockState()  # Billed/Abstracted states of measurement items
+        self.nodes = NodeIndex(self.cmbs)  # Stable ids of cmbs, measurements and measurement items
+        self.references = ReferenceIndex()  # Bills and abstracts refering measurement items
+        self.bill_engine = bill.BillEngine()  # Evaluation order of bills
+        self.restore_node_ids = None  # Iterator over ids given to nodes added back on undo of a delete
         self.cmb_ref = []  # Array of sets corresponding to cmbs refered to by particular cmb
+        # Dirty tracking for incremental updates
+        self.dirty_all = True  # Force full rebuild on next update
+        self.dirty_paths = set()  # Paths (tuples) of changed cmbs/measurements/measurement items
+        self.dirty_bills = set()  # Rows of changed bills
+        self.check_updates = False  # Verify every incremental update against a full rebuild
+        # Rendering
+        self.render_cache = misc.RenderCache()  # Hashes of inputs of rendered outputs
         
         if data is not None:
             self.schedule.set_model(data[0])
@@ -67,6 +78,15 @@ class DataModel:
             cmb_models.append(cmb.get_model())
         for bill in self.bills:
             bill_models.append(bill.get_model())
+        # References to measurement items are saved as positional paths
+        for cmb_model in cmb_models:
+            for meas_model in cmb_model[1][1]:
+                if meas_model[0] == 'Measurement':
+                    for item_model in meas_model[1][1]:
+                        if item_model[0] == 'MeasurementItemAbstract':
+                            item_model[1][0] = self.nodes.get_paths(item_model[1][0])
+        for bill_model in bill_models:
+            bill_model[1][5] = self.nodes.get_paths(bill_model[1][5])
         return ['DataModel', [schedule_model, cmb_models, bill_models]]
     
     def set_model(self, model):
@@ -84,46 +104,220 @@ class DataModel:
                 bill_item.set_model(bill_model)
                 self.bills.append(bill_item)
             # Update values
+            self.mark_dirty()
             self.update()
     
-    def update(self):
-        """Update derived data values"""
+    def mark_dirty(self, path=None, bill=None):
+        """Record a change in model for the next call to update
         
-        log.info('DataModel - update called')
+            Arguments:
+                path: Path to changed cmb/measurement/measurement item.
+                bill: Row of changed bill.
+                If both are None, a full rebuild is scheduled.
+        """
+        if path is None and bill is None:
+            self.dirty_all = True
+        if path is not None:
+            self.dirty_paths.add(tuple(path))
+        if bill is not None:
+            self.dirty_bills.add(bill)
+            
+    def is_path_dirty(self, path):
+        """Check if path or any of its parents is marked dirty"""
+        for i in range(1, len(path)+1):
+            if tuple(path[0:i]) in self.dirty_paths:
+                return True
+        return False
+        
+    def update(self, full=False):
+        """Update derived data values
+        
+            Arguments:
+                full: Rebuild all derived data irrespective of dirty state
+        """
+        if full or self.dirty_all:
+            self.update_all()
+        elif self.dirty_paths or self.dirty_bills:
+            self.update_dirty()
+            if self.check_updates:
+                self.verify_update()
+        
+    def update_all(self):
+        """Rebuild all derived data values"""
+        
+        log.info('DataModel - update_all called')
 
+        # Index all nodes and resolve references given as paths
+        self.nodes.reset()
+        self.references.clear()
+        for bill in self.bills:
+            self.set_references(bill, self.nodes.get_ids(bill.data.mitems))
+        for path, meas_item in self.get_abstract_items():
+            self.set_references(meas_item, self.nodes.get_ids(meas_item.mitems))
+        
         # Calculate extended descriptions
         self.schedule.update_values()
         
+        # Update 1) dependency tree of cmbs. 2) measurement abstracts
+        self.cmb_ref = []
+        for cmb_no, cmb in enumerate(self.cmbs):
+            self.cmb_ref.append(self.update_cmb(cmb_no))
+        
         # Update all bills
-        for bill in self.bills:
-            bill.update(self.schedule, self.cmbs, self.bills)
+        self.bill_engine.update(self.schedule, self.nodes, self.bills)
         
         # Update locks
-        self.lock_state = LockState()
-        for bill in self.bills:
-            self.lock_state += LockState(bill.get_billed_items())
-        for cmb in self.cmbs:
-            for meas in cmb:
-                if isinstance(meas, measurement.Measurement):
-                    for measitem in meas:
-                        if isinstance(measitem, measurement.MeasurementItemAbstract):
-                            self.lock_state += LockState(measitem.get_abstracted_items())
+        self.update_lock_state()
+            
+        # Clear dirty flags
+        self.dirty_all = False
+        self.dirty_paths.clear()
+        self.dirty_bills.clear()
+            
+    def update_dirty(self):
+        """Update derived data values dependent on dirty paths and bills"""
         
-        # Update 1) dependency tree of cmbs. 2) measurement abstracts
-        self.cmb_ref = []
-        for cmb_no, cmb in enumerate(self.cmbs):
-            ref = set()
-            for meas_no, meas in enumerate(cmb.items):
+        log.info('DataModel - update_dirty called - ' + str([sorted(self.dirty_paths), sorted(self.dirty_bills)]))
+        
+        cmbs_changed = set([path[0] for path in self.dirty_paths])
+        
+        # Bills and abstracts refering dirty items
+        dirty_ids = []
+        for path in self.dirty_paths:
+            node = self.nodes.get_node(path)
+            if node is not None:
+                dirty_ids += [child.node_id for child in self.nodes.walk(node)]
+        referrers = self.references.get_referrers(dirty_ids)
+        
+        # Update abstracts refering dirty items or being dirty themselves
+        for path, meas_item in self.get_abstract_items():
+            if meas_item in referrers or self.is_path_dirty(path):
+                meas_item.update(self.nodes, list(path))
+                # Abstract values changed, so mark dependents dirty
+                self.dirty_paths.add(path)
+                referrers |= self.references.get_referrers([meas_item.node_id])
+                cmbs_changed.add(path[0])
+                
+        # Update dependency tree of cmbs having changed abstracts
+        for cmb_no in cmbs_changed:
+            if cmb_no < len(self.cmb_ref):
+                self.cmb_ref[cmb_no] = self.update_cmb(cmb_no, update_abstracts=False)
+        
+        # Update bills refering dirty items and their successors
+        bills_changed = set(self.dirty_bills)
+        for row, bill in enumerate(self.bills):
+            if bill in referrers:
+                bills_changed.add(row)
+        self.bill_engine.update(self.schedule, self.nodes, self.bills, bills_changed)
+                
+        # Update locks, rebuilding them if positions of items might have changed
+        if any(len(path) < 3 for path in self.dirty_paths):
+            self.update_lock_state()
+        else:
+            for node_id in self.references.pop_changed():
+                if self.nodes.get(node_id) is not None:
+                    self.lock_state[self.nodes.get_path(node_id)] = self.references.is_refered(node_id)
+            
+        # Clear dirty flags
+        self.dirty_paths.clear()
+        self.dirty_bills.clear()
+        
+    def update_positions(self, path):
+        """Update positional data after insertion of a node at path
+        
+            Nodes following the node move down by one. Bills and abstracts
+            refer to items by id, so their values are unchanged; abstracts
+            refering moved items only update paths shown, and lock states of
+            moved items are moved.
+        """
+        container = self.nodes.get_node(path[:-1])
+        moved = [child.node_id for node in container.items[path[-1]+1:] for child in self.nodes.walk(node)]
+        # Move lock states
+        level = len(path) - 1
+        paths = [self.nodes.get_path(node_id) for node_id in moved if self.references.is_refered(node_id)]
+        for new_path in paths:
+            self.lock_state.discard(new_path[:level] + [new_path[level] - 1] + new_path[level+1:])
+        for new_path in paths:
+            self.lock_state.add(new_path)
+        # Update paths shown in abstracts
+        for referrer in self.references.get_referrers(moved):
+            if isinstance(referrer, measurement.MeasurementItemAbstract):
+                referrer.update_paths(self.nodes)
+        
+    def update_lock_state(self):
+        """Rebuild lock states of measurement items from bills and abstracts"""
+        self.lock_state = LockState(self.nodes.get_paths(self.references.get_refered()))
+        self.references.pop_changed()
+            
+    def update_cmb(self, cmb_no, update_abstracts=True):
+        """Update abstracts of a cmb and return set of cmbs refered by it"""
+        ref = set()
+        for path, meas_item in self.get_abstract_items([cmb_no]):
+            # Update MeasurementItemAbstract
+            if update_abstracts:
+                meas_item.update(self.nodes, list(path))
+            # Update Dependency
+            for mitem in meas_item.mitems:
+                mitem_cmb_no = self.nodes.get_path(mitem)[0]
+                if mitem_cmb_no != cmb_no:
+                    ref.add(mitem_cmb_no)
+        return ref
+        
+    def get_abstract_items(self, cmb_nos=None):
+        """Iterate over (path, item) of all MeasurementItemAbstract in selected cmbs"""
+        if cmb_nos is None:
+            cmb_nos = range(len(self.cmbs))
+        for cmb_no in cmb_nos:
+            for meas_no, meas in enumerate(self.cmbs[cmb_no].items):
                 if isinstance(meas, measurement.Measurement):
-                    for meas_item_nos, meas_item in enumerate(meas.items):
+                    for meas_item_no, meas_item in enumerate(meas.items):
                         if isinstance(meas_item, measurement.MeasurementItemAbstract):
-                            # Update MeasurementItemAbstract
-                            meas_item.update(self.cmbs, [cmb_no, meas_no, meas_item_nos])
-                            # Update Dependency
-                            for mitem in meas_item.mitems:
-                                if mitem[0] != cmb_no:
-                                    ref |= set([mitem[0]])
-            self.cmb_ref.append(ref)
+                            yield (cmb_no, meas_no, meas_item_no), meas_item
+                            
+    def get_derived_state(self):
+        """Return a comparable snapshot of derived data (used for verifying updates)"""
+        bills_state = []
+        for bill in self.bills:
+            bills_state.append([bill.item_qty, bill.item_paths, bill.item_normal_amount,
+                                bill.item_excess_amount, bill.bill_total_amount,
+                                bill.bill_since_prev_amount, bill.cmb_ref])
+        abstracts_state = []
+        for path, meas_item in self.get_abstract_items():
+            abstracts_state.append([path, [record.get_model() for record in meas_item.records]])
+        return copy.deepcopy([bills_state, abstracts_state, sorted(self.lock_state.get_paths()), self.cmb_ref])
+        
+    def verify_references(self):
+        """Compare reference index with a full scan of bills and abstracts
+        
+            Returns:
+                True if reference index is consistent, else False
+        """
+        refered = dict()
+        for bill in self.bills:
+            refered[bill] = bill.data.mitems
+        for path, meas_item in self.get_abstract_items():
+            refered[meas_item] = meas_item.mitems
+        if not self.references.verify(refered):
+            log.error('DataModel - verify_references - Reference index mismatch')
+            return False
+        return True
+        
+    def verify_update(self):
+        """Compare derived data with a full rebuild
+        
+            Returns:
+                True if incremental state matches full rebuild, else False
+        """
+        if not self.verify_references():
+            return False
+        state = self.get_derived_state()
+        self.update_all()
+        state_full = self.get_derived_state()
+        for name, value, value_full in zip(['bills', 'abstracts', 'locks', 'cmb_ref'], state, state_full):
+            if value != value_full:
+                log.error('DataModel - verify_update - Incremental update mismatch in ' + name)
+                return False
+        return True
             
     def get_lock_states(self):
         """Return underlying LockState object for App"""
@@ -150,125 +344,74 @@ class DataModel:
             nullmodel = item.get_model()
             return ['MeasurementItemCustom', schmod + nullmodel[1][4:6]]
     
-    def update_static_paths(self, path, add_flag = True):
-        """Updates static paths in bills and AbstractMeasurement on change in measurements model
+    def register_node(self, path):
+        """Add node at path and its children to node index, resolving references given as paths"""
+        node = self.nodes.get_node(path)
+        if self.nodes.get(getattr(node, 'node_id', None)) is not node:
+            self.nodes.register(node, self.nodes.get_id(path[:-1]), self.restore_node_ids)
+        for child in self.nodes.walk(node):
+            if isinstance(child, measurement.MeasurementItemAbstract):
+                self.set_references(child, self.nodes.get_ids(child.mitems))
+        return node
+        
+    def unregister_node(self, node):
+        """Remove node and its children from node index and drop references held by them"""
+        for child in self.nodes.walk(node):
+            if isinstance(child, measurement.MeasurementItemAbstract):
+                self.references.discard(child)
+        self.nodes.unregister(node)
+        
+    def set_references(self, referrer, mitems):
+        """Set items refered by a bill or abstract item, updating reference index
         
             Arguments:
-                path: Path to item being added/deleted
-                add_flag: True for additions, False for deletions
+                referrer: Bill or MeasurementItemAbstract
+                mitems: Ids of refered measurement items
         """
-        log.info('DataModel - update_static_paths - ' + str([path, add_flag]))
-        # Initialise replacement dictionary
-        mod_dict = dict()
-        # Paths to be deleted
-        del_path = []
-        # Saved values for reversal
-        bill_mitems_old = []
-        bill_paths_old = []
-        abs_mitems_old = []
-        abs_paths_old = []
-        # Increment path by 1 for add and decrement by 1 for remove
-        increment = 1 if add_flag else -1
-        
-        # CMB added/removed
-        if len(path) == 1:
-            for p1, cmb in enumerate(self.cmbs[path[0]:], path[0]):
-                for p2, meas in enumerate(self.cmbs[p1].items):
-                    if isinstance(self.cmbs[p1][p2], measurement.Measurement):
-                        for p3, meas_item in enumerate(self.cmbs[p1][p2].items):
-                            # Update items to be deleted
-                            if [p1] == path and not add_flag:
-                                del_path.append([p1,p2,p3])
-                            # Update items to be changed
-                            else:
-                                mod_dict[(p1,p2,p3)] = (p1+increment,p2,p3)
-                    mod_dict[(p1,p2)] = (p1+increment,p2)
-                mod_dict[tuple([p1])] = tuple([p1+increment])
-        # Measurement added/removed
-        elif len(path) == 2:
-            p1 = path[0]
-            for p2, meas in enumerate(self.cmbs[p1].items[path[1]:], path[1]):
-                if isinstance(self.cmbs[p1][p2], measurement.Measurement):
-                    for p3, meas_item in enumerate(self.cmbs[p1][p2].items):
-                        # Update items to be deleted
-                        if [p1,p2] == path and not add_flag:
-                            del_path.append([p1,p2,p3])
-                        # Update items to be changed
-                        else:
-                            mod_dict[(p1,p2,p3)] = (p1,p2+increment,p3)
-                mod_dict[(p1,p2)] = (p1,p2+increment)
-        # Measurement item added/removed
-        elif len(path) == 3:
-            p1 = path[0]
-            p2 = path[1]
-            for p3, meas_item in enumerate(self.cmbs[p1][p2].items[path[2]:], path[2]):
-                # Update items to be deleted
-                if [p1,p2,p3] == path  and not add_flag:
-                    del_path.append([p1,p2,p3])
-                # Update items to be changed
-                else:
-                    mod_dict[(p1,p2,p3)] = (p1,p2,p3+increment)
+        if isinstance(referrer, bill.Bill):
+            referrer.data.mitems = mitems
+        else:
+            referrer.mitems = mitems
+        self.references.set(referrer, mitems)
+        
+    def remove_references(self, node_ids):
+        """Remove references to nodes from bills and abstracts
         
-        # Make replacements in bill
+            Arguments:
+                node_ids: Ids of nodes being deleted
+            Returns:
+                Removed references for restore_references
+        """
+        log.info('DataModel - remove_references - ' + str(node_ids))
+        removed = set(node_ids)
+        bills_old = []
+        abstracts_old = []
+        referrers = self.references.get_referrers(node_ids)
         for row, bill in enumerate(self.bills):
-            changed = False
-            mitem_copy = copy.deepcopy(bill.data.mitems)
-            # If remove flag, remove path from bill 
-            if not add_flag:
-                for mitem in mitem_copy:
-                    if mitem in del_path:
-                        bill.data.mitems.remove(mitem)
-                        changed = True
-            for index, item in enumerate(bill.data.mitems):
-                if tuple(item) in mod_dict:
-                    bill.data.mitems[index] = list(mod_dict[tuple(item)])
-                    changed = True
-
-            # If bill changed
-            if changed:
-                bill_mitems_old.append(mitem_copy)
-                bill_paths_old.append(row)
-                
-        # Make replacements in abstract measurements
-        for p1, cmb in enumerate(self.cmbs):
-            for p2, meas in enumerate(self.cmbs[p1].items):
-                if isinstance(self.cmbs[p1][p2], measurement.Measurement):
-                    for p3, meas_item in enumerate(self.cmbs[p1][p2].items):
-                        if isinstance(meas_item, measurement.MeasurementItemAbstract):
-                            changed = False
-                            mitem_copy = copy.deepcopy(meas_item.mitems)
-                            # If remove flag, remove path from bill 
-                            if not add_flag: 
-                                for mitem in mitem_copy:
-                                    if mitem in del_path:
-                                        meas_item.mitems.remove(mitem)
-                                        changed = True
-                            for index, item in enumerate(meas_item.mitems):
-                                if tuple(item) in mod_dict:
-                                    meas_item.mitems[index] = list(mod_dict[tuple(item)])
-                                    changed = True
-                            # If abstract changed
-                            if changed:
-                                abs_mitems_old.append(mitem_copy)
-                                abs_paths_old.append([p1,p2,p3])
-        return [bill_paths_old, bill_mitems_old, abs_paths_old, abs_mitems_old]
-        
-    def replace_static_paths(self, data=None):
-        """Function reverses effect of update_static_paths"""
-        log.info('DataModel - replace_static_paths')
-        log.debug('DataModel - replace_static_paths - \n' + str(data))
+            if bill in referrers:
+                bills_old.append((row, bill.data.mitems))
+                self.set_references(bill, [mitem for mitem in bill.data.mitems if mitem not in removed])
+                self.mark_dirty(bill=row)
+        for meas_item in referrers:
+            if isinstance(meas_item, measurement.MeasurementItemAbstract) and meas_item.node_id not in removed:
+                abstracts_old.append((meas_item.node_id, meas_item.mitems))
+                self.set_references(meas_item, [mitem for mitem in meas_item.mitems if mitem not in removed])
+                self.mark_dirty(self.nodes.get_path(meas_item.node_id))
+        return [bills_old, abstracts_old]
+        
+    def restore_references(self, data=None):
+        """Function reverses effect of remove_references"""
+        log.info('DataModel - restore_references')
         if data is not None:
-            bill_paths_old = data[0]
-            bill_mitems_old = data[1]
-            abs_paths_old = data[2]
-            abs_mitems_old = data[3]
-            
-            # Make replacements in bill
-            for billno, mitems in zip(bill_paths_old, bill_mitems_old):
-                self.bills[billno].data.mitems = mitems
-            # Make replacements in abstract
-            for abspath, mitems in zip(abs_paths_old, abs_mitems_old):
-                self.cmbs[abspath[0]][abspath[1]][abspath[2]].mitems = mitems
+            bills_old, abstracts_old = data
+            for row, mitems in bills_old:
+                self.set_references(self.bills[row], mitems)
+                self.mark_dirty(bill=row)
+            for node_id, mitems in abstracts_old:
+                meas_item = self.nodes.get(node_id)
+                if meas_item is not None:
+                    self.set_references(meas_item, mitems)
+                    self.mark_dirty(self.nodes.get_path(node_id))
     
     @undoable
     def add_cmb_at_node(self, cmb_model, row):
@@ -278,14 +421,13 @@ class DataModel:
         if cmb_model[0] == 'CMB':
             cmb = measurement.Cmb(cmb_model[1])
             if row != None:
-                # Update static paths
-                self.update_static_paths([row])
-                
                 self.cmbs.insert(row,cmb)
                 row_delete = row
             else:
                 self.cmbs.append(cmb)
                 row_delete = len(self.cmbs) - 1
+            self.register_node([row_delete])
+            self.mark_dirty()
             self.update()
         else:
             log.warning('add_cmb_at_node - Wrong model loaded')
@@ -310,9 +452,6 @@ class DataModel:
         delete_path = None
         if path != None:
             if len(path) > 1: # If a measurement selected
-                # Update static paths
-                self.update_static_paths(path)
-                
                 self.cmbs[path[0]].insert_item(path[1],meas)
                 delete_path = [path[0],path[1]]
             else: # Append to selected Cmb
@@ -322,6 +461,13 @@ class DataModel:
             if len(self.cmbs) != 0:
                 self.cmbs[-1].append_item(meas)
                 delete_path = [len(self.cmbs)-1,self.cmbs[-1].length()-1]
+        if delete_path is not None:
+            self.register_node(delete_path)
+            self.update_positions(delete_path)
+            # Only items of new measurement need evaluation
+            if isinstance(meas, measurement.Measurement):
+                for count in range(meas.length()):
+                    self.mark_dirty(delete_path + [count])
         self.update()
 
         yield "Add Measurement at '{}'".format(path)
@@ -346,9 +492,6 @@ class DataModel:
             
         if path != None:
             if len(path) > 2: # if a measurement item selected
-                # Update static paths
-                self.update_static_paths(path)
-                
                 self.cmbs[path[0]][path[1]].insert_item(path[2],item)
                 delete_path = [path[0],path[1],path[2]]
             elif len(path) > 1: # if measurement group selected
@@ -367,6 +510,10 @@ class DataModel:
                     if isinstance(self.cmbs[-1][-1], measurement.Measurement):
                         self.cmbs[-1][-1].append_item(item)
                         delete_path = [len(self.cmbs)-1,self.cmbs[-1].length()-1,self.cmbs[-1][-1].length()-1]
+        if delete_path is not None:
+            self.register_node(delete_path)
+            self.update_positions(delete_path)
+            self.mark_dirty(delete_path)
         self.update()
         
         yield "Add Measurement item at '{}'".format(path)
@@ -391,6 +538,8 @@ class DataModel:
                     item.set_remark(newval)
                 else:
                     item.set_model(newval)
+                    self.register_node(path)
+            self.mark_dirty(path)
             self.update()
         
         yield "Edit measurement items at '{}'".format(path)
@@ -408,6 +557,8 @@ class DataModel:
                     item.set_remark(oldval)
                 else:
                     item.set_model(oldval)
+                    self.register_node(path)
+            self.mark_dirty(path)
             self.update()
         
     @undoable
@@ -415,8 +566,11 @@ class DataModel:
         """Undoable function for deleting a measurement item from model"""
         log.info('DataModel - delete_row_meas - ' + str(path))
         item = None
-        # Update static paths
-        static_paths_old = self.update_static_paths(path, False)
+        # Remove references to deleted nodes
+        node = self.nodes.get_node(path)
+        node_ids = [child.node_id for child in self.nodes.walk(node)]
+        references_old = self.remove_references(node_ids)
+        self.unregister_node(node)
 
         if len(path) == 1:
             item = self.cmbs[path[0]].get_model()
@@ -427,22 +581,33 @@ class DataModel:
         elif len(path) == 3:
             item = self.cmbs[path[0]][path[1]][path[2]].get_model()
             self.cmbs[path[0]][path[1]].remove_item(path[2])
+        # Removal of a cmb shifts cmb references, so rebuild all
+        if len(path) == 1:
+            self.mark_dirty()
+        else:
+            self.mark_dirty(path[0:1])
         self.update()
         
         yield "Delete measurement items at '{}'".format(path)
-        # Undo action
-        if len(path) == 1:
-            self.add_cmb_at_node(item,path[0])
-        elif len(path) == 2:
-            self.add_measurement_at_node(item,path)
-        elif len(path) == 3:
-            self.add_measurement_item_at_node(item,path)
-        # Replace static paths lost on delete
-        self.replace_static_paths(static_paths_old)
+        # Undo action, nodes are added back with their old ids so that
+        # references held by abstracts within them remain valid
+        self.restore_node_ids = iter(node_ids)
+        try:
+            if len(path) == 1:
+                self.add_cmb_at_node(item,path[0])
+            elif len(path) == 2:
+                self.add_measurement_at_node(item,path)
+            elif len(path) == 3:
+                self.add_measurement_item_at_node(item,path)
+        finally:
+            self.restore_node_ids = None
+        # Restore references lost on delete
+        self.restore_references(references_old)
         
+        self.mark_dirty()
         self.update()
         
-    def render_cmb(self, folder, replacement_dict, path, recursive = True):
+    def render_cmb(self, folder, replacement_dict, path, recursive = True, monitor = None):
         """Render CMB
             
             Arguments:
@@ -450,13 +615,115 @@ class DataModel:
                 replacement_dict: Replacement dictionary for global values
                 path: Path of CMB to be rendered
                 recursive: Flag to select rendering of dependent items
+                monitor: Optional misc.RenderMonitor for progress and cancellation
         """
         log.info('DataModel - render_cmb - ' + str([path, recursive]))
         # Build all data structures
         self.update()
         
+        # Select documents to be rendered
+        cmb_nos = [path[0]]
+        bill_nos = []
+        if recursive: # if recursive call
+            # Render all cmbs and bills refering cmb
+            cmb_nos += [count for count in range(len(self.cmbs)) if path[0] in self.cmb_ref[count] and count != path[0]]
+            bill_nos += [count for count, bill in enumerate(self.bills) if path[0] in bill.cmb_ref]
+        
+        # Run latex on documents
+        code = self.render_documents(folder, replacement_dict, cmb_nos, bill_nos, monitor)
+        if code[0] == misc.CMB_ERROR:
+            return code
+        
+        # Write spreadsheet outputs
+        for cmb_no in cmb_nos:
+            if monitor is not None:
+                if monitor.cancelled:
+                    return (misc.CMB_ERROR, 'Rendering cancelled')
+                monitor.progress('Writing spreadsheet of CMB No.' + self.cmbs[cmb_no].get_name())
+            filename = self.render_cmb_spreadsheet(folder, cmb_no)
+            if monitor is not None:
+                monitor.add_output(filename)
+        
+        # Return status code for main application interface
+        return (misc.CMB_INFO,'CMB No.' + self.cmbs[path[0]].get_name() + ' rendered successfully')
+        
+    def render_documents(self, folder, replacement_dict, cmb_nos, bill_nos, monitor=None):
+        """Write latex documents of cmbs and bills and run latex on them
+        
+            Documents with unchanged latex buffer, replacements and refered .aux
+            files are not written and run again unless a document refered changes.
+        
+            Arguments:
+                folder: Output folder
+                replacement_dict: Replacement dictionary for global values
+                cmb_nos: Indices of cmbs to be rendered
+                bill_nos: Indices of bills to be rendered, custom bills are skipped
+                monitor: Optional misc.RenderMonitor for progress and cancellation
+        """
+        folder = misc.posix_path(folder)
+        scheduler = misc.LatexScheduler(folder, monitor=monitor)
+        messages = dict()  # Error messages of documents
+        documents = []  # Filename, filenames refered, latex buffer and stage of documents
+        # CMBs are run before bills, abstracts in turn after their previous bill
+        for cmb_no in cmb_nos:
+            filename, depends, latex_buffer = self.get_cmb_latex(folder, replacement_dict, cmb_no)
+            documents.append((filename, depends, latex_buffer, 0))
+            messages[filename] = 'Rendering of CMB No.' + self.cmbs[cmb_no].get_name() + ' failed'
+        for bill_no in bill_nos:
+            if self.bills[bill_no].data.bill_type == misc.BILL_NORMAL:
+                filename, depends, latex_buffer, filename_bill, latex_buffer_bill = self.get_bill_latex(folder, replacement_dict, bill_no)
+                documents.append((filename, depends, latex_buffer, 1))
+                documents.append((filename_bill, [], latex_buffer_bill, 1))
+                messages[filename] = 'Rendering of Bill: ' + self.bills[bill_no].data.title + ' failed'
+                messages[filename_bill] = 'Rendering of Bill Schedule: ' + self.bills[bill_no].data.title + ' failed'
+        
+        # Write changed documents
+        replacements = sorted(replacement_dict.items())
+        for filename, depends, latex_buffer, stage in documents:
+            key = self.render_cache.make_key(latex_buffer.get_buffer(), replacements, 
+                                             [scheduler.read_aux(depend) for depend in depends])
+            output = os.path.splitext(filename)[0] + '.pdf'
+            if self.render_cache.check(folder, filename, key, [output]):
+                scheduler.add_job(filename, depends, clean=True, stage=stage)
+            else:
+                latex_buffer.write(filename)
+                scheduler.add_job(filename, depends, stage=stage)
+        log.info('DataModel - render_documents - Render cache - ' + str(self.render_cache.get_statistics()))
+        
+        # Run latex
+        if monitor is not None:
+            monitor.progress('Running latex on ' + str(len(documents)) + ' documents')
+        code, filename = scheduler.run()
+        if code == misc.CMB_ERROR:
+            self.render_cache.invalidate(folder, filename)
+            self.render_cache.save(folder)
+            if monitor is not None and monitor.cancelled:
+                return (misc.CMB_ERROR, 'Rendering cancelled')
+            return (misc.CMB_ERROR, messages[filename])
+        
+        # Store hashes of documents with final .aux files
+        for filename, depends, latex_buffer, stage in documents:
+            key = self.render_cache.make_key(latex_buffer.get_buffer(), replacements, 
+                                             [scheduler.read_aux(depend) for depend in depends])
+            self.render_cache.update(folder, filename, key)
+            if monitor is not None:
+                monitor.add_output(os.path.splitext(filename)[0] + '.pdf')
+        self.render_cache.save(folder)
+        return (misc.CMB_OK, None)
+        
+    def get_cmb_latex(self, folder, replacement_dict, cmb_no):
+        """Get latex document of CMB
+        
+            Arguments:
+                folder: Output folder
+                replacement_dict: Replacement dictionary for global values
+                cmb_no: Index of CMB
+            Returns:
+                Filename of document, list of filenames of documents refered
+                and latex buffer
+        """
         # Fill in latex buffer
-        latex_buffer = self.cmbs[path[0]].get_latex_buffer([path[0]], self.schedule)
+        latex_buffer = self.cmbs[cmb_no].get_latex_buffer([cmb_no], self.schedule)
 
         # Make global variables replacements
         latex_buffer.replace_and_clean(replacement_dict)
@@ -464,66 +731,41 @@ class DataModel:
         # Include linked cmbs and bills
         replacement_dict_external_docs = {}
         external_docs = ''
+        depends = []
         # Include cmbs
         for count,cmb in enumerate(self.cmbs):
-            if path[0] in self.cmb_ref[count]:
+            if cmb_no in self.cmb_ref[count]:
                 external_docs += '\externaldocument{cmb_' + str(count+1) + '}\n'
+                depends.append(misc.posix_path(folder,'cmb_' + str(count+1) + '.tex'))
         # Include bills
         for count,bill in enumerate(self.bills):
-            if path[0] in bill.cmb_ref:
+            if cmb_no in bill.cmb_ref:
                 external_docs += '\externaldocument{abs_' + str(count+1) + '}\n'
+                depends.append(misc.posix_path(folder,'abs_' + str(count+1) + '.tex'))
         replacement_dict_external_docs['$cmbexternaldocs$'] = external_docs
         latex_buffer.replace(replacement_dict_external_docs)
 
-        # Write output
-        filename = misc.posix_path(folder,'cmb_' + str(path[0]+1) + '.tex')
-        latex_buffer.write(filename)
-
-        # Run latex on files and dependencies
+        # Output filename
+        filename = misc.posix_path(folder,'cmb_' + str(cmb_no+1) + '.tex')
+        return (filename, depends, latex_buffer)
         
-        # Run on all cmbs refered by cmb
-        if recursive: # if recursive call
-            for cmb_count, cmb in enumerate(self.cmbs):
-                if path[0] in self.cmb_ref[cmb_count]:
-                    code = self.render_cmb(folder, replacement_dict, [cmb_count],False)
-                    if code[0] == misc.CMB_ERROR:
-                        return code
-        # Run on all bills refering cmb
-        if recursive: # if recursive call
-            for bill_count,bill in enumerate(self.bills):
-                if path[0] in bill.cmb_ref:
-                    code = self.render_bill(folder, replacement_dict, [bill_count], False)
-                    if code[0] == misc.CMB_ERROR:
-                        return code
-                        
-        # Run latex on file
-        code = misc.run_latex(misc.posix_path(folder), filename)
-        if code == misc.CMB_ERROR:
-            return (misc.CMB_ERROR,'Rendering of CMB No.' + self.cmbs[path[0]].get_name() + ' failed')
-
-        # Run on all cmbs and bills refering cmb again to rebuild indexes on recursive run
-        # Run on all cmbs refered by cmb
-        if recursive: # if recursive call
-            for cmb_count, cmb in enumerate(self.cmbs):
-                if path[0] in self.cmb_ref[cmb_count]:
-                    code = self.render_cmb(folder, replacement_dict, [cmb_count],False)
-                    if code[0] == misc.CMB_ERROR:
-                        return code
-        # Run on all bills refering cmb
-        if recursive: # if recursive call
-            for bill_count,bill in enumerate(self.bills):
-                if path[0] in bill.cmb_ref:
-                    code = self.render_bill(folder, replacement_dict, [bill_count], False)
-                    if code[0] == misc.CMB_ERROR:
-                        return code
-        
-        # Get spreadsheet buffer
-        spreadsheet = self.cmbs[path[0]].get_spreadsheet_buffer([path[0]], self.schedule)
-        filename = misc.posix_path(folder,'cmb_' + str(path[0]+1) + '.xlsx')
+    def render_cmb_spreadsheet(self, folder, cmb_no):
+        """Write spreadsheet of CMB if its generated content changed since last render, returns filename"""
+        folder = misc.posix_path(folder)
+        filename = misc.posix_path(folder,'cmb_' + str(cmb_no+1) + '.xlsx')
+        cmb = self.cmbs[cmb_no]
+        # Key from generated rows, covering abstracts of items elsewhere
+        rows = list(cmb.get_spreadsheet_rows([cmb_no], self.schedule))
+        key = self.render_cache.make_key(cmb.get_spreadsheet_heading([cmb_no]), rows)
+        if self.render_cache.check(folder, filename, key, [filename]):
+            return filename
+        # Stream spreadsheet to file
+        spreadsheet = misc.StreamingSpreadsheet()
+        cmb.get_spreadsheet_buffer([cmb_no], self.schedule, spreadsheet, rows)
         spreadsheet.save(filename)
-        
-        # Return status code for main application interface
-        return (misc.CMB_INFO,'CMB No.' + self.cmbs[path[0]].get_name() + ' rendered successfully')
+        self.render_cache.update(folder, filename, key)
+        self.render_cache.save(folder)
+        return filename
     
     # Bill methods
     
@@ -532,17 +774,20 @@ class DataModel:
         """Undoable function for adding a bill to model"""
         log.info('DataModel - insert_bill_at_row - ' + str(row))
         item = bill.Bill(data_model)
+        self.set_references(item, self.nodes.get_ids(item.data.mitems))
         if row is not None:
             new_row = row
             self.bills.insert(row, item)
         else:
             self.bills.append(item)
             new_row = len(self.bills) - 1
+        self.mark_dirty()
         self.update()
 
         yield "Insert data items to bill at row '{}'".format(new_row)
         # Undo action
         self.delete_bill(new_row)
+        self.mark_dirty()
         self.update()
         
     @undoable
@@ -552,12 +797,16 @@ class DataModel:
         if row is not None:
             old_data = copy.deepcopy(self.bills[row].get_model())
             self.bills[row].set_model(data_model)
+            self.set_references(self.bills[row], self.nodes.get_ids(self.bills[row].data.mitems))
+            self.mark_dirty(bill=row)
         self.update()
 
         yield "Edit bill item at row '{}'".format(row)
         # Undo action
         if row is not None:
             self.bills[row].set_model(old_data)
+            self.set_references(self.bills[row], self.nodes.get_ids(self.bills[row].data.mitems))
+            self.mark_dirty(bill=row)
         self.update()
     
     @undoable
@@ -565,15 +814,18 @@ class DataModel:
         """Undoable function for deleting a bill from model"""
         log.info('DataModel - delete_bill - ' + str(row))
         data_model = self.bills[row].get_model()
+        self.references.discard(self.bills[row])
         del self.bills[row]
+        self.mark_dirty()
         self.update()
 
         yield "Delete data items from bill at row '{}'".format(row)
         # Undo action
         self.insert_bill_at_row(data_model, row)
+        self.mark_dirty()
         self.update()
         
-    def render_bill(self, folder, replacement_dict, path, recursive=True):
+    def render_bill(self, folder, replacement_dict, path, recursive=True, monitor=None):
         """Render bill to file
             
             Arguments:
@@ -581,6 +833,7 @@ class DataModel:
                 replacement_dict: Replacement dictionary for global values
                 path: Path of Bill to be rendered
                 recursive: Flag to select rendering of dependent items
+                monitor: Optional misc.RenderMonitor for progress and cancellation
         """
         log.info('DataModel - render_bill - ' + str([path, recursive]))
                 
@@ -591,155 +844,338 @@ class DataModel:
         if self.bills[path[0]].data.bill_type == misc.BILL_NORMAL:
             bill = self.bills[path[0]]
             
-            # Fill in latex buffer
-            latex_buffer = bill.get_latex_buffer([path[0]], self.schedule)
-            latex_buffer_bill = bill.get_latex_buffer_bill(self.schedule)
-            # Make global variables replacements
-            latex_buffer.replace_and_clean(replacement_dict)
-            latex_buffer_bill.replace_and_clean(replacement_dict)
-            
-            # Include linked cmbs
-            cmb_refs = bill.cmb_ref.copy()
-            replacement_dict_cmbs = {}
-            external_docs = ''
-            # Add all cmbs depending on cmbs billed to include abstracted items
-            for count in bill.cmb_ref:
-                cmb_refs |= self.cmb_ref[count]
-            for cmbpath in cmb_refs:
-                if cmbpath != -1:
-                    external_docs += '\externaldocument{cmb_' + str(cmbpath + 1) + '}\n'
-                elif bill.data.prev_bill is not None: # prev abstract
-                    external_docs += '\externaldocument{abs_' + str(bill.data.prev_bill + 1) + '}\n'
-            replacement_dict_cmbs['$cmbexternaldocs$'] = external_docs
-            latex_buffer.replace(replacement_dict_cmbs)
-
-            # Write output
-            filename = misc.posix_path(folder, 'abs_' + str(path[0] + 1) + '.tex')
-            latex_buffer.write(filename)
-            filename_bill = misc.posix_path(folder, 'bill_' + str(path[0] + 1) + '.tex')
-            latex_buffer_bill.write(filename_bill)
-
-            # run latex on file and dependencies
+            # Select documents to be rendered
+            cmb_nos = []
+            bill_nos = [path[0]]
             if recursive:  # if recursive call
                 # Render all cmbs depending on the bill
-                for cmb_ref in cmb_refs:
-                    if cmb_ref is not -1:  # if not prev bill
-                        code = self.render_cmb(folder, replacement_dict, [cmb_ref], False)
-                        if code[0] == misc.CMB_ERROR:
-                            return code
+                cmb_nos = sorted(cmb_ref for cmb_ref in self.get_bill_cmb_refs(path[0]) if cmb_ref != -1)
                 # Render prev bill
                 if bill.prev_bill is not None and bill.prev_bill.data.bill_type == misc.BILL_NORMAL:
-                    code = self.render_bill(folder, replacement_dict, [bill.data.prev_bill], False)
-                    if code[0] == misc.CMB_ERROR:
-                        return code
+                    bill_nos.append(bill.data.prev_bill)
+                    
+            # Run latex on documents
+            code = self.render_documents(folder, replacement_dict, cmb_nos, bill_nos, monitor)
+            if code[0] == misc.CMB_ERROR:
+                return code
 
-            # Render this bill
-            code = misc.run_latex(misc.posix_path(folder), filename)
-            if code == misc.CMB_ERROR:
-                return (misc.CMB_ERROR, 'Rendering of Bill: ' + self.bill.data.title + ' failed')
-            code_bill = misc.run_latex(misc.posix_path(folder), filename_bill)
-            if code_bill == misc.CMB_ERROR:
-                return (misc.CMB_ERROR, 'Rendering of Bill Schedule: ' + self.bill.data.title + ' failed')
-
-            # Render all cmbs again to rebuild indexes on recursive run
             if recursive:  # if recursive call
-                for cmb_ref in cmb_refs:
-                    if cmb_ref is not -1:  # if not prev bill
-                        code = self.render_cmb(folder, replacement_dict, [cmb_ref], False)
-                        if code[0] == misc.CMB_ERROR:
-                            return code
-                # Write spreadsheet output
+                # Write spreadsheet outputs
+                for cmb_no in cmb_nos:
+                    if monitor is not None:
+                        if monitor.cancelled:
+                            return (misc.CMB_ERROR, 'Rendering cancelled')
+                        monitor.progress('Writing spreadsheet of CMB No.' + self.cmbs[cmb_no].get_name())
+                    filename = self.render_cmb_spreadsheet(folder, cmb_no)
+                    if monitor is not None:
+                        monitor.add_output(filename)
+                if monitor is not None:
+                    monitor.progress('Writing spreadsheet of Bill: ' + bill.data.title)
                 filename_bill_spreadsheet = misc.posix_path(folder, 'bill_' + str(path[0] + 1) + '.xlsx')
                 bill.export_spreadsheet_bill(filename_bill_spreadsheet, replacement_dict, self.schedule)
+                if monitor is not None:
+                    monitor.add_output(filename_bill_spreadsheet)
 
             return (misc.CMB_INFO, 'Bill: ' + self.bills[path[0]].data.title + ' rendered successfully')
         else:
             return (misc.CMB_WARNING, 'Rendering of custom bill not supported')
+            
+    def get_bill_cmb_refs(self, bill_no):
+        """Returns set of cmbs refered by bill including cmbs of abstracted items, -1 marks previous bill"""
+        bill = self.bills[bill_no]
+        cmb_refs = bill.cmb_ref.copy()
+        # Add all cmbs depending on cmbs billed to include abstracted items
+        for count in bill.cmb_ref:
+            if count != -1:
+                cmb_refs |= self.cmb_ref[count]
+        return cmb_refs
+            
+    def get_bill_latex(self, folder, replacement_dict, bill_no):
+        """Get latex documents of bill
+        
+            Arguments:
+                folder: Output folder
+                replacement_dict: Replacement dictionary for global values
+                bill_no: Index of bill
+            Returns:
+                Filename of abstract document, list of filenames of documents
+                refered by abstract, latex buffer of abstract, filename of bill
+                document and latex buffer of bill
+        """
+        bill = self.bills[bill_no]
+        
+        # Fill in latex buffer
+        latex_buffer = bill.get_latex_buffer([bill_no], self.schedule)
+        latex_buffer_bill = bill.get_latex_buffer_bill(self.schedule)
+        # Make global variables replacements
+        latex_buffer.replace_and_clean(replacement_dict)
+        latex_buffer_bill.replace_and_clean(replacement_dict)
+        
+        # Include linked cmbs
+        replacement_dict_cmbs = {}
+        external_docs = ''
+        depends = []
+        for cmbpath in self.get_bill_cmb_refs(bill_no):
+            if cmbpath != -1:
+                external_docs += '\externaldocument{cmb_' + str(cmbpath + 1) + '}\n'
+                depends.append(misc.posix_path(folder, 'cmb_' + str(cmbpath + 1) + '.tex'))
+            elif bill.data.prev_bill is not None: # prev abstract
+                external_docs += '\externaldocument{abs_' + str(bill.data.prev_bill + 1) + '}\n'
+                depends.append(misc.posix_path(folder, 'abs_' + str(bill.data.prev_bill + 1) + '.tex'))
+        replacement_dict_cmbs['$cmbexternaldocs$'] = external_docs
+        latex_buffer.replace(replacement_dict_cmbs)
+
+        # Output filenames
+        filename = misc.posix_path(folder, 'abs_' + str(bill_no + 1) + '.tex')
+        filename_bill = misc.posix_path(folder, 'bill_' + str(bill_no + 1) + '.tex')
+        return (filename, depends, latex_buffer, filename_bill, latex_buffer_bill)
+
+        
+class NodeIndex:
+    """Index of stable ids of cmbs, measurements and measurement items
+    
+        Ids are assigned to nodes on registering and are held by the node
+        objects, so that references to measurement items held by bills and
+        abstracts are unaffected by insertion or removal of other nodes.
+        Positional paths are resolved on demand from a position map per
+        container, rebuilt only after the container is changed.
+    """
+    
+    def __init__(self, cmbs):
+        self.cmbs = cmbs  # List of cmbs of data model
+        self.nodes = dict()  # Id mapped to node
+        self.parents = dict()  # Id mapped to id of parent node, None for cmbs
+        self.positions = dict()  # Id of container mapped to dictionary of child id to position
+        self.counter = itertools.count(1)  # Source of new ids
+        
+    def reset(self):
+        """Rebuild index from cmbs, retaining ids of nodes already having one"""
+        self.nodes.clear()
+        self.parents.clear()
+        self.positions.clear()
+        for cmb in self.cmbs:
+            self.register(cmb)
+            
+    def walk(self, node):
+        """Iterate over node and its children in preorder"""
+        yield node
+        if isinstance(node, (measurement.Cmb, measurement.Measurement)):
+            for child in node.items:
+                yield from self.walk(child)
+                
+    def register(self, node, parent_id=None, node_ids=None):
+        """Add node and its children to index
+        
+            Arguments:
+                node: Cmb, Measurement, Completion or measurement item
+                parent_id: Id of parent node, None for cmbs
+                node_ids: Iterator over ids to be assigned to nodes in preorder,
+                          used to restore ids of deleted nodes. New ids are
+                          assigned to nodes without one if None.
+        """
+        if node_ids is not None:
+            node.node_id = next(node_ids)
+        elif getattr(node, 'node_id', None) is None or self.nodes.get(node.node_id, node) is not node:
+            node.node_id = next(self.counter)
+        self.nodes[node.node_id] = node
+        self.parents[node.node_id] = parent_id
+        self.positions.pop(parent_id, None)
+        if isinstance(node, (measurement.Cmb, measurement.Measurement)):
+            for child in node.items:
+                self.register(child, node.node_id, node_ids)
+        
+    def unregister(self, node):
+        """Remove node and its children from index"""
+        self.positions.pop(self.parents.get(node.node_id), None)
+        for child in self.walk(node):
+            self.nodes.pop(child.node_id, None)
+            self.parents.pop(child.node_id, None)
+            self.positions.pop(child.node_id, None)
+            
+    def get(self, node_id):
+        """Returns node of id, None if not existing"""
+        return self.nodes.get(node_id)
+        
+    def get_node(self, path):
+        """Returns node at positional path, None if not existing"""
+        node = None
+        container = self.cmbs
+        for index in path:
+            if not (type(index) is int and 0 <= index < len(container)):
+                return None
+            node = container[index]
+            container = node.items if isinstance(node, (measurement.Cmb, measurement.Measurement)) else []
+        return node
+        
+    def get_id(self, path):
+        """Returns id of node at positional path, None for root or if not existing"""
+        return getattr(self.get_node(path), 'node_id', None)
+        
+    def get_ids(self, refs):
+        """Returns ids of nodes refered as ids or positional paths, skipping missing nodes"""
+        node_ids = []
+        for ref in refs:
+            node_id = self.get_id(ref) if isinstance(ref, (list, tuple)) else ref
+            if node_id in self.nodes:
+                node_ids.append(node_id)
+            else:
+                log.warning('NodeIndex - get_ids - Node not found - ' + str(ref))
+        return node_ids
+        
+    def get_path(self, node_id):
+        """Returns positional path of node"""
+        path = []
+        while node_id is not None:
+            parent_id = self.parents[node_id]
+            positions = self.positions.get(parent_id)
+            if positions is None:
+                container = self.cmbs if parent_id is None else self.nodes[parent_id].items
+                positions = {child.node_id: index for index, child in enumerate(container)}
+                self.positions[parent_id] = positions
+            path.append(positions[node_id])
+            node_id = parent_id
+        path.reverse()
+        return path
+        
+    def get_paths(self, node_ids):
+        """Returns positional paths of nodes"""
+        return [self.get_path(node_id) for node_id in node_ids]
+
+        
+class ReferenceIndex:
+    """Reverse index from measurement items to bills and abstract items refering them"""
+    
+    def __init__(self):
+        self.referrers = dict()  # Id of measurement item mapped to Counter of refering bills and abstract items
+        self.refered = dict()  # Refering bill or abstract item mapped to ids of items refered
+        self.changed = set()  # Ids of items becoming refered or unrefered since last call to pop_changed
+        
+    def clear(self):
+        self.referrers.clear()
+        self.refered.clear()
+        self.changed.clear()
+        
+    def set(self, referrer, mitems):
+        """Set ids of items refered by bill or abstract item"""
+        self.discard(referrer)
+        self.refered[referrer] = list(mitems)
+        for mitem in mitems:
+            if mitem not in self.referrers:
+                self.referrers[mitem] = collections.Counter()
+                self.changed.add(mitem)
+            self.referrers[mitem][referrer] += 1
+            
+    def discard(self, referrer):
+        """Remove references held by bill or abstract item"""
+        for mitem in self.refered.pop(referrer, []):
+            counter = self.referrers[mitem]
+            counter[referrer] -= 1
+            if counter[referrer] <= 0:
+                del counter[referrer]
+                if not counter:
+                    del self.referrers[mitem]
+                    self.changed.add(mitem)
+                    
+    def get_referrers(self, node_ids):
+        """Returns set of bills and abstract items refering any of the nodes"""
+        referrers = set()
+        for node_id in node_ids:
+            counter = self.referrers.get(node_id)
+            if counter:
+                referrers.update(counter)
+        return referrers
+        
+    def get_refered(self):
+        """Returns ids of all refered measurement items"""
+        return list(self.referrers)
+        
+    def is_refered(self, node_id):
+        return node_id in self.referrers
+        
+    def pop_changed(self):
+        """Returns ids of items becoming refered or unrefered since last call and clears them"""
+        changed = self.changed
+        self.changed = set()
+        return changed
+        
+    def verify(self, refered):
+        """Compare index with references obtained from a full scan
+        
+            Arguments:
+                refered: Dictionary of bill or abstract item to ids of items refered
+            Returns:
+                True if index matches, else False
+        """
+        referrers = dict()
+        for referrer, mitems in refered.items():
+            for mitem in mitems:
+                referrers.setdefault(mitem, collections.Counter())[referrer] += 1
+        refered = {referrer: list(mitems) for referrer, mitems in refered.items() if mitems}
+        index_refered = {referrer: mitems for referrer, mitems in self.refered.items() if mitems}
+        return referrers == self.referrers and refered == index_refered
 
         
 class LockState:
-    """Implements variable for storing N-D array of bools for tracking variable lock states"""
+    """Implements set of paths for tracking lock states of measurement items"""
     
     def __init__(self, mitems = None):
         """Initialises class with list of path indices"""
-        self.flags = []
-        if mitems != None:
-            for mitem in mitems:
-                self.__setitem__(mitem, True)
-                
-    def resize(self, path):
-        """Resize array to path"""
-        flag_part = self.flags
-        for index in path[:-1]:
-            if len(flag_part) <= index:
-                # Expand array
-                for i in range(index - len(flag_part) + 1):
-                    flag_part.append([])
-            flag_part = flag_part[index]
-        if len(flag_part) <= path[-1]:
-            flag_part.extend([False]*(path[-1] - len(flag_part) + 1))
+        self.paths = set()  # Paths of locked items as tuples
+        if mitems is not None:
+            self.paths.update(tuple(mitem) for mitem in mitems)
             
-    def get_paths(self, paths=None, flags = None, level=[]):
-        """Returns a list of paths from model"""
-        if paths == None:
-            paths = []
-            flags = self.flags
-        for index, flag_part in enumerate(flags):
-            if isinstance(flag_part, list):
-                self.get_paths(paths, flag_part, level + [index])
-            # If at terminal node, append path
-            elif flag_part == True:
-                paths.append(level + [index])
-        return paths
+    def get_paths(self):
+        """Returns a sorted list of locked paths"""
+        return [list(path) for path in sorted(self.paths)]
+        
+    def add(self, path):
+        """Lock path"""
+        self.paths.add(tuple(path))
+        
+    def discard(self, path):
+        """Unlock path"""
+        self.paths.discard(tuple(path))
                         
     def __setitem__(self, path, value):
         """Set path"""
-        # Resize array to path
-        self.resize(path)
-        flag_part = self.flags
-        if value in [True, False]:
-            for index in path[:-1]:
-                flag_part = flag_part[index]
-            flag_part[path[-1]] = value
+        if value is True:
+            self.add(path)
+        elif value is False:
+            self.discard(path)
             
     def __getitem__(self, path):
         """Get path
             
             Returns:
-                True/False: if path exist
-                None: If path does not exist
+                True if path is locked, else False
         """
-        # Resize array to path
-        flag_part = self.flags
-        for index in path[:-1]:
-            if len(flag_part) > index:
-                flag_part = flag_part[index]
-            else:
-                return None
-        if len(flag_part) > path[-1]:
-            return flag_part[path[-1]]
-        else:
-            return None
+        return tuple(path) in self.paths
+        
+    def __contains__(self, path):
+        return tuple(path) in self.paths
+        
+    def __len__(self):
+        return len(self.paths)
+        
+    def __ior__(self, other):
+        """Add items in place"""
+        self.paths |= other.paths
+        return self
+        
+    def __isub__(self, other):
+        """Remove items in place"""
+        self.paths -= other.paths
+        return self
                 
     def __add__(self, other):
         """Add items"""
-        # Copy current array
-        new_lock = copy.deepcopy(self)
-        # Resize array to size of other and set item
-        paths = other.get_paths()
-        for path in paths:
-            new_lock.resize(path)
-            new_lock[path] = True
+        new_lock = LockState()
+        new_lock.paths = self.paths | other.paths
         return new_lock
                 
     def __sub__(self, other):
-        """Add items"""
-        # Copy current array
-        new_lock = copy.deepcopy(self)
-        # Resize array to size of other and set item
-        paths = other.get_paths()
-        for path in paths:
-            new_lock.resize(path)
-            new_lock[path] = False
+        """Remove items"""
+        new_lock = LockState()
+        new_lock.paths = self.paths - other.paths
         return new_lock
         
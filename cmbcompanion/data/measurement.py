@@ -22,7 +22,7 @@
 #  
 #  
 
-import copy, logging
+import copy, logging, array, itertools, collections, math, sys
 
 # local files import
 from .. import misc
@@ -31,6 +31,9 @@ from . import templates
 # Setup logger object
 log = logging.getLogger(__name__)
 
+# Source of modification counters, unique across all items and record stores
+versions = itertools.count(1)
+
 class Cmb:
     """Stores a CMB data instance"""
     def __init__(self, model=None):
@@ -106,20 +109,35 @@ class Cmb:
         latex_buffer.add_suffix_from_file(misc.abs_path('latex','end.tex'))
         return latex_buffer
     
-    def get_spreadsheet_buffer(self, path, schedule):
-        spreadsheet = misc.Spreadsheet()
-        # Set datas
-        spreadsheet.add_merged_cell(value='DETAILS OF MEASUREMENT FOR ' + self.name + '  (ref:' + str(path) + ')', bold=True, width=6, horizontal='center')
-        spreadsheet.append_data([[None]])
-        # Set datas of children
-        for slno, item in enumerate(self.items):
-            spreadsheet.append(item.get_spreadsheet_buffer(path + [slno], schedule))
+    def get_spreadsheet_buffer(self, path, schedule, spreadsheet=None, rows=None):
+        """Get spreadsheet buffer, appending to spreadsheet if passed
+        
+            Rows already generated by get_spreadsheet_rows may be passed as rows.
+        """
+        if spreadsheet is None:
+            spreadsheet = misc.Spreadsheet()
+        if rows is None:
+            rows = self.get_spreadsheet_rows(path, schedule)
         # Set sheet properties
         spreadsheet.set_title('CMB')
         spreadsheet.set_column_widths([10, 50, 15] + [10]*15)
+        # Set datas
+        spreadsheet.add_merged_cell(value=self.get_spreadsheet_heading(path), bold=True, width=6, horizontal='center')
+        spreadsheet.append_rows(rows)
         
         return spreadsheet
         
+    def get_spreadsheet_heading(self, path):
+        """Get heading of spreadsheet"""
+        return 'DETAILS OF MEASUREMENT FOR ' + self.name + '  (ref:' + str(path) + ')'
+        
+    def get_spreadsheet_rows(self, path, schedule):
+        """Generate rows of spreadsheet as (data, style) pairs for Spreadsheet.append_rows"""
+        yield [[None]], {}
+        # Set datas of children
+        for slno, item in enumerate(self.items):
+            yield from item.get_spreadsheet_rows(path + [slno], schedule)
+        
     def get_text(self):
         return "<b>CMB No." + misc.clean_markup(self.name) + "</b>"
     
@@ -203,16 +221,21 @@ class Measurement:
             latex_buffer += item.get_latex_buffer(newpath, schedule)
         return latex_buffer
     
-    def get_spreadsheet_buffer(self, path, schedule):
-        spreadsheet = misc.Spreadsheet()
+    def get_spreadsheet_buffer(self, path, schedule, spreadsheet=None):
+        """Get spreadsheet buffer, appending to spreadsheet if passed"""
+        if spreadsheet is None:
+            spreadsheet = misc.Spreadsheet()
+        spreadsheet.append_rows(self.get_spreadsheet_rows(path, schedule))
+        return spreadsheet
+        
+    def get_spreadsheet_rows(self, path, schedule):
+        """Generate rows of spreadsheet as (data, style) pairs for Spreadsheet.append_rows"""
         # Set datas
         rows = [[str(path), 'Date of measurement:', self.date], [None]]
-        spreadsheet.append_data(rows, bold=True, wrap_text=False)
+        yield rows, dict(bold=True, wrap_text=False)
         # Set datas of children
         for slno, item in enumerate(self.items):
-            spreadsheet.append(item.get_spreadsheet_buffer(path + [slno], schedule))
-            
-        return spreadsheet
+            yield from item.get_spreadsheet_rows(path + [slno], schedule)
         
     def clear(self):
         self.items = []
@@ -235,6 +258,7 @@ class MeasurementItem:
         self.records = records
         self.remark = remark
         self.item_remarks = item_remarks
+        self.version = next(versions)  # Modification counter of records
 
     def set_item(self,index,itemno):
         self.itemnos[index] = itemno
@@ -244,15 +268,19 @@ class MeasurementItem:
         
     def append_record(self,record):
         self.records.append(record)
+        self.version = next(versions)
                 
     def insert_record(self,index,record):
         self.records.insert(index,record)
+        self.version = next(versions)
         
     def remove_record(self,index):
         del(self.records[index])
+        self.version = next(versions)
         
     def __setitem__(self, index, value):
         self.records[index] = value
+        self.version = next(versions)
     
     def __getitem__(self, index):
         return self.records[index]
@@ -266,11 +294,19 @@ class MeasurementItem:
     def length(self):
         return len(self.records)
         
+    def get_spreadsheet_buffer(self, path, schedule, spreadsheet=None):
+        """Get spreadsheet buffer, appending to spreadsheet if passed"""
+        if spreadsheet is None:
+            spreadsheet = misc.Spreadsheet()
+        spreadsheet.append_rows(self.get_spreadsheet_rows(path, schedule))
+        return spreadsheet
+        
     def clear(self):
         self.itemnos = []
         self.records = []
         self.remark = ''
         self.item_remarks = []
+        self.version = next(versions)
                 
 class MeasurementItemHeading(MeasurementItem):
     """Stores an item heading"""
@@ -303,10 +339,9 @@ class MeasurementItemHeading(MeasurementItem):
         latex_buffer.replace_and_clean(measheading_local_vars)
         return latex_buffer
     
-    def get_spreadsheet_buffer(self, path, schedule):
-        spreadsheet = misc.Spreadsheet()
-        spreadsheet.append_data([[str(path), self.remark], [None]], bold=True, wrap_text=False)
-        return spreadsheet
+    def get_spreadsheet_rows(self, path, schedule):
+        """Generate rows of spreadsheet as (data, style) pairs for Spreadsheet.append_rows"""
+        yield [[str(path), self.remark], [None]], dict(bold=True, wrap_text=False)
         
     def get_text(self):
         return "<b><i>" + misc.clean_markup(self.remark) + "</i></b>"
@@ -317,29 +352,298 @@ class MeasurementItemHeading(MeasurementItem):
     def print_item(self):
         print("    " + self.remark)
 
-class RecordCustom:
-    """An individual record of a MeasurementItemCustom"""
-    def __init__(self, items, cust_funcs, total_func, columntypes):
-        self.data_string = items
-        self.data = []
-        # Populate Data
-        for x,columntype in zip(self.data_string,columntypes):
-            if columntype not in [misc.MEAS_DESC, misc.MEAS_CUST]:
-                try:
-                    num = eval(x)
-                    self.data.append(num)
-                except:
-                    self.data.append(0)
-            else:
-                self.data.append(0)
+class RecordStore:
+    """Column store holding the records of a MeasurementItemCustom
+    
+        Numeric values of each column are held in a shared array('d') with a
+        matching array('b') of flags marking integer values, description and
+        custom columns holding no numeric values at all, string values in
+        one list per column, repeated strings being shared. Per record totals
+        from total_func are evaluated when first read after a record is
+        written and held column wise in the same manner, totals of an item
+        as a whole are evaluated over the numeric columns by total_func_batch.
+        Indexing the store returns a RecordCustom view of a record.
+    """
+    TOTALS_PENDING = 0xFFFF  # Totals width of a record whose totals are not evaluated
+    
+    def __init__(self, cust_funcs, total_func, columntypes):
         self.cust_funcs = cust_funcs
         self.total_func = total_func
         self.columntypes = columntypes
-        self.total = self.find_total()
+        self.clear()
+        
+    def clear(self):
+        """Remove all records"""
+        self.strings = []  # String value columns
+        # Numeric value columns and integer flags, None for non numeric columns
+        self.values = [array.array('d') if self.is_numeric(columntype) else None
+                       for columntype in self.columntypes]
+        self.values_int = [array.array('b') if self.is_numeric(columntype) else None
+                           for columntype in self.columntypes]
+        self.widths = array.array('H')  # Number of string values per record
+        self.totals = []  # Total columns
+        self.totals_int = []  # Integer flags of total columns
+        self.totals_widths = array.array('H')  # Number of totals per record
+        self.version = next(versions)  # Modification counter
+        
+    def copy(self):
+        """Returns a copy of the store, functions and column types are shared"""
+        store = copy.copy(self)
+        store.strings = [list(column) for column in self.strings]
+        store.values = [column[:] if column is not None else None for column in self.values]
+        store.values_int = [column[:] if column is not None else None for column in self.values_int]
+        store.widths = self.widths[:]
+        store.totals = [column[:] for column in self.totals]
+        store.totals_int = [column[:] for column in self.totals_int]
+        store.totals_widths = self.totals_widths[:]
+        store.version = next(versions)
+        return store
+        
+    def __len__(self):
+        return len(self.widths)
+        
+    def __getitem__(self, index):
+        return RecordCustom(store=self, row=self._check_index(index))
+        
+    def __setitem__(self, index, record):
+        self.set_model(self._check_index(index), record.get_model())
+        
+    def __delitem__(self, index):
+        row = self._check_index(index)
+        for column in self.strings + self.values + self.values_int + self.totals + self.totals_int:
+            if column is not None:
+                del column[row]
+        del self.widths[row]
+        del self.totals_widths[row]
+        self.version = next(versions)
+        
+    def __iter__(self):
+        for row in range(len(self)):
+            yield RecordCustom(store=self, row=row)
+            
+    def _check_index(self, index):
+        """Returns a positive row index, raising IndexError if out of range"""
+        length = len(self)
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError('RecordStore index out of range')
+        return index
+        
+    @staticmethod
+    def is_numeric(columntype):
+        """Returns whether values of a column type are evaluated"""
+        return columntype not in [misc.MEAS_DESC, misc.MEAS_CUST]
+        
+    def append(self, record):
+        self.insert_model(len(self), record.get_model())
+        
+    def insert(self, index, record):
+        self.insert_model(index, record.get_model())
+        
+    def append_model(self, items):
+        """Append a record from its data model"""
+        self.insert_model(len(self), items)
+        
+    def insert_model(self, index, items):
+        """Insert a record from its data model
+        
+            Arguments:
+                index: Position of record, clipped to the store length as with list.insert
+                items: List of strings
+        """
+        length = len(self)
+        if index < 0:
+            index = max(index + length, 0)
+        index = min(index, length)
+        # Open a slot in every column and fill it in
+        for column in self.strings:
+            column.insert(index, '')
+        for columns in (self.values, self.values_int, self.totals, self.totals_int):
+            for column in columns:
+                if column is not None:
+                    column.insert(index, 0)
+        self.widths.insert(index, 0)
+        self.totals_widths.insert(index, self.TOTALS_PENDING)
+        self.set_model(index, items)
+        
+    def set_model(self, row, items):
+        """Set data model of a record
+        
+            Arguments:
+                row: Index of record
+                items: List of strings
+        """
+        # String columns
+        while len(self.strings) < len(items):
+            self.strings.append([''] * len(self))
+        for column, item in zip(self.strings, items):
+            column[row] = sys.intern(item) if type(item) is str else item
+        for column in self.strings[len(items):]:
+            column[row] = ''
+        self.widths[row] = len(items)
+        # Numeric columns, totals being evaluated when read
+        for x, values, values_int in zip(items, self.values, self.values_int):
+            if values is None:
+                continue
+            num = 0
+            try:
+                num = misc.evaluate(x)
+            except:
+                pass
+            try:
+                values[row] = num
+            except (OverflowError, TypeError):
+                # Value not representable as a float, treat as invalid
+                log.warning('RecordStore - set_model - value not representable - ' + str(x)[:50])
+                num = 0
+                values[row] = num
+            values_int[row] = isinstance(num, int)
+        self.totals_widths[row] = self.TOTALS_PENDING
+        self.version = next(versions)
+        
+    def set_total(self, row):
+        """Evaluate totals of a record by total_func"""
+        total = self.total_func(self.get_data(row))
+        while len(self.totals) < len(total):
+            self.totals.append(array.array('d', bytes(8 * len(self))))
+            self.totals_int.append(array.array('b', bytes(len(self))))
+        for value, totals, totals_int in zip(total, self.totals, self.totals_int):
+            try:
+                if isinstance(value, float) and not math.isfinite(value):
+                    raise OverflowError
+                totals[row] = value
+            except (OverflowError, TypeError):
+                # Total not representable as a float, treat as invalid
+                log.warning('RecordStore - set_total - total not representable - ' + str(value)[:50])
+                value = 0
+                totals[row] = value
+            totals_int[row] = isinstance(value, int)
+        self.totals_widths[row] = len(total)
+        
+    def set_string(self, row, column, value):
+        """Set string of a description column of a record without evaluating record"""
+        self.strings[column][row] = value
+        self.version = next(versions)
+        
+    def set_values(self, edits):
+        """Set values of a batch of cells, writing each record once
+        
+            Arguments:
+                edits: List of (row, column, value) with value a string,
+                       later edits of a cell override earlier ones
+            Returns:
+                Sorted list of rows modified
+        """
+        rows = collections.OrderedDict()  # Row mapped to data model being edited
+        for row, column, value in edits:
+            if row not in rows:
+                rows[row] = self.get_model(row)
+            items = rows[row]
+            if column >= len(items):
+                items.extend([''] * (column + 1 - len(items)))
+            items[column] = value
+        for row, items in rows.items():
+            self.set_model(row, items)
+        return sorted(rows)
+        
+    def get_model(self, row):
+        """Get data model of a record"""
+        return [column[row] for column in self.strings[0:self.widths[row]]]
+        
+    def get_data(self, row):
+        """Get numeric values of a record"""
+        width = min(self.widths[row], len(self.columntypes))
+        return [0 if values is None else int(values[row]) if values_int[row] else values[row]
+                for values, values_int in zip(self.values[0:width], self.values_int[0:width])]
+        
+    def get_total(self, row):
+        """Get total of a record as evaluated by total_func"""
+        if self.totals_widths[row] == self.TOTALS_PENDING:
+            self.set_total(row)
+        width = self.totals_widths[row]
+        return [int(totals[row]) if totals_int[row] else totals[row]
+                for totals, totals_int in zip(self.totals[0:width], self.totals_int[0:width])]
+        
+    def get_matrix(self):
+        """Get numeric values of all records as a 2-D numpy float array
+        
+            Requires numpy.
+        """
+        matrix = misc.numpy.zeros((len(self), len(self.columntypes)), 'float64')
+        for index, values in enumerate(self.values):
+            if values is not None:
+                matrix[:, index] = misc.numpy.frombuffer(values, 'float64')
+        return matrix
+        
+    def get_integer_matrix(self):
+        """Get a 2-D numpy boolean array marking integer values of all records
+        
+            Requires numpy.
+        """
+        matrix = misc.numpy.ones((len(self), len(self.columntypes)), 'bool')
+        for index, values_int in enumerate(self.values_int):
+            if values_int is not None:
+                matrix[:, index] = misc.numpy.frombuffer(values_int, 'int8')
+        return matrix
+        
+    def get_column(self, index):
+        """Get numeric values of a column as an array('d')"""
+        if self.values[index] is None:
+            return array.array('d', bytes(8 * len(self)))
+        return self.values[index]
+        
+    def get_total_column(self, index):
+        """Get total values of a column as an array('d')"""
+        for row in range(len(self)):
+            if self.totals_widths[row] == self.TOTALS_PENDING:
+                self.set_total(row)
+        return self.totals[index]
+
+
+class RecordCustom:
+    """An individual record of a MeasurementItemCustom
+    
+        A record is a view over a row of a RecordStore. A record created
+        from items owns a single row store of its own, which is copied into
+        the item store on being added to a MeasurementItemCustom.
+    """
+    __slots__ = ('store', 'row')
+    
+    def __init__(self, items=None, cust_funcs=None, total_func=None, columntypes=None, store=None, row=0):
+        if store is None:
+            store = RecordStore(cust_funcs, total_func, columntypes)
+            store.append_model(items)
+        self.store = store
+        self.row = row
+        
+    @property
+    def data_string(self):
+        return self.store.get_model(self.row)
+        
+    @property
+    def data(self):
+        return self.store.get_data(self.row)
+        
+    @property
+    def total(self):
+        return self.store.get_total(self.row)
+        
+    @property
+    def cust_funcs(self):
+        return self.store.cust_funcs
+        
+    @property
+    def total_func(self):
+        return self.store.total_func
+        
+    @property
+    def columntypes(self):
+        return self.store.columntypes
 
     def get_model(self):
         """Get data model"""
-        return self.data_string
+        return self.store.get_model(self.row)
         
     def get_model_rendered(self, row=None):
         """Get data model with results of custom functions included for rendering"""
@@ -360,13 +664,13 @@ class RecordCustom:
                         rendered_item.append(item_elem)
                     elif columntype == misc.MEAS_NO:
                         try:
-                            value = int(eval(item_elem)) if item_elem not in ['0','0.0'] else 0
+                            value = int(misc.evaluate(item_elem)) if item_elem not in ['0','0.0'] else 0
                             rendered_item.append(value)
                         except:
                             rendered_item.append('0')
                     elif columntype == misc.MEAS_L:
                         try:
-                            value = eval(item_elem) if item_elem not in ['0','0.0'] else 0
+                            value = misc.evaluate(item_elem) if item_elem not in ['0','0.0'] else 0
                             rendered_item.append(value)
                         except:
                             rendered_item.append('0')
@@ -377,12 +681,16 @@ class RecordCustom:
                 log.warning('RecordCustom - Wrong value loaded in item - ' + str(item_elem))
         return rendered_item
         
-    def set_model(self, items, cust_funcs, total_func, columntypes):
-        """Set data model"""
-        self.__init__(items, cust_funcs, total_func, columntypes)
+    def set_model(self, items, cust_funcs=None, total_func=None, columntypes=None):
+        """Set data model
+        
+            Functions and column types are those of the parent store and
+            the corresponding arguments are retained for compatibility.
+        """
+        self.store.set_model(self.row, items)
 
     def find_total(self):
-        return self.total_func(self.data)
+        return self.store.get_total(self.row)
 
     def find_custom(self,index):
         return self.cust_funcs[index](self.data)
@@ -402,6 +710,7 @@ class MeasurementItemCustom(MeasurementItem):
         self.cust_funcs = []
         self.total_func_item = None
         self.total_func = None
+        self.total_func_batch = None
         self.latex_item = ''
         self.latex_record = ''
         # For user data support
@@ -411,6 +720,9 @@ class MeasurementItemCustom(MeasurementItem):
         self.latex_postproc_func = None
         self.export_abstract = None
         self.dimensions = None
+        # Cached result of get_total()
+        self.total_cache = None
+        self.total_cache_key = None
 
         # Read description from file
         if plugin is not None:
@@ -425,6 +737,8 @@ class MeasurementItemCustom(MeasurementItem):
                 self.cust_funcs = self.custom_object.cust_funcs
                 self.total_func_item = self.custom_object.total_func_item
                 self.total_func = self.custom_object.total_func
+                # Optional batch total function operating on a numpy array
+                self.total_func_batch = getattr(self.custom_object, 'total_func_batch', None)
                 self.latex_item = self.custom_object.latex_item
                 self.latex_record = self.custom_object.latex_record
                 # For user data support
@@ -437,19 +751,17 @@ class MeasurementItemCustom(MeasurementItem):
             except ImportError:
                 log.error('Error Loading plugin - MeasurementItemCustom - ' + str(plugin))
 
+            records = RecordStore(self.cust_funcs, self.total_func_item, self.columntypes)
             if data != None:
                 itemnos = data[0]
-                records = []
                 for item_model in data[1]:
-                    item = RecordCustom(item_model, self.cust_funcs,
-                                        self.total_func_item, self.columntypes)
-                    records.append(item)
+                    records.append_model(item_model)
                 remark = data[2]
                 item_remarks = data[3]
                 self.user_data = data[4]
                 MeasurementItem.__init__(self, itemnos, records, remark, item_remarks)
             else:
-                MeasurementItem.__init__(self, [None]*self.item_width(), [],
+                MeasurementItem.__init__(self, [None]*self.item_width(), records,
                                         '', ['']*self.item_width())
         else:
             MeasurementItem.__init__(self)
@@ -481,34 +793,51 @@ class MeasurementItemCustom(MeasurementItem):
             self.clear()
             self.__init__(model[1], model[1][5])
 
+    def set_values(self, edits):
+        """Set values of a batch of cells given as (row, column, value), returns rows modified"""
+        return self.records.set_values(edits)
+        
+    def copy(self):
+        """Returns a copy of item for editing, plugin objects and functions are shared"""
+        item = copy.copy(self)
+        item.records = self.records.copy()
+        item.itemnos = list(self.itemnos)
+        item.item_remarks = list(self.item_remarks)
+        item.user_data = copy.deepcopy(self.user_data)
+        item.version = next(versions)
+        return item
+
     def get_latex_buffer(self, path, schedule, isabstract=False):
-        latex_records = misc.LatexFile()
+        latex_records = []
+        template_record = misc.LatexTemplate(self.latex_record)
         
         data_string = [None]*self.model_width()
         for slno,record in enumerate(self.records):
             meascustom_rec_vars = {}
             meascustom_rec_vars_van = {}
+            record_model = record.get_model()
+            record_data = record.data
             # Evaluate string to make replacement
             for i,columntype in enumerate(self.columntypes): # evaluate string of data entries, suppress zero.
                 if columntype == misc.MEAS_CUST:
                     try:
-                        value =  str(record.cust_funcs[i](record.get_model(),slno))
+                        value =  str(self.cust_funcs[i](record_model,slno))
                         data_string[i] = value if value not in ['0','0.0'] else ''
                     except:
                         data_string[i] = ''
                 elif columntype == misc.MEAS_DESC:
                     try:
-                        data_string[i] = str(record.data_string[i])
+                        data_string[i] = str(record_model[i])
                     except:
                         data_string[i] = ''
                 elif columntype == misc.MEAS_NO:
                     try:
-                        data_string[i] = str(int(record.data[i])) if record.data[i] != 0 else ''
+                        data_string[i] = str(int(record_data[i])) if record_data[i] != 0 else ''
                     except:
                         data_string[i] = ''
                 else:
                     try:
-                        data_string[i] = str(record.data[i]) if record.data[i] != 0 else ''
+                        data_string[i] = str(record_data[i]) if record_data[i] != 0 else ''
                     except:
                         data_string[i] = ''
                 # Check for carry over item possibly contains code
@@ -523,10 +852,7 @@ class MeasurementItemCustom(MeasurementItem):
                     meascustom_rec_vars['$data' + str(i+1) + '$'] = data_string[i]
             meascustom_rec_vars['$slno$'] = str(slno+1)
             
-            latex_record = misc.LatexFile(self.latex_record)
-            latex_record.replace(meascustom_rec_vars_van)
-            latex_record.replace_and_clean(meascustom_rec_vars)
-            latex_records += latex_record
+            latex_records.append('\n' + template_record.render(meascustom_rec_vars, meascustom_rec_vars_van))
             
         # replace local variables
         meascustom_local_vars = {}
@@ -552,37 +878,34 @@ class MeasurementItemCustom(MeasurementItem):
         else:
             meascustom_local_vars_vannilla['$cmbasbstractitem$'] = '\\iffalse'
         # fill in records - vanilla used since latex_records contains latex code
-        meascustom_local_vars_vannilla['$cmbrecords$'] = latex_records.get_buffer()
+        meascustom_local_vars_vannilla['$cmbrecords$'] = ''.join(latex_records)
             
-        latex_buffer = misc.LatexFile(self.latex_item)
-        latex_buffer.replace_and_clean(meascustom_local_vars)
-        latex_buffer.replace(meascustom_local_vars_vannilla)
+        latex_buffer = misc.LatexFile(misc.LatexTemplate(self.latex_item).render(meascustom_local_vars, meascustom_local_vars_vannilla))
         
         latex_post = self.latex_postproc_func(self.records, self.user_data, latex_buffer, isabstract)
         return latex_post
         
-    def get_spreadsheet_buffer(self, path, schedule):
-        spreadsheet = misc.Spreadsheet()
+    def get_spreadsheet_rows(self, path, schedule):
+        """Generate rows of spreadsheet as (data, style) pairs for Spreadsheet.append_rows"""
         # Item no and description
         for slno, itemno in enumerate(self.itemnos):
             if itemno is not None and schedule[itemno] is not None:
-                spreadsheet.append_data([[str(path), 'Item No:' + itemno, self.item_remarks[slno]]], bold=True, wrap_text=False)
-                spreadsheet.append_data([[None, schedule[itemno].extended_description]])
+                yield [[str(path), 'Item No:' + itemno, self.item_remarks[slno]]], dict(bold=True, wrap_text=False)
+                yield [[None, schedule[itemno].extended_description]], {}
         # Remarks columns
         if self.remark != '':
-            spreadsheet.append_data([[None, 'Remarks: ' + self.remark]], bold=True)
+            yield [[None, 'Remarks: ' + self.remark]], dict(bold=True)
         # Data rows
-        spreadsheet.append_data([[None], [None] + self.captions], bold=True)
+        yield [[None], [None] + self.captions], dict(bold=True)
         for slno, record in enumerate(self.records,1):
             values = record.get_model_rendered(slno)
-            spreadsheet.append_data([[slno] + values])
+            yield [[slno] + values], {}
         # User data
         if self.captions_udata:
-            spreadsheet.append_data([[None], [None, 'User Data Captions'] + self.captions_udata], bold=True)
-            spreadsheet.append_data([[None, 'User Datas'] + self.user_data])
+            yield [[None], [None, 'User Data Captions'] + self.captions_udata], dict(bold=True)
+            yield [[None, 'User Datas'] + self.user_data], {}
         # Total values
-        spreadsheet.append_data([[None], [None, 'TOTAL'] + self.get_total(), [None]], bold=True)
-        return spreadsheet
+        yield [[None], [None, 'TOTAL'] + self.get_total(), [None]], dict(bold=True)
 
     def print_item(self):
         print("    Item No." + str(self.itemnos))
@@ -590,11 +913,24 @@ class MeasurementItemCustom(MeasurementItem):
             self[i].print_item()
         print("    " + "Total: " + str(self.get_total()))
 
+    def get_version(self):
+        """Returns a key identifying the current state of records and user data"""
+        user_data = tuple(self.user_data) if self.user_data else ()
+        return (self.version, getattr(self.records, 'version', None), user_data)
+
     def get_total(self):
-        if self.total_func is not None:
-            return self.total_func(self.records,self.user_data)
-        else:
-            return []
+        key = self.get_version()
+        if self.total_cache_key != key:
+            if self.total_func_batch is not None and misc.numpy is not None and self.length() > 0:
+                total = self.total_func_batch(self.records.get_matrix(),
+                                              self.records.get_integer_matrix(), self.user_data)
+            elif self.total_func is not None:
+                total = self.total_func(self.records,self.user_data)
+            else:
+                total = []
+            self.total_cache = total
+            self.total_cache_key = key
+        return list(self.total_cache)
 
     def get_text(self):
         total = self.get_total()
@@ -608,11 +944,51 @@ class MeasurementItemCustom(MeasurementItem):
             return None
 
 
+class MeasurementItemEdit:
+    """Copy on write edit session of a MeasurementItemCustom
+    
+        Reads are served from the item of the data model until the first
+        modification, when the item is copied. The data model is left
+        unchanged until the edited item is saved.
+    """
+    def __init__(self, item, edited=None):
+        """Initialise edit session
+        
+            Arguments:
+                item: Item of data model being edited
+                edited: Previously modified copy of item if any
+        """
+        self.original = item
+        self.edited = edited
+
+    def is_modified(self):
+        return self.edited is not None
+        
+    def get_item(self):
+        """Returns item for reading, not to be modified"""
+        if self.edited is not None:
+            return self.edited
+        return self.original
+        
+    def get_writable(self):
+        """Returns item for modification, copying item of data model on first call"""
+        if self.edited is None:
+            self.edited = self.original.copy()
+        return self.edited
+        
+    def reset(self, item=None):
+        """Discard modified copy after save, optionally rebasing on item"""
+        if item is not None:
+            self.original = item
+        self.edited = None
+
+
 class MeasurementItemAbstract(MeasurementItem):
     """Stores an abstract of measurements"""
     def __init__(self, data = None):
         self.int_mitem = None  # MeasurementItemCustom for storing abstract
-        self.mitems = []  # Paths to items to be abstracted
+        self.mitems = []  # Ids of items to be abstracted, positional paths in saved model
+        self.source_key = None  # Versions of abstracted items at last update
         MeasurementItem.__init__(self, itemnos=[], records=[], 
                 remark='', item_remarks = [])
 
@@ -638,33 +1014,61 @@ class MeasurementItemAbstract(MeasurementItem):
             self.clear()
             self.__init__(model[1])
             
-    def update(self, cmbs, path):
-        """Update values from static itemlist"""
+    def update(self, nodes, path):
+        """Update values from static itemlist
+        
+            Arguments:
+                nodes: datamodel.NodeIndex for looking up abstracted items
+                path: Path of item
+        """
         if self.mitems:
-            p = self.mitems[0]
-            item_int = cmbs[p[0]][p[1]][p[2]]
+            item_int = nodes.get(self.mitems[0])
             type_ = item_int.itemtype
             if self.int_mitem is None:
                 self.int_mitem = MeasurementItemCustom(item_int.get_model()[1], type_)
+                self.source_key = None
+            # Skip if abstracted items or their positions unchanged since last update
+            items = [nodes.get(node_id) for node_id in self.mitems]
+            paths = nodes.get_paths(self.mitems)
+            source_key = tuple((tuple(path), item.get_version()) for path, item in zip(paths, items))
+            if source_key == self.source_key:
+                return
             # Populate values
-            self.int_mitem.records = []
-            for path in self.mitems:
-                item = cmbs[path[0]][path[1]][path[2]]
+            self.int_mitem.records.clear()
+            for path, item in zip(paths, items):
                 values = item.export_abstract(item.records, item.user_data)
                 # Save abstracted item path to record for reference
                 values[0] = 'Qty B/F ' + str(path)
-                self.int_mitem.append_record(RecordCustom(values,
-                    self.int_mitem.cust_funcs,self.int_mitem.total_func_item,
-                    self.int_mitem.columntypes))
+                self.int_mitem.records.append_model(values)
+            self.source_key = source_key
             # Update base class from new values
             MeasurementItem.__init__(self, itemnos=self.int_mitem.itemnos, 
                 records=self.int_mitem.records, remark=self.remark, 
                 item_remarks = self.int_mitem.item_remarks)
         else:
             self.int_mitem = None
+            self.source_key = None
+            
+    def update_paths(self, nodes):
+        """Update paths of abstracted items shown in records after they moved
+        
+            Values are not evaluated again.
+            
+            Arguments:
+                nodes: datamodel.NodeIndex for looking up abstracted items
+        """
+        if self.int_mitem is None or self.source_key is None or len(self.source_key) != len(self.mitems):
+            return
+        paths = nodes.get_paths(self.mitems)
+        source_key = tuple((tuple(path), version) for path, (path_old, version) in zip(paths, self.source_key))
+        if source_key == self.source_key:
+            return
+        for row, path in enumerate(paths):
+            self.int_mitem.records.set_string(row, 0, 'Qty B/F ' + str(path))
+        self.source_key = source_key
             
     def get_abstracted_items(self):
-        """Returns a list of static paths to abstracted items"""
+        """Returns a list of ids of abstracted items"""
         return self.mitems
 
     def get_latex_buffer(self, path, schedule):
@@ -673,11 +1077,10 @@ class MeasurementItemAbstract(MeasurementItem):
         else:
             return misc.LatexFile()
             
-    def get_spreadsheet_buffer(self, path, schedule):
+    def get_spreadsheet_rows(self, path, schedule):
+        """Generate rows of spreadsheet as (data, style) pairs for Spreadsheet.append_rows"""
         if self.mitems:
-            return self.int_mitem.get_spreadsheet_buffer(path, schedule)
-        else:
-            return misc.Spreadsheet()
+            yield from self.int_mitem.get_spreadsheet_rows(path, schedule)
 
     def print_item(self):
         print('    Abstract Item')
@@ -735,10 +1138,16 @@ class Completion:
         latex_buffer.replace_and_clean(measgroup_local_vars)
         return latex_buffer
         
-    def get_spreadsheet_buffer(self, path, schedule):
-        spreadsheet = misc.Spreadsheet()
-        spreadsheet.append_data([[None], [str(path), 'DATE OF COMPLETION', self.date], [None]], bold=True, wrap_text=False)
+    def get_spreadsheet_buffer(self, path, schedule, spreadsheet=None):
+        """Get spreadsheet buffer, appending to spreadsheet if passed"""
+        if spreadsheet is None:
+            spreadsheet = misc.Spreadsheet()
+        spreadsheet.append_rows(self.get_spreadsheet_rows(path, schedule))
         return spreadsheet
+        
+    def get_spreadsheet_rows(self, path, schedule):
+        """Generate rows of spreadsheet as (data, style) pairs for Spreadsheet.append_rows"""
+        yield [[None], [str(path), 'DATE OF COMPLETION', self.date], [None]], dict(bold=True, wrap_text=False)
 
     def get_text(self):
         return "<b>Completion recorded on " + misc.clean_markup(self.date) + "</b>"
@@ -22,7 +22,7 @@
 #  
 #  
 
-import logging
+import logging, re, bisect
 
 # Local module import
 from .. import misc
@@ -64,20 +64,20 @@ class ScheduleItem(ScheduleItemGeneric):
         self.description = description
         self.unit = unit
         try:
-            self.rate = round(eval(rate), 2)
+            self.rate = round(misc.evaluate(rate), 2)
         except:
             log.warning('ScheduleItem - Wrong value loaded in model - rate - ' + rate)
             rate = '0'
             self.rate = 0
         try:
-            self.qty = eval(qty)
+            self.qty = misc.evaluate(qty)
         except:
             log.warning('ScheduleItem - Wrong value loaded in model - qty - ' + qty)
             qty = '0'
             self.qty = 0
         self.reference = reference
         try:
-            self.excess_rate_percent = eval(excess_rate_percent)
+            self.excess_rate_percent = misc.evaluate(excess_rate_percent)
         except:
             log.warning('ScheduleItem - Wrong value loaded in model - excess_rate_percent -' + excess_rate_percent)
             excess_rate_percent = '30'
@@ -100,14 +100,14 @@ class ScheduleItem(ScheduleItemGeneric):
             self.unit = value
         elif index == 3:
             try:
-                self.rate = round(float(eval(value)), 2)
+                self.rate = round(float(misc.evaluate(value)), 2)
             except:
                 log.warning('ScheduleItem - Wrong value loaded in model - rate - ' + value)
                 self.rate = 0
                 value = '0'
         elif index == 4:
             try:
-                self.qty = float(eval(value))
+                self.qty = float(misc.evaluate(value))
             except:
                 log.warning('ScheduleItem - Wrong value loaded in model - qty - ' + value)
                 self.qty = 0
@@ -116,7 +116,7 @@ class ScheduleItem(ScheduleItemGeneric):
             self.reference = value
         elif index == 6:
             try:
-                self.excess_rate_percent = float(eval(value))
+                self.excess_rate_percent = float(misc.evaluate(value))
             except:
                 log.warning('ScheduleItem - Wrong value loaded in model - excess_rate_percent -' + value)
                 self.excess_rate_percent = 30
@@ -181,12 +181,54 @@ class Schedule(ScheduleGeneric):
     """Class stores the schedule of rates for work"""
     
     def __init__(self, items=[]):
+        # Derived data
+        self.index = None  # Dictionary of itemno to row, rebuilt on demand
+        self.itemnos = None  # Cached result of get_itemnos()
+        self.search_index = None  # Search index of itemnos, rebuilt on demand
         #Initialise base class
         super(Schedule,self).__init__(items)
         self.update_values()
         
+    def invalidate_index(self):
+        """Clear itemno index and cached itemnos (call on change of rows)"""
+        self.index = None
+        self.itemnos = None
+        self.search_index = None
+        
+    def get_index(self):
+        """Return dictionary mapping itemno to row (first occurance)"""
+        if self.index is None:
+            self.index = dict()
+            for row, item in enumerate(self.items):
+                if item.itemno not in self.index:
+                    self.index[item.itemno] = row
+        return self.index
+        
+    def append_item(self, item):
+        """Append item at end of schedule"""
+        self.items.append(item)
+        self.invalidate_index()
+
+    def set_item_at_index(self, index, item):
+        self.items[index] = item
+        self.invalidate_index()
+
+    def insert_item_at_index(self, index, item):
+        self.items.insert(index, item)
+        self.invalidate_index()
+
+    def remove_item_at_index(self, index):
+        del (self.items[index])
+        self.invalidate_index()
+
+    def clear(self):
+        del self.items[:]
+        self.invalidate_index()
+        
     def update_values(self):
         """Populate ScheduleItem.extended_description (Used for final billing)"""
+        # Item values might have been edited in place
+        self.invalidate_index()
         iter = 0
         extended_description = ''
         itemno = ''
@@ -223,11 +265,12 @@ class Schedule(ScheduleGeneric):
     def __setitem__(self, index, value):
         if isinstance(index, int):
             self.items[index] = value
+            self.invalidate_index()
         elif isinstance(index, str):
-            for item in self.items:
-                if item.itemno == index:
-                    self.items[index] = value
-                    break
+            row = self.get_index().get(index)
+            if row is not None:
+                self.items[row] = value
+                self.invalidate_index()
             else:
                 log.warning("Schedule - Itemno not found while assigning value")
 
@@ -235,9 +278,9 @@ class Schedule(ScheduleGeneric):
         if isinstance(index, int):
             return self.items[index]
         elif isinstance(index, str):
-            for item in self.items:
-                if item.itemno == index:
-                    return item
+            row = self.get_index().get(index)
+            if row is not None:
+                return self.items[row]
             return None
     
     def set_model(self,items):
@@ -248,10 +291,69 @@ class Schedule(ScheduleGeneric):
         self.update_values()
             
     def get_itemnos(self):
-        """Returns a list of itemnos with order as in schedule"""
-        itemnos = []
-        for item in self.items:
-            if item.itemno != '' and item.qty != 0:
-                itemnos.append(item.itemno)
-        return itemnos
+        """Returns a list of itemnos with order as in schedule (cached, do not modify)"""
+        if self.itemnos is None:
+            self.itemnos = []
+            for item in self.items:
+                if item.itemno != '' and item.qty != 0:
+                    self.itemnos.append(item.itemno)
+        return self.itemnos
+        
+    def get_search_index(self):
+        """Return search index of itemnos (cached)
+        
+            The index holds lower cased itemnos in order of schedule, and a
+            sorted list of words of itemno and extended description with a
+            dictionary mapping each word to the set of positions of itemnos
+            containing it.
+        """
+        if self.search_index is None:
+            itemnos = self.get_itemnos()
+            keys = []
+            postings = dict()
+            for position, itemno in enumerate(itemnos):
+                item = self[itemno]
+                keys.append(itemno.lower())
+                for word in set(re.findall(r'\w+', (itemno + ' ' + item.extended_description).lower())):
+                    postings.setdefault(word, set()).add(position)
+            self.search_index = (itemnos, keys, sorted(postings), postings)
+        return self.search_index
+        
+    def search(self, query, limit):
+        """Search itemnos by itemno prefix and words of description
+        
+            Itemnos starting with the query come first, followed by itemnos
+            with every word of the query matching the start of a word of
+            itemno or extended description, each in order of schedule.
+            
+            Arguments:
+                query: Search string
+                limit: Maximum number of results
+            Returns:
+                List of itemnos
+        """
+        itemnos, keys, words, postings = self.get_search_index()
+        query = query.strip().lower()
+        if query == '':
+            return itemnos[0:limit]
+        # Prefix matches of itemno
+        results = [itemnos[position] for position, key in enumerate(keys) if key.startswith(query)][0:limit]
+        # Full text matches, each query word is a prefix of a word of item
+        positions = None
+        for token in re.findall(r'\w+', query):
+            matches = set()
+            start = bisect.bisect_left(words, token)
+            for word in words[start:bisect.bisect_left(words, token + '\uffff')]:
+                matches.update(postings[word])
+            positions = matches if positions is None else positions & matches
+            if not positions:
+                break
+        if positions:
+            found = set(results)
+            for position in sorted(positions):
+                if len(results) >= limit:
+                    break
+                if itemnos[position] not in found:
+                    results.append(itemnos[position])
+        return results
 
@@ -22,6 +22,9 @@
 #
 #
 
+# Local module import
+from ... import misc
+
 # Item codes for schedule dialog * DONT CHANGE *
 MEAS_NO = 1
 MEAS_L = 2
@@ -61,7 +64,7 @@ class CustomItem:
             data = []
             for x in data_str:
                 try:
-                    num = eval(x)
+                    num = misc.evaluate(x)
                     data.append(num)
                 except:
                     data.append(0)
@@ -106,6 +109,15 @@ class CustomItem:
             else:
                 return [total]
                 
+        def total_func_batch(matrix,integer,userdata=None):
+            # Evaluate product of non-zero values of all records
+            data = matrix[:,2:6]
+            nonzero = data != 0
+            total = misc.numpy.where(nonzero, data, 1).prod(axis=1)
+            total = misc.numpy.where(nonzero.any(axis=1), total, 0)
+            total_integer = (integer[:,2:6] | ~nonzero).all(axis=1)
+            return [round(misc.sequential_sum(total, total_integer),3)]
+
         def latex_postproc_func(item_list,userdata,latex_buffer,isabstract=False):
             # Do nothing return as it is
             return latex_buffer
@@ -124,6 +136,7 @@ class CustomItem:
         self.cust_funcs = [None, callback_breakup, None, None, None, None, callback_total_item]
         self.total_func = total_func
         self.total_func_item = total_func_item
+        self.total_func_batch = total_func_batch
         self.latex_postproc_func = latex_postproc_func
         self.export_abstract = None
         self.dimensions = [[200,150,80,80,80,80,100], [True,False,False,False,False,False,False]]
@@ -22,6 +22,9 @@
 #
 #
 
+# Local module import
+from ... import misc
+
 # Item codes for schedule dialog * DONT CHANGE *
 MEAS_NO = 1
 MEAS_L = 2
@@ -102,6 +105,10 @@ class CustomItem:
         def total_func_item(values):
             return values[1:9]
                 
+        def total_func_batch(matrix,integer,userdata=None):
+            total = misc.sequential_sum(matrix[:,1:9], integer[:,1:9])
+            return [round(t,3) for t in total]
+
         def latex_postproc_func(item_list,userdata,latex_buffer,isabstract=False):
             # Do nothing return as it is
             return latex_buffer
@@ -120,6 +127,7 @@ class CustomItem:
         self.cust_funcs = [None, None, None, None, None, None, None, None, None]
         self.total_func = total_func
         self.total_func_item = total_func_item
+        self.total_func_batch = total_func_batch
         self.latex_postproc_func = latex_postproc_func
         self.export_abstract = None
         self.dimensions = [[200,80,80,80,80,80,80,80,80], [True,False,False,False,False,False,False,False,False]]
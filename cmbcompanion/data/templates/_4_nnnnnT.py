@@ -22,6 +22,9 @@
 #
 #
 
+# Local module import
+from ... import misc
+
 # Item codes for schedule dialog * DONT CHANGE *
 MEAS_NO = 1
 MEAS_L = 2
@@ -61,7 +64,7 @@ class CustomItem:
             data = []
             for x in data_str:
                 try:
-                    num = eval(x)
+                    num = misc.evaluate(x)
                     data.append(num)
                 except:
                     data.append(0)
@@ -94,6 +97,19 @@ class CustomItem:
             else:
                 return [total]
                 
+        def total_func_batch(matrix,integer,userdata=None):
+            # Evaluate totals of all records
+            item_total = matrix[:,1].copy()
+            for i in range(2,6):
+                item_total += matrix[:,i]
+            # Running total rounded per record as in total_func
+            total = 0
+            for t in item_total.tolist():
+                total = round(total + t,3)
+            if integer[:,1:6].all():
+                total = int(total)
+            return [total]
+
         def latex_postproc_func(item_list,userdata,latex_buffer,isabstract=False):
             # Do nothing return as it is
             return latex_buffer
@@ -112,6 +128,7 @@ class CustomItem:
         self.cust_funcs = [None, None, None, None, None, None, callback_total_item]
         self.total_func = total_func
         self.total_func_item = total_func_item
+        self.total_func_batch = total_func_batch
         self.latex_postproc_func = latex_postproc_func
         self.export_abstract = None
         self.dimensions = [[200,80,80,80,80,80,100], [True,False,False,False,False,False,False]]
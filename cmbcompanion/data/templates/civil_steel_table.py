@@ -22,26 +22,24 @@
 #
 #
 
+# Local module import
+from ... import misc
+
 # Standard conviniance functions * DONT CHANGE *
 
 def replace_all(text, dic):
-    for i, j in dic.items():
-        j = clean_latex(j)
-        text = text.replace(i, j)
-    return text
+    latex_file = misc.LatexFile(text)
+    latex_file.replace_and_clean(dic)
+    return latex_file.get_buffer()
 
 
 def replace_all_vanilla(text, dic):
-    for i, j in dic.items():
-        text = text.replace(i, j)
-    return text
+    latex_file = misc.LatexFile(text)
+    latex_file.replace(dic)
+    return latex_file.get_buffer()
 
 def clean_latex(text):
-    for splchar, replspelchar in zip(['\\', '#', '$', '%', '^', '&', '_', '{', '}', '~', '\n'],
-                                     ['\\textbackslash ', '\# ', '\$ ', '\% ', '\\textasciicircum ', '\& ', '\_ ',
-                                      '\{ ', '\} ', '\\textasciitilde ', '\\newline ']):
-        text = text.replace(splchar, replspelchar)
-    return text
+    return misc.clean_latex(text)
 
 # Item codes for schedule dialog * DONT CHANGE *
 MEAS_NO = 1
@@ -92,7 +90,7 @@ class CustomItem:
                     l = ''
                     for value in values[3:9]:
                         if value not in ['','0','0.0']:
-                            l += str(eval(value)) + ','
+                            l += str(misc.evaluate(value)) + ','
                     l = l[:-1]
             except:
                 l = ''
@@ -100,9 +98,9 @@ class CustomItem:
 
         def c_1(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[3])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[3])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -110,9 +108,9 @@ class CustomItem:
 
         def c_2(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[4])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[4])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -120,9 +118,9 @@ class CustomItem:
 
         def c_3(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[5])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[5])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -130,9 +128,9 @@ class CustomItem:
 
         def c_4(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[6])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[6])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -140,9 +138,9 @@ class CustomItem:
 
         def c_5(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[7])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[7])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -150,9 +148,9 @@ class CustomItem:
 
         def c_6(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[8])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[8])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -183,6 +181,19 @@ class CustomItem:
             total = [round(l*n,2) for l in data_l]
             return total
             
+        def total_func_batch(matrix,integer,userdata):
+            # Evaluate totals of all records
+            n = matrix[:,1]*matrix[:,2]
+            data_l = matrix[:,3:9]
+            total = misc.sequential_sum(misc.round_array(data_l*n[:,None],2))
+            grandtotal = 0
+            for (i,t) in enumerate(total):
+                try:
+                    grandtotal += t*float(userdata[6+i])
+                except:
+                    pass
+            return [round(grandtotal,3)]
+
         def export_abstract(item_list,userdata):
             total = [0]*6
             for item in item_list:
@@ -231,6 +242,7 @@ class CustomItem:
         self.cust_funcs = [None, None, None, None, None, None, None, None, None, c_def,c_1,c_2,c_3,c_4,c_5,c_6]
         self.total_func = total_func
         self.total_func_item = total_func_item
+        self.total_func_batch = total_func_batch
         self.latex_postproc_func = latex_postproc_func
         self.export_abstract = None
         self.dimensions = [[200,40,40,50,50,50,50,50,50,100,50,50,50,50,50,50], [True,False,False,False,False,False,False,False,False,False,False,False,False,False,False,False]]
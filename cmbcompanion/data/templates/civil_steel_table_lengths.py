@@ -22,6 +22,9 @@
 #
 #
 
+# Local module import
+from ... import misc
+
 # Item codes for schedule dialog * DONT CHANGE *
 MEAS_NO = 1
 MEAS_L = 2
@@ -73,7 +76,7 @@ class CustomItem:
                     l = ''
                     for value in values[3:9]:
                         if value not in ['','0','0.0']:
-                            l += str(eval(value)) + ','
+                            l += str(misc.evaluate(value)) + ','
                     l = l[:-1]
             except:
                 l = ''
@@ -81,9 +84,9 @@ class CustomItem:
 
         def c_1(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[3])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[3])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -91,9 +94,9 @@ class CustomItem:
 
         def c_2(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[4])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[4])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -101,9 +104,9 @@ class CustomItem:
 
         def c_3(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[5])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[5])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -111,9 +114,9 @@ class CustomItem:
 
         def c_4(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[6])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[6])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -121,9 +124,9 @@ class CustomItem:
 
         def c_5(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[7])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[7])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -131,9 +134,9 @@ class CustomItem:
 
         def c_6(values,row=None):
             try:
-                n1 = eval(values[1])
-                n2 = eval(values[2])
-                l = eval(values[8])
+                n1 = misc.evaluate(values[1])
+                n2 = misc.evaluate(values[2])
+                l = misc.evaluate(values[8])
                 total = round(n1*n2*l,2)
             except:
                 total = 0
@@ -164,6 +167,19 @@ class CustomItem:
             total = [round(l*n,2) for l in data_l]
             return total
 
+        def total_func_batch(matrix,integer,userdata):
+            # Evaluate totals of all records
+            n = matrix[:,1]*matrix[:,2]
+            data_l = matrix[:,3:9]
+            total = misc.sequential_sum(misc.round_array(data_l*n[:,None],2))
+            grandtotal = 0
+            for (i,t) in enumerate(total):
+                try:
+                    grandtotal += t*float(userdata[6+i])
+                except:
+                    pass
+            return [round(grandtotal,3)]
+
         def export_abstract(item_list,userdata):
             total = [0]*6
             for item in item_list:
@@ -212,6 +228,7 @@ class CustomItem:
         self.cust_funcs = [None, None, None, None, None, None, None, None, None, c_def,c_1,c_2,c_3,c_4,c_5,c_6]
         self.total_func = total_func
         self.total_func_item = total_func_item
+        self.total_func_batch = total_func_batch
         self.latex_postproc_func = latex_postproc_func
         self.export_abstract = export_abstract
         self.dimensions = [[200,40,40,50,50,50,50,50,50,100,50,50,50,50,50,50], [True,False,False,False,False,False,False,False,False,False,False,False,False,False,False,False]]
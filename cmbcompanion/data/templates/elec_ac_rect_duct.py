@@ -22,6 +22,9 @@
 #
 #
 
+# Local module import
+from ... import misc
+
 # Item codes for schedule dialog * DONT CHANGE *
 MEAS_NO = 1
 MEAS_L = 2
@@ -61,7 +64,7 @@ class CustomItem:
             data = []
             for x in data_str:
                 try:
-                    num = eval(x)
+                    num = misc.evaluate(x)
                     data.append(num)
                 except:
                     data.append(0)
@@ -83,6 +86,12 @@ class CustomItem:
             total = round((data[0]+data[1]+data[2]+data[3])*(data[4]+data[5])/2000000.0,3)
             return [total]
                 
+        def total_func_batch(matrix,integer,userdata=None):
+            # Evaluate totals of all records
+            data = matrix[:,1:7]
+            total = misc.round_array((data[:,0]+data[:,1]+data[:,2]+data[:,3])*(data[:,4]+data[:,5])/2000000.0,3)
+            return [misc.sequential_sum(total)]
+
         def latex_postproc_func(item_list,userdata,latex_buffer,isabstract=False):
             # Do nothing return as it is
             return latex_buffer
@@ -102,6 +111,7 @@ class CustomItem:
         self.cust_funcs = [None, None, None, None, None, None, None, callback_total_item]
         self.total_func = total_func
         self.total_func_item = total_func_item
+        self.total_func_batch = total_func_batch
         self.latex_postproc_func = latex_postproc_func
         self.export_abstract = None
         self.dimensions = [[300,80,80,80,80,80,80,100], [True,False,False,False,False,False,False,False]]
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# jobs.py
+#
+#  Copyright 2014 Manu Varkey <manuvarkey@gmail.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import os, logging, json, shutil, threading, collections, concurrent.futures, uuid, time
+
+from . import data, misc
+
+# Get logger object
+log = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_ERROR = 'error'
+JOB_CANCELLED = 'cancelled'
+
+# Job types supported
+JOB_KINDS = ['cmb', 'bill', 'cmb_xlsx', 'bill_xlsx']
+
+# Extensions of files served as job outputs
+JOB_ARTIFACT_EXTENSIONS = ['.pdf', '.xlsx']
+
+
+class RenderJob:
+    """Render or export job run on a snapshot of a project"""
+
+    def __init__(self, session_id, kind, path, model, project_settings, work_folder, jobs_folder):
+        """Initialise job
+
+            Arguments:
+                session_id: Id of session submitting job
+                kind: One of JOB_KINDS
+                path: Path of CMB or bill
+                model: Snapshot of data model of project as JSON string
+                project_settings: Snapshot of project settings
+                work_folder: Folder rendered into, shared by jobs of session
+                jobs_folder: Folder under which output folder of job is created
+        """
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.kind = kind
+        self.path = path
+        self.model = model
+        self.datamodel = None  # Data model built from model when job is run
+        self.project_settings = project_settings
+        self.work_folder = work_folder
+        self.folder = os.path.join(jobs_folder, self.id)  # Output folder, outputs of job are copied here
+        self.status = JOB_QUEUED
+        self.message = ''
+        self.artifacts = []  # Filenames of outputs in folder
+        self.created = time.time()
+        self.monitor = misc.RenderMonitor()
+
+    def get_status(self):
+        """Returns dict describing job state"""
+        return {'job_id': self.id,
+                'kind': self.kind,
+                'path': self.path,
+                'status': self.status,
+                'message': self.message,
+                'artifacts': self.artifacts}
+
+    def is_finished(self):
+        return self.status in [JOB_DONE, JOB_ERROR, JOB_CANCELLED]
+
+    def run(self):
+        """Run job in work folder, returns status code and message
+
+            Filenames of outputs of job are recorded in monitor.outputs.
+        """
+        self.datamodel = data.datamodel.DataModel(json.loads(self.model)[1])
+        self.model = None
+        if self.kind == 'cmb':
+            return self.datamodel.render_cmb(self.work_folder, self.project_settings, self.path, True, self.monitor)
+        elif self.kind == 'bill':
+            return self.datamodel.render_bill(self.work_folder, self.project_settings, self.path, True, self.monitor)
+        elif self.kind == 'cmb_xlsx':
+            self.datamodel.update()
+            filename = self.datamodel.render_cmb_spreadsheet(self.work_folder, self.path[0])
+            self.monitor.add_output(filename)
+            return (misc.CMB_INFO, 'CMB No.' + self.datamodel.cmbs[self.path[0]].get_name() + ' exported successfully')
+        elif self.kind == 'bill_xlsx':
+            self.datamodel.update()
+            bill = self.datamodel.bills[self.path[0]]
+            filename = misc.posix_path(self.work_folder, 'bill_' + str(self.path[0] + 1) + '.xlsx')
+            bill.export_spreadsheet_bill(filename, self.project_settings, self.datamodel.schedule)
+            self.monitor.add_output(filename)
+            return (misc.CMB_INFO, 'Bill: ' + bill.data.title + ' exported successfully')
+
+    def collect_outputs(self):
+        """Copy outputs of job from work folder to output folder of job"""
+        os.makedirs(self.folder, exist_ok=True)
+        for filename in self.monitor.outputs:
+            if os.path.splitext(filename)[1] in JOB_ARTIFACT_EXTENSIONS and os.path.exists(filename):
+                shutil.copy2(filename, self.folder)
+                self.artifacts.append(os.path.basename(filename))
+        self.artifacts.sort()
+
+
+class JobQueue:
+    """Runs render jobs on a bounded pool of worker threads
+
+        Jobs of a session render into a shared work folder so that the
+        render cache is reused across jobs, and are run one at a time per
+        session. Outputs of each job are then copied to a folder of its own.
+    """
+
+    def __init__(self, folder, workers, max_jobs, notify=None):
+        """Initialise job queue
+
+            Arguments:
+                folder: Folder under which output folders of sessions are created
+                workers: Number of jobs run in parallel
+                max_jobs: Number of finished jobs retained for status and download
+                notify: Optional function called with job on every change of job state
+        """
+        self.folder = folder
+        self.max_jobs = max_jobs
+        self.notify = notify
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.jobs = collections.OrderedDict()  # Job id mapped to job
+        self.folder_locks = collections.defaultdict(threading.Lock)  # Work folder mapped to lock
+        self.lock = threading.Lock()  # Guards jobs and folder_locks
+
+    def get_folder(self, session_id):
+        """Returns work folder of session"""
+        return os.path.join(self.folder, session_id + '_output')
+
+    def get_jobs_folder(self, session_id):
+        """Returns folder holding output folders of jobs of session"""
+        return os.path.join(self.folder, session_id + '_jobs')
+
+    def submit(self, session_id, kind, path, project):
+        """Add job for rendering snapshot of project, called with project locked
+
+            The data model is snapshot as a JSON dump, the data model to be
+            rendered is built from it by the worker running the job.
+
+            Arguments:
+                session_id: Id of session submitting job
+                kind: One of JOB_KINDS
+                path: Path of CMB or bill
+                project: Project to be rendered
+            Returns:
+                Job added
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError('Bad job type - ' + str(kind))
+        if kind in ['cmb', 'cmb_xlsx'] and not path[0] < len(project.datamodel.cmbs):
+            raise ValueError('Bad CMB path - ' + str(path))
+        if kind in ['bill', 'bill_xlsx'] and not path[0] < len(project.datamodel.bills):
+            raise ValueError('Bad bill path - ' + str(path))
+        model = json.dumps(project.datamodel.get_model())
+        job = RenderJob(session_id, kind, path, model, dict(project.project_settings),
+                        self.get_folder(session_id), self.get_jobs_folder(session_id))
+        job.monitor.callback = lambda message: self.set_status(job, job.status, message)
+        with self.lock:
+            self.jobs[job.id] = job
+            # Drop oldest finished jobs
+            finished = [job_id for job_id, item in self.jobs.items() if item.is_finished()]
+            dropped = [self.jobs.pop(job_id) for job_id in finished[0:max(len(self.jobs) - self.max_jobs, 0)]]
+        for item in dropped:
+            shutil.rmtree(item.folder, ignore_errors=True)
+        log.info('JobQueue - submit - ' + str([job.id, kind, path]))
+        self.set_status(job, JOB_QUEUED, 'Job queued')
+        self.executor.submit(self.run, job)
+        return job
+
+    def get(self, job_id, session_id):
+        """Returns job of session, None if not existing"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None and job.session_id == session_id:
+            return job
+        return None
+
+    def cancel(self, job):
+        """Cancel job, terminating running latex processes"""
+        log.info('JobQueue - cancel - ' + job.id)
+        job.monitor.cancel()
+        if job.status == JOB_QUEUED:
+            self.set_status(job, JOB_CANCELLED, 'Job cancelled')
+
+    def set_status(self, job, status, message):
+        """Update state of job and notify"""
+        job.status = status
+        job.message = message
+        if self.notify is not None:
+            try:
+                self.notify(job)
+            except:
+                log.exception('JobQueue - set_status - Error notifying job status')
+
+    def run(self, job):
+        """Run job in worker thread"""
+        if job.monitor.cancelled:
+            return
+        with self.lock:
+            folder_lock = self.folder_locks[job.work_folder]
+        with folder_lock:
+            if job.monitor.cancelled:
+                return
+            self.set_status(job, JOB_RUNNING, 'Job started')
+            try:
+                os.makedirs(job.work_folder, exist_ok=True)
+                code, message = job.run()
+                if code != misc.CMB_ERROR and not job.monitor.cancelled:
+                    job.collect_outputs()
+            except:
+                log.exception('JobQueue - run - Error running job - ' + job.id)
+                code, message = (misc.CMB_ERROR, 'Error running job')
+            job.datamodel = None  # Release snapshot
+            job.model = None
+            if job.monitor.cancelled:
+                self.set_status(job, JOB_CANCELLED, 'Job cancelled')
+            elif code == misc.CMB_ERROR:
+                self.set_status(job, JOB_ERROR, message)
+            else:
+                self.set_status(job, JOB_DONE, message)
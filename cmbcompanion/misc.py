@@ -22,9 +22,16 @@
 #  
 #  
 
-import subprocess, threading, os, posixpath, platform, logging
+import subprocess, threading, os, posixpath, platform, logging, ast, operator, math, functools, hashlib, json, re
+import concurrent.futures
 import openpyxl
 
+# Optional modules
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Setup logger object
 log = logging.getLogger(__name__)
 
@@ -56,6 +63,12 @@ MEAS_COLOR_NORMAL = '#FFFFFF'
 MEAS_COLOR_SELECTED = '#729FCF'
 # Timeout for killing Latex subprocess
 LATEX_TIMEOUT = 300 # 5 minutes
+# Maximum number of Latex passes run for resolving cross references
+LATEX_MAX_PASSES = 5
+# Number of Latex sub-processes run in parallel
+LATEX_WORKERS = os.cpu_count() or 1
+# Filename of render cache stored in output folder
+RENDER_CACHE_FILENAME = '.render_cache.json'
 # Item description wrap-width for screen purpose
 CMB_DESCRIPTION_WIDTH = 60
 CMB_DESCRIPTION_MAX_LENGTH = 1000
@@ -66,6 +79,22 @@ INT_ITEMS = ['point', 'points', 'pnt', 'pnts', 'number', 'numbers', 'no', 'nos',
              'lump', 'lumpsum', 'lump-sum', 'lump sum', 'ls', 'each','job','jobs','set','sets',
              'pair','pairs',
              'pnt.', 'no.', 'nos.', 'l.s.', 'l.s']
+# Maximum number of parsed expressions cached by evaluate()
+EXPR_CACHE_SIZE = 16384
+# Limit on size in bits of integer results of evaluated expressions
+EXPR_MAX_BITS = 4096
+# Regular expression matching placeholders in latex templates
+LATEX_PLACEHOLDER = re.compile(r'\$\w+\$')
+# Latex commands for special charachters
+LATEX_ESCAPES = {'\\': '\\textbackslash ', '#': '\\# ', '$': '\\$ ', '%': '\\% ',
+                 '^': '\\textasciicircum ', '&': '\\& ', '_': '\\_ ', '{': '\\{ ',
+                 '}': '\\} ', '~': '\\textasciitilde ', '\n': '\\newline '}
+# Regular expression matching special charachters in latex
+LATEX_SPECIAL = re.compile('[' + re.escape(''.join(LATEX_ESCAPES)) + ']')
+# Maximum number of strings cached by clean_latex()
+LATEX_CLEAN_CACHE_SIZE = 16384
+# Translation table of special charachters in markup
+MARKUP_ESCAPE_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
 # String used for checking file version
 PROJECT_FILE_VER = 'CMBAUTOMISER_FILE_REFERENCE_VER_3'
 # Item codes for project global variables
@@ -117,6 +146,7 @@ class Spreadsheet:
         else:
             self.spreadsheet = openpyxl.Workbook()
         self.sheet = self.spreadsheet.active
+        self.row_counts = dict()  # Write cursor of each sheet
     
     def save(self, filename):
         """Save worksheet to file"""
@@ -134,7 +164,14 @@ class Spreadsheet:
         
     def length(self):
         """Get number of rows in sheet"""
-        return len(self.sheet.rows)
+        if self.sheet not in self.row_counts:
+            self.row_counts[self.sheet] = len(self.sheet.rows)
+        return self.row_counts[self.sheet]
+        
+    def extend_rows(self, row):
+        """Advance write cursor of sheet to include row"""
+        if row > self.length():
+            self.row_counts[self.sheet] = row
         
     def set_title(self, title):
         """Set title of sheet"""
@@ -166,6 +203,7 @@ class Spreadsheet:
         alignment = openpyxl.styles.Alignment(wrap_text=wrap_text, horizontal=horizontal)
         self.sheet.cell(row=row, column=col).font = font
         self.sheet.cell(row=row, column=col).alignment = alignment
+        self.extend_rows(row)
         
     # Data addition functions
             
@@ -173,16 +211,51 @@ class Spreadsheet:
         """Append an sheet to current sheet"""
         sheet = ss_obj.spreadsheet.active
         rowcount = self.length()
-        for row_no, row in enumerate(sheet.rows, 1):
-            for col_no, cell in enumerate(row, 1):
-                self.sheet.cell(row=row_no+rowcount, column=col_no).value = cell.value
-                self.sheet.cell(row=row_no+rowcount, column=col_no).style = cell.style
+        styles = dict()  # Styles of sheet mapped to current spreadsheet
+        for (row_no, col_no), cell in sorted(sheet._cells.items()):
+            new_cell = self.sheet.cell(row=row_no+rowcount, column=col_no)
+            new_cell.value = cell.value
+            if cell.has_style:
+                style = tuple(cell._style)
+                if style not in styles:
+                    styles[style] = self.copy_style(cell._style, ss_obj.spreadsheet)
+                new_cell._style = openpyxl.styles.styleable.StyleArray(styles[style])
+        self.extend_rows(rowcount + len(sheet.rows))
+        
+    def copy_style(self, style, spreadsheet):
+        """Map style array of a cell in spreadsheet to current spreadsheet
+        
+            Arguments:
+                style: StyleArray of cell
+                spreadsheet: Workbook containing the cell
+        """
+        new_style = openpyxl.styles.styleable.StyleArray()
+        for key, collection in [('fontId', '_fonts'), ('fillId', '_fills'), ('borderId', '_borders'),
+                                ('protectionId', '_protections'), ('alignmentId', '_alignments')]:
+            value = getattr(spreadsheet, collection)[getattr(style, key)]
+            setattr(new_style, key, getattr(self.spreadsheet, collection).add(value))
+        if style.numFmtId < 164:
+            new_style.numFmtId = style.numFmtId
+        else:
+            number_format = spreadsheet._number_formats[style.numFmtId - 164]
+            new_style.numFmtId = self.spreadsheet._number_formats.add(number_format) + 164
+        return new_style
                 
     def append_data(self, data, bold=False, wrap_text=True, horizontal='general'):
         """Append data to current sheet"""
         rowcount = self.length()
         self.insert_data(data, rowcount+1, 1, bold, wrap_text, horizontal)
     
+    def append_rows(self, rows):
+        """Append data from an iterable of (data, style) pairs
+        
+            Arguments:
+                rows: Iterable of (data, style) pairs, style being a dict of
+                      keyword arguments to append_data
+        """
+        for data, style in rows:
+            self.append_data(data, **style)
+    
     def insert_data(self, data, start_row=1, start_col=1, bold=False, wrap_text=True, horizontal='general'):
         """Insert data to current sheet"""
         # Setup styles
@@ -194,6 +267,7 @@ class Spreadsheet:
                 self.sheet.cell(row=row_no, column=col_no).value = value
                 self.sheet.cell(row=row_no, column=col_no).font = font
                 self.sheet.cell(row=row_no, column=col_no).alignment = alignment
+            self.extend_rows(row_no)
                 
     def add_merged_cell(self, value, row=None, width=2, bold=False, wrap_text=True, horizontal='general'):
         """Add a merged cell of prescrbed width"""
@@ -208,9 +282,11 @@ class Spreadsheet:
     def __setitem__(self, index, value):
         """Set an individual cell"""
         self.sheet.cell(row=index[0], column=index[1]).value = value
+        self.extend_rows(index[0])
         
     def __getitem__(self, index):
         """Set an individual cell"""
+        self.extend_rows(index[0])
         return self.sheet.cell(row=index[0], column=index[1]).value
             
     # Bulk read functions
@@ -261,26 +337,163 @@ class Spreadsheet:
         return items
 
 
+class StreamingSpreadsheet:
+    """Write a single sheet straight to file using a write-only workbook
+    
+        Supports the write methods of Spreadsheet used for appending data.
+        Sheet title and column widths must be set before appending data
+        and rows cannot be modified once appended.
+    """
+    
+    def __init__(self):
+        self.spreadsheet = openpyxl.Workbook(write_only=True)
+        self.sheet = self.spreadsheet.create_sheet()
+        self.styles = dict()  # Shared style arrays by style arguments
+        
+    def save(self, filename):
+        """Save worksheet to file"""
+        self.spreadsheet.save(filename)
+        
+    def length(self):
+        """Get number of rows in sheet"""
+        return self.sheet._max_row
+        
+    def set_title(self, title):
+        """Set title of sheet"""
+        self.sheet.title = title
+        
+    def set_column_widths(self, widths):
+        """Set column widths of sheet"""
+        for column, width in enumerate(widths, 1):
+            col_letter = openpyxl.cell.get_column_letter(column)
+            self.sheet.column_dimensions[col_letter].width = width
+            
+    def get_style(self, bold=False, wrap_text=True, horizontal='general'):
+        """Get style array shared by all cells of given style"""
+        key = (bold, wrap_text, horizontal)
+        if key not in self.styles:
+            cell = openpyxl.writer.write_only.WriteOnlyCell(self.sheet)
+            cell.font = openpyxl.styles.Font(bold=bold)
+            cell.alignment = openpyxl.styles.Alignment(wrap_text=wrap_text, horizontal=horizontal)
+            self.styles[key] = cell._style
+        return self.styles[key]
+        
+    def make_row(self, values, style, skip_empty=True):
+        """Get a row of styled cells for writing
+        
+            Arguments:
+                values: List of cell values
+                style: Style array of cells
+                skip_empty: Skip cells with value None if True
+        """
+        row = []
+        for value in values:
+            if value is None and skip_empty:
+                row.append(None)
+            else:
+                cell = openpyxl.writer.write_only.WriteOnlyCell(self.sheet, value)
+                cell._style = openpyxl.styles.styleable.StyleArray(style)
+                row.append(cell)
+        return row
+        
+    def append_rows(self, rows):
+        """Append data from an iterable of (data, style) pairs
+        
+            Arguments:
+                rows: Iterable of (data, style) pairs, style being a dict of
+                      keyword arguments to append_data
+        """
+        for data, style in rows:
+            self.append_data(data, **style)
+                
+    def append_data(self, data, bold=False, wrap_text=True, horizontal='general'):
+        """Append data to sheet"""
+        style = self.get_style(bold, wrap_text, horizontal)
+        for row in data:
+            self.sheet.append(self.make_row(row, style))
+            
+    def add_merged_cell(self, value, width=2, bold=False, wrap_text=True, horizontal='general'):
+        """Add a cell spanning prescribed width
+        
+            Cells cannot be merged in write-only sheets, a centered cell is
+            centered across the following empty cells instead.
+        """
+        if horizontal == 'center':
+            horizontal = 'centerContinuous'
+        style = self.get_style(bold, wrap_text, horizontal)
+        self.sheet.append(self.make_row([value] + [None]*(width-1), style, False))
+
+
+class LatexTemplate:
+    """Latex code with $name$ placeholders parsed once for repeated rendering"""
+    
+    def __init__(self, text):
+        self.text = text
+        # Literal text and placeholder names alternate, starting with text
+        self.parts = LATEX_PLACEHOLDER.split(text)
+        self.names = LATEX_PLACEHOLDER.findall(text)
+        
+    def render(self, dic_clean=None, dic=None):
+        """Render template in a single pass
+        
+            Placeholders not in either dictionary are retained.
+            
+            Arguments:
+                dic_clean: Dictionary of values to be cleaned of special charachters
+                dic: Dictionary of values containing latex code
+        """
+        dic_clean = dic_clean or {}
+        dic = dic or {}
+        buffer = [self.parts[0]]
+        for name, text in zip(self.names, self.parts[1:]):
+            if name in dic_clean:
+                buffer.append(clean_latex(dic_clean[name]))
+            else:
+                buffer.append(dic.get(name, name))
+            buffer.append(text)
+        return ''.join(buffer)
+
+
 class LatexFile:
-    """Class for formating and rendering of latex code"""
+    """Class for formating and rendering of latex code
+    
+        Latex code is stored as a list of chunks joined only when the buffer
+        is read, so that appending is linear in the size of the document.
+    """
     
     def __init__(self, latex_buffer = ""):
-        self.latex_buffer = latex_buffer
+        self.chunks = [latex_buffer]
     
     # Inbuilt methods
 
     def clean_latex(self, text):
-        """Replace special charchters with latex commands"""
-        for splchar, replspelchar in zip(['\\', '#', '$', '%', '^', '&', '_', '{', '}', '~', '\n'],
-                                         ['\\textbackslash ', '\# ', '\$ ', '\% ', '\\textasciicircum ', '\& ', '\_ ',
-                                          '\{ ', '\} ', '\\textasciitilde ', '\\newline ']):
-            text = text.replace(splchar, replspelchar)
-        return text
+        """Replace special charachters with latex commands"""
+        return clean_latex(text)
         
     # Operator overloading
     
     def __add__(self,other):
-        return LatexFile(self.latex_buffer + '\n' + other.latex_buffer)
+        latex_file = LatexFile()
+        latex_file.chunks = self.chunks + ['\n'] + other.chunks
+        return latex_file
+        
+    def __iadd__(self,other):
+        self.chunks.append('\n')
+        self.chunks.extend(other.chunks)
+        return self
+        
+    # Properties
+    
+    @property
+    def latex_buffer(self):
+        """Underlying latex buffer, chunks are joined on read"""
+        if len(self.chunks) > 1:
+            self.chunks = [''.join(self.chunks)]
+        return self.chunks[0]
+        
+    @latex_buffer.setter
+    def latex_buffer(self, value):
+        self.chunks = [value]
         
     # Public members
     
@@ -290,32 +503,27 @@ class LatexFile:
             
     def add_preffix_from_file(self,filename):
         """Add a latex file as preffix"""
-        latex_file = open(filename,'r')
-        self.latex_buffer = latex_file.read() + '\n' + self.latex_buffer
-        latex_file.close()
+        self.chunks[0:0] = [get_latex_template(filename).text, '\n']
         
     def add_suffix_from_file(self,filename):
         """Add a latex file as suffix"""
-        latex_file = open(filename,'r')
-        self.latex_buffer = self.latex_buffer + '\n' + latex_file.read()
-        latex_file.close()
+        self.chunks.extend(['\n', get_latex_template(filename).text])
         
     def replace_and_clean(self, dic):
         """Replace items as per dictionary after cleaning special charachters"""
-        for i, j in dic.items():
-            j = self.clean_latex(j)
-            self.latex_buffer = self.latex_buffer.replace(i, j)
+        if dic:
+            dic_clean = dict((key, clean_latex(value)) for key, value in dic.items())
+            self.latex_buffer = compile_keys(tuple(dic)).sub(lambda match: dic_clean[match.group()], self.latex_buffer)
 
     def replace(self, dic):
         """Replace items as per dictionary"""
-        for i, j in dic.items():
-            self.latex_buffer = self.latex_buffer.replace(i, j)
+        if dic:
+            self.latex_buffer = compile_keys(tuple(dic)).sub(lambda match: dic[match.group()], self.latex_buffer)
             
     def write(self, filename):
-        """Write latex file to disk"""
-        file_latex = open(filename,'w')
-        file_latex.write(self.latex_buffer)
-        file_latex.close()
+        """Write latex file to disk, chunks are written without joining"""
+        with open(filename,'w') as file_latex:
+            file_latex.writelines(self.chunks)
 
 
 class Command(object):
@@ -325,11 +533,16 @@ class Command(object):
         """Initialises class with command to be executed"""
         self.cmd = cmd
         self.process = None
+        self.terminated = False
+        self.lock = threading.Lock()  # Guards spawning and termination of process
 
     def run(self, timeout):
         """Run set command with selected timeout"""
         def target():
-            self.process = subprocess.Popen(self.cmd)
+            with self.lock:
+                if self.terminated:
+                    return
+                self.process = subprocess.Popen(self.cmd)
             log.info('Sub-process spawned - ' + str(self.process.pid))
             self.process.communicate()
         thread = threading.Thread(target=target)
@@ -338,10 +551,247 @@ class Command(object):
         thread.join(timeout)
         if thread.is_alive():
             log.error('Terminating sub-process exceeding timeout - ' + str(self.process.pid))
-            self.process.terminate()
+            self.terminate()
             thread.join()
             return -1
+        if self.terminated:
+            return -1
         return 0
+        
+    def terminate(self):
+        """Terminate command, command is not started if not running yet"""
+        with self.lock:
+            self.terminated = True
+            if self.process is not None and self.process.poll() is None:
+                log.info('Terminating sub-process - ' + str(self.process.pid))
+                self.process.terminate()
+
+
+class RenderMonitor:
+    """Reports progress of a render and allows cancelling it from another thread"""
+    
+    def __init__(self, callback=None):
+        """Initialises class with callback called with progress messages"""
+        self.callback = callback
+        self.cancelled = False
+        self.commands = set()  # Commands running for render
+        self.outputs = []  # Filenames of output documents of render
+        self.lock = threading.Lock()  # Guards commands
+        
+    def progress(self, message):
+        """Report progress message"""
+        log.info('RenderMonitor - progress - ' + message)
+        if self.callback is not None:
+            self.callback(message)
+            
+    def add_output(self, filename):
+        """Record filename of an output document, written or found up to date"""
+        if filename not in self.outputs:
+            self.outputs.append(filename)
+            
+    def add_command(self, command):
+        """Track running command, command is terminated if render is cancelled"""
+        with self.lock:
+            self.commands.add(command)
+            if self.cancelled:
+                command.terminate()
+                
+    def remove_command(self, command):
+        """Stop tracking command"""
+        with self.lock:
+            self.commands.discard(command)
+        
+    def cancel(self):
+        """Cancel render terminating all running commands"""
+        with self.lock:
+            self.cancelled = True
+            for command in self.commands:
+                command.terminate()
+
+
+class LatexScheduler:
+    """Runs Latex on a set of documents refering to each other
+    
+        All documents are run in the first pass. Within a pass documents are
+        run by stage and within a stage only after the documents they refer
+        to have been run, documents independent of each other being run in
+        parallel. Documents of an earlier stage refering to a document of a
+        later stage read its .aux file of the previous pass. In further passes
+        a document is run again only if its own .aux file or the .aux file of
+        a document it refers to changed in the previous pass, until all .aux
+        files are stable. Clean documents are skipped in the first pass and
+        run only if a document refered changes.
+    """
+    
+    def __init__(self, folder, workers=LATEX_WORKERS, monitor=None):
+        self.folder = folder
+        self.workers = workers
+        self.monitor = monitor  # Optional RenderMonitor
+        self.jobs = dict()  # Filename of document mapped to set of filenames refered
+        self.clean = set()  # Filenames of documents with up to date outputs
+        self.stages = dict()  # Filename of document mapped to stage
+        
+    def add_job(self, filename, depends=(), clean=False, stage=0):
+        """Add document to be run, duplicate documents are run once
+        
+            Arguments:
+                filename: Filename of .tex document
+                depends: Filenames of .tex documents refered by document
+                clean: Flag indicating outputs of document are up to date
+                stage: Documents of lower stages are run first in each pass
+        """
+        self.stages[filename] = min(stage, self.stages.get(filename, stage))
+        if not clean:
+            self.clean.discard(filename)
+        elif filename not in self.jobs:
+            self.clean.add(filename)
+        self.jobs.setdefault(filename, set()).update(depends)
+        
+    def read_aux(self, filename):
+        """Returns hash of .aux file of document, None if not existing"""
+        aux_filename = posix_path(self.folder, os.path.splitext(os.path.basename(filename))[0] + '.aux')
+        try:
+            with open(aux_filename, 'rb') as aux_file:
+                return hashlib.sha1(aux_file.read()).hexdigest()
+        except OSError:
+            return None
+            
+    def run_job(self, filename):
+        """Run a single Latex pass on document"""
+        latex_exec = Command([global_settings_dict['latex_path'], '-interaction=batchmode', '-output-directory=' + self.folder, filename])
+        if self.monitor is None:
+            return latex_exec.run(timeout=LATEX_TIMEOUT)
+        self.monitor.add_command(latex_exec)
+        try:
+            return latex_exec.run(timeout=LATEX_TIMEOUT)
+        finally:
+            self.monitor.remove_command(latex_exec)
+        
+    def get_layers(self, pending):
+        """Returns list of lists of documents to be run in order
+        
+            Documents in a layer refer only to documents in earlier layers of
+            the same stage, cycles of references within a stage are broken by
+            running a document early.
+        """
+        layers = []
+        for stage in sorted(set(self.stages[filename] for filename in pending)):
+            remaining = set(filename for filename in pending if self.stages[filename] == stage)
+            layers += self.get_stage_layers(remaining)
+        return layers
+        
+    def get_stage_layers(self, remaining):
+        """Returns list of lists of documents of a stage to be run in order"""
+        layers = []
+        while remaining:
+            layer = sorted(filename for filename in remaining 
+                           if not (self.jobs[filename] - {filename}) & remaining)
+            if not layer:
+                filename = min(remaining, key=lambda filename: (len(self.jobs[filename] & remaining), filename))
+                log.warning('LatexScheduler - get_stage_layers - Cyclic references - ' + str(filename))
+                layer = [filename]
+            layers.append(layer)
+            remaining.difference_update(layer)
+        return layers
+        
+    def run(self):
+        """Run Latex on all documents
+        
+            Returns (CMB_OK, None) on success and (CMB_ERROR, filename) on failure
+        """
+        aux = dict((filename, self.read_aux(filename)) for filename in self.jobs)
+        pending = sorted(set(self.jobs) - self.clean)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for count in range(LATEX_MAX_PASSES):
+                if not pending:
+                    break
+                log.info('LatexScheduler - run - Pass ' + str(count+1) + ' - ' + str(pending))
+                for layer in self.get_layers(pending):
+                    for filename, code in zip(layer, executor.map(self.run_job, layer)):
+                        if code != 0:
+                            return (CMB_ERROR, filename)
+                        if self.monitor is not None:
+                            self.monitor.progress('Latex pass ' + str(count+1) + ' completed - ' + os.path.basename(filename))
+                # Find documents with changed references
+                changed = set()
+                for filename in self.jobs:
+                    aux_new = self.read_aux(filename)
+                    if aux_new != aux[filename]:
+                        aux[filename] = aux_new
+                        changed.add(filename)
+                pending = sorted(filename for filename, depends in self.jobs.items()
+                                 if filename in changed or depends & changed)
+            else:
+                if pending:
+                    log.warning('LatexScheduler - run - References not stable after passes - ' + str(pending))
+        return (CMB_OK, None)
+
+
+class RenderCache:
+    """Cache of content hashes of rendered documents
+    
+        A hash of the inputs of each output file is stored in the output folder,
+        so that unchanged documents need not be rendered again.
+    """
+    
+    def __init__(self):
+        self.keys = dict()  # Folder mapped to dict of filenames and hashes
+        self.hits = 0
+        self.misses = 0
+        
+    def get_keys(self, folder):
+        """Returns dict of hashes stored for folder"""
+        if folder not in self.keys:
+            try:
+                with open(posix_path(folder, RENDER_CACHE_FILENAME), 'r') as cache_file:
+                    self.keys[folder] = json.load(cache_file)
+            except (OSError, ValueError):
+                self.keys[folder] = dict()
+        return self.keys[folder]
+        
+    def make_key(self, *args):
+        """Returns hash of string representation of arguments"""
+        key = hashlib.sha1()
+        for arg in args:
+            key.update(repr(arg).encode('utf-8'))
+            key.update(b'\0')
+        return key.hexdigest()
+        
+    def check(self, folder, filename, key, outputs):
+        """Returns True if stored hash matches and outputs exist
+        
+            Arguments:
+                folder: Output folder
+                filename: Filename of document
+                key: Hash of inputs of document
+                outputs: Filenames of outputs of document
+        """
+        if self.get_keys(folder).get(filename) == key and all(os.path.exists(output) for output in outputs):
+            self.hits += 1
+            return True
+        else:
+            self.misses += 1
+            return False
+            
+    def update(self, folder, filename, key):
+        """Store hash of inputs of document"""
+        self.get_keys(folder)[filename] = key
+        
+    def invalidate(self, folder, filename):
+        """Remove stored hash of document"""
+        self.get_keys(folder).pop(filename, None)
+        
+    def save(self, folder):
+        """Write stored hashes of folder to disk"""
+        try:
+            with open(posix_path(folder, RENDER_CACHE_FILENAME), 'w') as cache_file:
+                json.dump(self.get_keys(folder), cache_file)
+        except OSError:
+            log.warning('RenderCache - save - Render cache could not be written - ' + folder)
+            
+    def get_statistics(self):
+        """Returns dict of cache hits and misses"""
+        return {'hits': self.hits, 'misses': self.misses}
 
 
 ## GLOBAL METHODS
@@ -369,23 +819,124 @@ def posix_path(*args):
             return path
             
 def run_latex(folder, filename): 
-    """Runs latex on file to folder in two passes"""
+    """Runs latex on file to folder until references are resolved"""
     if filename is not None:
-        latex_exec = Command([global_settings_dict['latex_path'], '-interaction=batchmode', '-output-directory=' + folder, filename])
-        # First Pass
-        code = latex_exec.run(timeout=LATEX_TIMEOUT)
-        if code == 0:
-            # Second Pass
-            code = latex_exec.run(timeout=LATEX_TIMEOUT)
-            if code != 0:
-                return CMB_ERROR
-        else:
-            return CMB_ERROR
+        scheduler = LatexScheduler(folder)
+        scheduler.add_job(filename)
+        return scheduler.run()[0]
     return CMB_OK
 
+# Operators allowed in user entered arithmetic expressions
+_expr_binary_operators = {ast.Add: operator.add,
+                          ast.Sub: operator.sub,
+                          ast.Mult: operator.mul,
+                          ast.Div: operator.truediv}
+_expr_unary_operators = {ast.UAdd: operator.pos,
+                         ast.USub: operator.neg}
+
+def _evaluate_node(node):
+    """Recursively evaluate a parsed arithmetic expression node"""
+    if isinstance(node, ast.Constant):
+        if type(node.value) in (int, float):
+            return node.value
+    elif isinstance(node, ast.BinOp) and type(node.op) in _expr_binary_operators:
+        left = _evaluate_node(node.left)
+        right = _evaluate_node(node.right)
+        # Bound size of integer results before computing
+        if isinstance(node.op, ast.Mult) and isinstance(left, int) and isinstance(right, int):
+            if left.bit_length() + right.bit_length() > EXPR_MAX_BITS:
+                raise ValueError('Result out of range')
+        return _expr_binary_operators[type(node.op)](left, right)
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _expr_unary_operators:
+        return _expr_unary_operators[type(node.op)](_evaluate_node(node.operand))
+    raise ValueError('Unsupported expression element - ' + type(node).__name__)
+
+@functools.lru_cache(maxsize=EXPR_CACHE_SIZE)
+def _evaluate_cached(text):
+    """Evaluate expression string, returns None if not valid"""
+    try:
+        value = _evaluate_node(ast.parse(text.strip(), mode='eval').body)
+    except (SyntaxError, ValueError, TypeError, ArithmeticError, RecursionError):
+        return None
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def evaluate(text):
+    """Evaluate an arithmetic expression typed by user
+    
+        Only numbers, + - * / and brackets are allowed. Results are cached
+        by expression string.
+        
+        Raises:
+            ValueError: If text is not a valid expression
+    """
+    if isinstance(text, str):
+        value = _evaluate_cached(text)
+        if value is not None:
+            return value
+    raise ValueError('Invalid expression - ' + repr(text))
+
+def round_array(values, digits):
+    """Round a numpy array elementwise, matching the builtin round()
+    
+        numpy.round works on the scaled value and can differ from round() when
+        the scaled value falls close to a half, such elements are rounded
+        individually with round().
+        
+        Arguments:
+            values: numpy array of numbers
+            digits: Number of decimal digits
+    """
+    if values.dtype.kind != 'f':
+        return values
+    rounded = numpy.round(values, digits)
+    scaled = numpy.abs(values) * 10.0**digits
+    near_half = numpy.abs(scaled - numpy.floor(scaled) - 0.5) < 1e-6
+    for index in zip(*numpy.nonzero(near_half)):
+        rounded[index] = round(float(values[index]), digits)
+    return rounded
+
+def sequential_sum(values, integer=None):
+    """Sum a numpy array along its first axis in sequence
+    
+        Sums are accumulated element by element as in a plain loop so that
+        results match totals summed record by record. Returns a number for a
+        1-D array and a list of numbers for a 2-D array.
+        
+        Arguments:
+            values: numpy array of numbers
+            integer: Optional boolean numpy array marking integer values,
+                     sums of integers alone are returned as int
+    """
+    if len(values) == 0:
+        return numpy.zeros(values.shape[1:], int).tolist()
+    total = values.cumsum(axis=0)[-1].tolist()
+    if integer is not None:
+        if values.ndim == 1:
+            if integer.all():
+                total = int(total)
+        else:
+            total = [int(t) if is_int else t for t, is_int in zip(total, integer.all(axis=0))]
+    return total
+
+@functools.lru_cache(maxsize=None)
+def get_latex_template(filename):
+    """Returns LatexTemplate read from file, files are read once"""
+    with open(filename,'r') as latex_file:
+        return LatexTemplate(latex_file.read())
+
+@functools.lru_cache(maxsize=256)
+def compile_keys(keys):
+    """Returns regular expression matching any of the keys, longest first"""
+    return re.compile('|'.join(re.escape(key) for key in sorted(keys, key=len, reverse=True)))
+
+@functools.lru_cache(maxsize=LATEX_CLEAN_CACHE_SIZE)
+def clean_latex(text):
+    """Replace special charachters with latex commands, results are cached"""
+    return LATEX_SPECIAL.sub(lambda match: LATEX_ESCAPES[match.group()], text)
+
 def clean_markup(text):
     """Clear markup text of special characters"""
-    for splchar, replspelchar in zip(['&', '<', '>', ], ['&amp;', '&lt;', '&gt;']):
-        text = text.replace(splchar, replspelchar)
-    return text
+    return text.translate(MARKUP_ESCAPE_TABLE)
     
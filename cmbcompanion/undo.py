@@ -23,6 +23,7 @@ __author__ = 'David Townshend'
 __all__ = ['undoable', 'group', 'Stack', 'stack', 'setstack']
 
 import contextlib
+import threading
 
 from collections import deque
 
@@ -311,21 +312,21 @@ class Stack:
         return self._savepoint is None or self._savepoint != self.undocount()
 
 
-_stack = None
+# Stack in use is stored per thread so that threads serving different
+# projects do not push actions onto each other's stacks
+_local = threading.local()
 
 
 def stack():
-    ''' Return the currently used stack.
+    ''' Return the currently used stack of this thread.
     
     If no stack has been set, a new one is created and set.
     '''
-    global _stack
-    if _stack is None:
-        _stack = Stack()
-    return _stack
+    if getattr(_local, 'stack', None) is None:
+        _local.stack = Stack()
+    return _local.stack
 
 
 def setstack(stack):
-    ''' Set the undo stack to a specific `Stack` object.'''
-    global _stack
-    _stack = stack
+    ''' Set the undo stack of this thread to a specific `Stack` object.'''
+    _local.stack = stack
@@ -22,15 +22,15 @@
 #  
 #  
 
-import os, logging, copy, re
+import os, logging, re, ast, functools, uuid
 
 import flask, flask_socketio
 from werkzeug.utils import secure_filename
 
 from . import misc, undo
-from .data.measurement import MeasurementItemCustom, RecordCustom
+from .data.measurement import MeasurementItemCustom, MeasurementItemEdit, RecordCustom
 
-from cmbcompanion import app, project, socketio
+from cmbcompanion import app, projects, render_jobs, socketio
 
 # Get logger object
 log = logging.getLogger(__name__)
@@ -44,13 +44,117 @@ def remove_tags(text):
     new_text = re.sub('<[^>]*>', '', text)
     return new_text
     
-def render_measurement(path_str=None, activepath_str=None, softload=False):
+def parse_path(path_str):
+    """Convert a path string like '[0, 1, 2]' into a list of indices
+    
+        Returns None for 'None'. Raises ValueError for malformed paths.
+    """
+    if path_str is None or str(path_str) == 'None':
+        return None
+    try:
+        path = ast.literal_eval(str(path_str))
+    except (SyntaxError, ValueError):
+        raise ValueError('Bad path - ' + str(path_str))
+    if not isinstance(path, list) or not all(type(index) is int and index >= 0 for index in path):
+        raise ValueError('Bad path - ' + str(path_str))
+    return path
+    
+def get_session_id():
+    """Returns id of project session of user, a new id is assigned on first request"""
+    if 'project_id' not in flask.session:
+        flask.session['project_id'] = uuid.uuid4().hex
+    return flask.session['project_id']
+    
+def with_project(func):
+    """Decorator passing project of session of user as first argument
+    
+        The project is locked for the duration of the call.
+    """
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        with projects.session(get_session_id()) as project:
+            return func(project, *args, **kwargs)
+    return inner
+    
+def format_rendered_value(value):
+    """Format value of a rendered record cell for display"""
+    if value is None:
+        return ''
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+    
+def get_measitem_delta(measitem, rows):
+    """Returns changes in display of measurement item on editing records
+    
+        Only values of custom function columns of the edited records and
+        the item totals change on editing records.
+        
+        Arguments:
+            measitem: MeasurementItemCustom being edited
+            rows: Indices of records edited
+    """
+    records = []
+    for row in rows:
+        rendered = measitem[row].get_model_rendered(row)
+        columns = dict()
+        for column, columntype in enumerate(measitem.columntypes):
+            if columntype == misc.MEAS_CUST:
+                columns[str(column)] = format_rendered_value(rendered[column])
+        records.append({'row': row, 'columns': columns})
+    totals = [format_rendered_value(total) for total in measitem.get_total()]
+    return {'records': records, 'totals': totals}
+    
+def get_measitem_records(measitem, start, count):
+    """Returns range of records of measurement item for display
+    
+        Arguments:
+            measitem: MeasurementItemCustom being edited
+            start: Index of first record
+            count: Number of records
+    """
+    start = min(max(start, 0), measitem.length())
+    records = []
+    for row in range(start, min(start + count, measitem.length())):
+        record = measitem[row]
+        records.append({'values': record.get_model(),
+                        'rendered': [format_rendered_value(value) for value in record.get_model_rendered(row)]})
+    return {'start': start, 'length': measitem.length(), 'records': records}
+    
+def parse_measitem_edit(measitem, data):
+    """Returns cell edit as (row, column, value), None if not valid"""
+    row = data.get('row')
+    column = data.get('column')
+    if not (type(row) is int and 0 <= row < measitem.length() and type(column) is int and 0 <= column < measitem.model_width()):
+        log.error('parse_measitem_edit - Bad cell - ' + str([row, column]))
+        return None
+    return (row, column, remove_tags(str(data.get('html', ''))))
+    
+def apply_measitem_edits(project, session_id):
+    """Apply queued cell edits of project and send changes to clients of session"""
+    rows = project.apply_measitem_edits()
+    if rows:
+        socketio.emit('meas_item_delta', get_measitem_delta(project.global_settings['measitem'].get_item(), rows), to=session_id)
+        
+def apply_measitem_edits_delayed(session_id):
+    """Background task applying edits queued within the edit window in one pass"""
+    socketio.sleep(app.config['MEASITEM_EDIT_WINDOW'])
+    with projects.session(session_id) as project:
+        project.measitem_edits_scheduled = False
+        apply_measitem_edits(project, session_id)
+    
+def render_measurement(project, path_str=None, activepath_str=None, softload=False):
+    # Apply pending edits of measurement item
+    project.apply_measitem_edits()
     # Initialise variables
     if path_str == None:
         project.global_settings['current_page'] = '/measurements'
     else:
         project.global_settings['current_page'] = '/measurements/' + str(path_str)
-    activepath = eval(str(activepath_str))
+    try:
+        activepath = parse_path(activepath_str)
+    except ValueError:
+        activepath = None
     meas = dict()
     item_list = []
     item_paths = []
@@ -66,8 +170,8 @@ def render_measurement(path_str=None, activepath_str=None, softload=False):
     # Evaluate path
     if path_str is not None:
         try:
-            path = eval(path_str)
-        except:
+            path = parse_path(path_str)
+        except ValueError:
             log.error("Bad path specified")
             return flask.redirect(project.global_settings['current_page'])
     
@@ -114,49 +218,52 @@ def render_measurement(path_str=None, activepath_str=None, softload=False):
                 meas['measitem_path'] = [p1,p2,p3]
                 meas['measitem_name'] = flask.Markup('<b>#' + str(p3+1) + '</b>')
                 
-                # If item already loaded
-                if softload:
-                    items = project.global_settings['measitem'].get_model()[1][1]
-                else:
-                    project.global_settings['measitem'] = copy.deepcopy(measurement_item)
-                    items = measurement_item.get_model()[1][1]
-                meas['measitem_table'] = items
+                # If item already loaded continue edit session, else start new one
+                if not softload:
+                    project.global_settings['measitem'] = MeasurementItemEdit(measurement_item)
                 if not isinstance(measurement_item, MeasurementItemCustom):
                     return flask.redirect('/measurements/' + str(path[0:2]))
                 else:
-                    meas['measitem_captions'] = ['Sl.No.'] + measurement_item.captions
-                    meas['measitem_columntypes'] = measurement_item.columntypes
-                    item_itemnos = measurement_item.itemnos
-                    item_item_remarks = measurement_item.item_remarks
-                    meas['item_remark'] = measurement_item.remark
+                    measitem = project.global_settings['measitem'].get_item()
+                    # Last page of records, other records are fetched as scrolled into view
+                    page_size = app.config['MEASITEM_PAGE_SIZE']
+                    meas['measitem_records'] = get_measitem_records(measitem, max(measitem.length() - page_size, 0), page_size)
+                    meas['measitem_records']['columntypes'] = measitem.columntypes
+                    meas['measitem_records']['page_size'] = page_size
+                    meas['item_totals'] = [format_rendered_value(total) for total in measitem.get_total()]
+                    meas['measitem_captions'] = ['Sl.No.'] + measitem.captions
+                    item_itemnos = measitem.itemnos
+                    item_item_remarks = measitem.item_remarks
+                    meas['item_remark'] = measitem.remark
                     meas['item_itemnos_group'] = zip(item_itemnos, item_item_remarks)
-                    
-                    sch_items = []
-                    # Populate schedule for selection
-                    for itemno in project.datamodel.schedule.get_itemnos():
-                        item = project.datamodel.schedule[itemno]
-                        sch_items.append([item.itemno, item.extended_description_limited, item.unit, item.reference])
-                    meas['item_schedule'] = sch_items
+
         if len(path) > 3:
             return flask.redirect(project.global_settings['current_page'])
         
     meas['items'] = zip(item_paths, item_list)
 
-    return flask.render_template('measurements.html', active='measurements', meas=meas, settings=copy.deepcopy(project.global_settings))
+    return flask.render_template('measurements.html', active='measurements', meas=meas, settings=project.get_settings_view())
 
 ## Sockets,IO methods
 
 @socketio.on('measitem_save')
-def measitem_save():
+@with_project
+def measitem_save(project):
+    apply_measitem_edits(project, get_session_id())
     path = project.global_settings['measitem_path']
-    measitem = project.global_settings['measitem']
-    model = measitem.get_model()
-    project.datamodel.cmbs[path[0]][path[1]][path[2]].set_model(model)
+    edit = project.global_settings['measitem']
+    if edit.is_modified():
+        item = project.datamodel.cmbs[path[0]][path[1]][path[2]]
+        item.set_model(edit.get_item().get_model())
+        edit.reset(item)
+        project.datamodel.mark_dirty(path)
+        project.datamodel.update()
     
 @socketio.on('measitem_header_value_changed')
-def measitem_header_value_changed(data):
+@with_project
+def measitem_header_value_changed(project, data):
     print(data)
-    measitem = project.global_settings['measitem']
+    measitem = project.global_settings['measitem'].get_writable()
     if 'remark' in data:
         measitem.remark = str(data['remark'])
     elif 'item_remark' in data:
@@ -169,31 +276,45 @@ def measitem_header_value_changed(data):
     
     
 @socketio.on('measitem_value_changed')
-def measitem_value_changed(data):
-    row = data['row']
-    column = data['column']
-    value = remove_tags(data['html'])
-    
-    # Update duplicate item
-    measitem = project.global_settings['measitem']
-    record = measitem[row].get_model()
-    record[column] = value
-    measitem[row].set_model(record, measitem.cust_funcs, measitem.total_func_item, measitem.columntypes)
-    
-@socketio.on('measitem_page_refresh')
-def measitem_page_refresh():
-    measitem = project.global_settings['measitem']
-    items = []
-    for item in measitem:
-        items.append(item.get_model_rendered())
-    flask_socketio.emit('meas_item_update', items)
-            
+@with_project
+def measitem_value_changed(project, data):
+    edit = parse_measitem_edit(project.global_settings['measitem'].get_item(), data)
+    if edit is None:
+        return
+    # Queue edit, bursts of edits are applied together after edit window
+    project.queue_measitem_edit(edit)
+    if not project.measitem_edits_scheduled:
+        project.measitem_edits_scheduled = True
+        socketio.start_background_task(apply_measitem_edits_delayed, get_session_id())
+        
+@socketio.on('measitem_values_changed')
+@with_project
+def measitem_values_changed(project, data):
+    measitem = project.global_settings['measitem'].get_item()
+    for item in data.get('edits', []):
+        edit = parse_measitem_edit(measitem, item)
+        if edit is not None:
+            project.queue_measitem_edit(edit)
+    # Apply batch along with any queued edits
+    apply_measitem_edits(project, get_session_id())
+    
+@socketio.on('connect')
+def connect():
+    # Join room of session for receiving render job status
+    flask_socketio.join_room(get_session_id())
+    
+@socketio.on('render_job_cancel')
+def render_job_cancel(data):
+    job = render_jobs.get(str(data.get('job_id')), get_session_id())
+    if job is not None:
+        render_jobs.cancel(job)
     
 ## Route functions
 
 @app.route('/')
 @app.route('/index', methods=['GET', 'POST'])
-def index():
+@with_project
+def index(project):
     filename = None
     # Handle project file opening
     if flask.request.method == 'POST':
@@ -205,7 +326,7 @@ def index():
                 flask.flash('No Project file Selected','warning')
             elif file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                path = os.path.join(app.config['UPLOAD_FOLDER'], 'project.proj')
+                path = projects.get_project_filename(get_session_id())
                 file.save(path)
                 # Try opening project
                 if project.open_project(path):
@@ -215,23 +336,31 @@ def index():
                     project.global_settings['project_path'] = ''
                     flask.flash('Bad project file','danger')
     project.global_settings['current_page'] = '/'
-    return flask.render_template('index.html', active='index', filename=filename, settings=project.global_settings)
+    return flask.render_template('index.html', active='index', filename=filename, settings=project.get_settings_view())
 
 @app.route('/schedule')
-def schedule():
+@with_project
+def schedule(project):
     schedule = project.datamodel.schedule.get_model()
     project.global_settings['current_page'] = '/schedule'
-    return flask.render_template('schedule.html', active='schedule', schedule=schedule, settings=project.global_settings)
+    return flask.render_template('schedule.html', active='schedule', schedule=schedule, settings=project.get_settings_view())
 
 @app.route('/measurements')
 @app.route('/measurements/<path_str>', methods=['GET', 'POST'])
 @app.route('/measurements/<path_str>/<activepath_str>', methods=['GET', 'POST'])
-def measurements(path_str=None, activepath_str=None):
+@with_project
+def measurements(project, path_str=None, activepath_str=None):
     
     # Handle button requests
     if flask.request.method == 'POST':
-        path = eval(path_str)
-        activepath = eval(str(activepath_str))
+        # Apply pending edits before structural changes
+        apply_measitem_edits(project, get_session_id())
+        try:
+            path = parse_path(path_str)
+            activepath = parse_path(activepath_str)
+        except ValueError:
+            log.error("Bad path specified")
+            return flask.redirect(project.global_settings['current_page'])
         # Measurement Items
         if len(path) == 2:
             if 'add' in flask.request.form and flask.request.form['add'] != 'None':
@@ -243,7 +372,7 @@ def measurements(path_str=None, activepath_str=None):
                     project.datamodel.add_measurement_item_at_node(model, path)
             if 'edit' in flask.request.form:
                 if activepath != None:
-                    return render_measurement(activepath_str)
+                    return render_measurement(project, activepath_str)
             elif 'undo' in flask.request.form:
                 project.undo()
             elif 'redo' in flask.request.form:
@@ -257,38 +386,74 @@ def measurements(path_str=None, activepath_str=None):
                         project.datamodel.delete_row_meas(path + [measurement.length()-1])
         elif len(path) == 3:
             if 'measitem_add' in flask.request.form:
-                measitem = project.global_settings['measitem']
+                measitem = project.global_settings['measitem'].get_writable()
                 measitem.append_record(RecordCustom(['']*measitem.model_width() , measitem.cust_funcs, measitem.total_func_item, measitem.columntypes))
             elif 'measitem_addn' in flask.request.form:
                 try:
                     no = int(flask.request.form['measitem_addn_no'])
                     if no > 25:
                         no = 25
-                    measitem = project.global_settings['measitem']
+                    measitem = project.global_settings['measitem'].get_writable()
                     for i in range(no):
                         measitem.append_record(RecordCustom(['']*measitem.model_width() , measitem.cust_funcs, measitem.total_func_item, measitem.columntypes))
                 except:
                     flask.flash('Wrong number of rows input', 'error')
             elif 'measitem_delete' in flask.request.form:
-                measitem = project.global_settings['measitem']
+                measitem = project.global_settings['measitem'].get_writable()
                 if measitem.length() > 0:
                     measitem.remove_record(measitem.length()-1)
-            return render_measurement(str(project.global_settings['measitem_path']), None, softload=True)
+            return render_measurement(project, str(project.global_settings['measitem_path']), None, softload=True)
         
         return flask.redirect(project.global_settings['current_page'])
         
     # Handle website requests
     elif flask.request.method == 'GET':
-        return render_measurement(path_str, activepath_str)
+        return render_measurement(project, path_str, activepath_str)
         
     
+@app.route('/measitem/records')
+@with_project
+def measitem_records(project):
+    """Returns JSON of range of records of measurement item being edited"""
+    if 'measitem' not in project.global_settings:
+        flask.abort(404)
+    # Apply pending edits so that records are up to date
+    apply_measitem_edits(project, get_session_id())
+    measitem = project.global_settings['measitem'].get_item()
+    try:
+        start = int(flask.request.args.get('start', 0))
+        count = int(flask.request.args.get('count', app.config['MEASITEM_PAGE_SIZE']))
+    except ValueError:
+        flask.abort(400)
+    count = min(max(count, 0), app.config['MEASITEM_PAGE_SIZE'])
+    return flask.jsonify(get_measitem_records(measitem, start, count))
+    
+@app.route('/schedule/search')
+@with_project
+def schedule_search(project):
+    """Returns JSON of schedule items matching query for selection"""
+    query = flask.request.args.get('q', '')
+    try:
+        limit = int(flask.request.args.get('limit', app.config['SCHEDULE_SEARCH_LIMIT']))
+    except ValueError:
+        flask.abort(400)
+    limit = min(max(limit, 0), app.config['SCHEDULE_SEARCH_LIMIT'])
+    schedule = project.datamodel.schedule
+    items = []
+    for itemno in schedule.search(query, limit):
+        item = schedule[itemno]
+        items.append([item.itemno, item.extended_description_limited, item.unit, item.reference])
+    return flask.jsonify({'items': items})
+    
 @app.route('/contactus')
-def contactus():
+@with_project
+def contactus(project):
     project.global_settings['current_page'] = '/contactus'
-    return flask.render_template('contactus.html', active='contactus', settings=project.global_settings)
+    return flask.render_template('contactus.html', active='contactus', settings=project.get_settings_view())
     
 @app.route('/save')
-def save():
+@with_project
+def save(project):
     path = project.global_settings['project_path']
     if path is not '':
         if project.save_project(path):
@@ -300,14 +465,16 @@ def save():
     return flask.redirect(project.global_settings['current_page'])
     
 @app.route('/close', methods=['GET', 'POST'])
-def close():
+@with_project
+def close(project):
     # Reset Project
     project.global_settings['project_path'] = ''
     flask.flash('Project successfully closed','success')
     return flask.redirect('/')
     
 @app.route('/download')
-def download():
+@with_project
+def download(project):
     file_ = open(project.global_settings['project_path'], 'r')
     if file_ is not None:
         body = file_.read()
@@ -319,3 +486,36 @@ def download():
         return flask.redirect('/')
 
     
+
+@app.route('/render/<kind>/<path_str>', methods=['POST'])
+@with_project
+def render(project, kind, path_str):
+    try:
+        path = parse_path(path_str)
+        job = render_jobs.submit(get_session_id(), kind, path, project)
+    except (ValueError, TypeError, IndexError):
+        log.error("Bad render request - " + str([kind, path_str]))
+        return flask.jsonify({'error': 'Bad render request'}), 400
+    return flask.jsonify(job.get_status()), 202
+    
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = render_jobs.get(job_id, get_session_id())
+    if job is None:
+        return flask.jsonify({'error': 'Job not found'}), 404
+    return flask.jsonify(job.get_status())
+    
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    job = render_jobs.get(job_id, get_session_id())
+    if job is None:
+        return flask.jsonify({'error': 'Job not found'}), 404
+    render_jobs.cancel(job)
+    return flask.jsonify(job.get_status())
+    
+@app.route('/jobs/<job_id>/download/<filename>')
+def job_download(job_id, filename):
+    job = render_jobs.get(job_id, get_session_id())
+    if job is None or filename not in job.artifacts:
+        flask.abort(404)
+    return flask.send_from_directory(job.folder, filename, as_attachment=True)
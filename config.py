@@ -7,3 +7,17 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
 ALLOWED_EXTENSIONS = set(['proj'])
+# Maximum number of projects kept in memory, idle projects beyond are saved to disk
+MAX_OPEN_PROJECTS = 8
+# Seconds after which projects saved to disk and not opened again are removed
+SESSION_FILE_LIFETIME = 7 * 24 * 3600
+# Number of render jobs run in parallel
+RENDER_WORKERS = 2
+# Number of finished render jobs retained for status and download
+MAX_RENDER_JOBS = 100
+# Seconds over which single cell edits of a measurement item are merged before being applied
+MEASITEM_EDIT_WINDOW = 0.05
+# Number of records of a measurement item sent to the browser at a time
+MEASITEM_PAGE_SIZE = 100
+# Maximum number of schedule items returned by a search
+SCHEDULE_SEARCH_LIMIT = 50
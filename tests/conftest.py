@@ -0,0 +1,91 @@
+# Test configuration for cmbcompanion
+
+import os, sys
+
+import pytest
+
+# Package root for imports of cmbcompanion and config, and package folder
+# for the bundled openpyxl
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'cmbcompanion'))
+sys.path.insert(0, ROOT)
+
+from cmbcompanion import data, undo
+
+
+@pytest.fixture
+def stack():
+    """Fresh undo stack for undoable data model functions"""
+    stack = undo.Stack()
+    undo.setstack(stack)
+    return stack
+
+
+def make_steel_item(lengths):
+    """Returns a steel measurement item with a record for each bar length"""
+    item = data.measurement.MeasurementItemCustom(None, 'civil_steel_table_lengths')
+    for count, length in enumerate(lengths):
+        values = ['bar ' + str(count), '10', '1', str(length), '', '', '', '', ''] + [''] * 7
+        item.append_record(data.measurement.RecordCustom(values, item.cust_funcs, item.total_func_item, item.columntypes))
+    return item
+
+
+def make_datamodel():
+    """Returns a data model of two cmbs with steel items and an abstract over items of cmb 0
+    
+        Layout:
+            [0, 0, 0..1]: steel items
+            [0, 0, 2]: abstract of [0, 0, 0] and [0, 0, 1]
+            [1, 0, 0]: steel item
+    """
+    datamodel = data.datamodel.DataModel()
+    for cmb_no in range(2):
+        cmb = data.measurement.Cmb(['CMB ' + str(cmb_no + 1), []])
+        cmb.append_item(data.measurement.Measurement(['01/01/2016', []]))
+        datamodel.cmbs.append(cmb)
+    datamodel.cmbs[0][0].append_item(make_steel_item([1.5, 2]))
+    datamodel.cmbs[0][0].append_item(make_steel_item([3]))
+    datamodel.cmbs[0][0].append_item(data.measurement.MeasurementItemAbstract([[[0, 0, 0], [0, 0, 1]], 'Abstract']))
+    datamodel.cmbs[1][0].append_item(make_steel_item([4, 0.5]))
+    datamodel.update(full=True)
+    return datamodel
+
+
+def make_billed_datamodel(items=40, bills=3, seed=1):
+    """Returns a data model with a schedule and steel items billed in a chain of bills
+    
+        Layout:
+            [0, 0, 0..items-1]: steel items on random schedule items
+            [0, 0, items]: abstract of [0, 0, 0..3]
+            bill 0: abstract and items 4 onwards up to share of bill
+            bill n: next share of items, previous bill n-1
+    """
+    random = __import__('random').Random(seed)
+    datamodel = data.datamodel.DataModel()
+    rows = [['1.' + str(count), 'Item ' + str(count), random.choice(['kg', 'cum', 'nos', 'each']), str(round(random.uniform(10, 500), 2)),
+             str(random.choice([random.randint(10, 200), round(random.uniform(10, 200), 3)])), '',
+             str(random.choice([30, 20, 0]))] for count in range(10)]
+    datamodel.schedule.set_model(rows)
+    itemnos = datamodel.schedule.get_itemnos()
+    cmb = data.measurement.Cmb(['CMB 1', []])
+    cmb.append_item(data.measurement.Measurement(['01/01/2016', []]))
+    datamodel.cmbs.append(cmb)
+    for count in range(items):
+        item = make_steel_item([random.choice([round(random.uniform(0.5, 12), 2), random.randint(1, 12)])
+                                for record in range(random.randint(1, 4))])
+        for index in range(len(item.itemnos)):
+            item.itemnos[index] = random.choice(itemnos)
+        cmb[0].append_item(item)
+    cmb[0].append_item(data.measurement.MeasurementItemAbstract([[[0, 0, count] for count in range(4)], 'Abstract']))
+    share = (items - 4) // bills
+    for bill_no in range(bills):
+        bill = data.bill.Bill()
+        bill.data.title = 'Bill ' + str(bill_no + 1)
+        bill.data.mitems = [[0, 0, count] for count in range(4 + bill_no * share, 4 + (bill_no + 1) * share)]
+        if bill_no == 0:
+            bill.data.mitems.insert(0, [0, 0, items])
+        else:
+            bill.data.prev_bill = bill_no - 1
+        datamodel.bills.append(bill)
+    datamodel.update(full=True)
+    return datamodel
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# Stub of pdflatex for tests, set as misc.global_settings_dict['latex_path']
+#
+# Writes an .aux file recording the .aux files of the documents refered by
+# externaldocument, so that references settle over passes as with pdflatex,
+# and an empty .pdf. Each run is logged to calls.log in the output folder.
+
+import os, re, sys
+
+folder = [arg for arg in sys.argv if arg.startswith('-output-directory=')][0].split('=', 1)[1]
+filename = sys.argv[-1]
+name = os.path.splitext(os.path.basename(filename))[0]
+with open(filename) as tex_file:
+    depends = re.findall(r'\\externaldocument\{(\w+)\}', tex_file.read())
+aux = [name]
+for depend in depends:
+    aux_filename = os.path.join(folder, depend + '.aux')
+    if os.path.exists(aux_filename):
+        with open(aux_filename) as aux_file:
+            aux.append(depend + ':' + str(aux_file.read().count('\n')))
+with open(os.path.join(folder, 'calls.log'), 'a') as log_file:
+    log_file.write(name + '\n')
+with open(os.path.join(folder, name + '.aux'), 'w') as aux_file:
+    aux_file.write('\n'.join(aux) + '\n')
+with open(os.path.join(folder, name + '.pdf'), 'w') as pdf_file:
+    pdf_file.write('')
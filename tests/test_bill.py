@@ -0,0 +1,97 @@
+# Tests for cmbcompanion.data.bill
+
+import collections, copy
+
+import pytest
+
+from cmbcompanion import data, misc
+
+from conftest import make_billed_datamodel
+
+
+def get_bill_values(datamodel):
+    """Returns values of all bills along with their types"""
+    values = []
+    for bill in datamodel.bills:
+        items = [[(itemno, type(value).__name__, value) for itemno, value in sorted(dict(item_values).items())]
+                 for item_values in [bill.item_total_qty, bill.item_normal_qty, bill.item_excess_qty,
+                                     bill.item_normal_amount, bill.item_excess_amount]]
+        values.append([bill.bill_total_amount, bill.bill_since_prev_amount, bill.item_cmb_ref] + items)
+    return values
+
+
+@pytest.mark.skipif(misc.numpy is None, reason='numpy not installed')
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_array_evaluation_matches_item_evaluation(monkeypatch, seed):
+    datamodel = make_billed_datamodel(items=60, bills=4, seed=seed)
+    values = get_bill_values(datamodel)
+    assert isinstance(datamodel.bills[0].item_total_qty, data.bill.ItemValues)
+    assert any(bill.item_excess_qty[itemno] > 0 for bill in datamodel.bills for itemno in datamodel.schedule.get_itemnos())
+    
+    monkeypatch.setattr(misc, 'numpy', None)
+    datamodel.bill_engine.arrays = None
+    datamodel.update(full=True)
+    
+    assert not isinstance(datamodel.bills[0].item_total_qty, data.bill.ItemValues)
+    assert get_bill_values(datamodel) == values
+
+
+def get_totals(bill):
+    return dict((itemno, qty) for itemno, qty in bill.item_total_qty.items() if qty != 0)
+
+
+def set_prev_bills(datamodel, prev_bills):
+    for bill, prev_bill in zip(datamodel.bills, prev_bills):
+        bill.data.prev_bill = prev_bill
+    datamodel.update(full=True)
+
+
+def test_prev_bill_later_in_list():
+    datamodel = make_billed_datamodel()
+    set_prev_bills(datamodel, [None, None, None])
+    own_totals = [get_totals(bill) for bill in datamodel.bills]
+    
+    # Bill 0 carries forward from bill 2, which carries forward from bill 1
+    set_prev_bills(datamodel, [2, None, 1])
+    
+    assert datamodel.bill_engine.order == [1, 2, 0]
+    expected = collections.Counter(own_totals[0]) + collections.Counter(own_totals[1]) + collections.Counter(own_totals[2])
+    totals = get_totals(datamodel.bills[0])
+    assert sorted(totals) == sorted(expected)
+    assert all(totals[itemno] == pytest.approx(expected[itemno]) for itemno in expected)
+    assert datamodel.verify_update()
+
+
+def test_prev_bill_cycle_logged(caplog):
+    datamodel = make_billed_datamodel()
+    
+    set_prev_bills(datamodel, [None, 2, 1])
+    
+    assert datamodel.bill_engine.order == [0, 1, 2]
+    assert 'Cyclic previous bill references - [1, 2]' in caplog.text
+
+
+def test_update_carried_only_changed_items(stack, monkeypatch):
+    datamodel = make_billed_datamodel()
+    totals = [get_totals(bill) for bill in datamodel.bills]
+    updated = []
+    carried = []
+    update, update_carried = data.bill.Bill.update, data.bill.Bill.update_carried
+    monkeypatch.setattr(data.bill.Bill, 'update', 
+                        lambda bill, *args: updated.append(datamodel.bills.index(bill)) or update(bill, *args))
+    monkeypatch.setattr(data.bill.Bill, 'update_carried', 
+                        lambda bill, schedule, itemnos: carried.append((datamodel.bills.index(bill), set(itemnos))) 
+                                                        or update_carried(bill, schedule, itemnos))
+    
+    # Edit item billed in first bill of chain
+    item = datamodel.cmbs[0][0][5]
+    model = item.get_model()
+    edited = copy.deepcopy(model)
+    edited[1][1][0][3] = '25'
+    datamodel.edit_measurement_item([0, 0, 5], item, edited, model)
+    
+    changed = set(itemno for itemno, qty in get_totals(datamodel.bills[0]).items() if totals[0].get(itemno) != qty)
+    assert changed and len(changed) < len(datamodel.schedule.get_itemnos())
+    assert updated == [0]
+    assert carried == [(1, changed), (2, changed)]
+    assert datamodel.verify_update()
@@ -0,0 +1,150 @@
+# Tests for cmbcompanion.data.datamodel
+
+import copy, logging
+
+import pytest
+
+from cmbcompanion import data
+
+from conftest import make_datamodel, make_billed_datamodel, make_steel_item
+
+
+def get_abstract(datamodel):
+    return datamodel.cmbs[0][0][2]
+
+
+def test_undo_delete_measurement_restores_abstract(stack):
+    datamodel = make_datamodel()
+    abstract = get_abstract(datamodel)
+    mitems = list(abstract.mitems)
+    total = abstract.get_total()
+    assert len(mitems) == 2 and total
+    
+    datamodel.delete_row_meas([0, 0])
+    stack.undo()
+    
+    abstract = get_abstract(datamodel)
+    assert abstract.mitems == mitems
+    assert datamodel.nodes.get_paths(abstract.mitems) == [[0, 0, 0], [0, 0, 1]]
+    assert abstract.get_total() == total
+    assert datamodel.verify_references()
+
+
+def test_undo_delete_cmb_restores_abstract(stack):
+    datamodel = make_datamodel()
+    total = get_abstract(datamodel).get_total()
+    
+    datamodel.delete_row_meas([0])
+    stack.undo()
+    
+    abstract = get_abstract(datamodel)
+    assert datamodel.nodes.get_paths(abstract.mitems) == [[0, 0, 0], [0, 0, 1]]
+    assert abstract.get_total() == total
+    assert sorted(datamodel.get_lock_states().get_paths()) == [[0, 0, 0], [0, 0, 1]]
+
+
+def test_incremental_updates_match_full_update(stack, caplog):
+    datamodel = make_billed_datamodel()
+    datamodel.check_updates = True
+    item = datamodel.cmbs[0][0][5]
+    model = item.get_model()
+    edited = copy.deepcopy(model)
+    edited[1][1][0][3] = '25'  # Length of first record
+    
+    # Edit billed item, abstracted item, bills and structure
+    datamodel.edit_measurement_item([0, 0, 5], item, edited, model)
+    datamodel.edit_measurement_item([0, 0, 1], datamodel.cmbs[0][0][1], edited, datamodel.cmbs[0][0][1].get_model())
+    bill_model = datamodel.bills[1].get_model()
+    bill_model[1][5] = datamodel.nodes.get_paths(bill_model[1][5])[0:5]
+    datamodel.edit_bill_at_row(bill_model, 1)
+    datamodel.add_measurement_item_at_node(make_steel_item([2]).get_model(), [0, 0, 0])
+    datamodel.delete_row_meas([0, 0, 3])
+    datamodel.delete_bill(0)
+    for count in range(6):
+        stack.undo()
+    for count in range(6):
+        stack.redo()
+    
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+    assert datamodel.verify_update()
+    # Compare with data model rebuilt from saved model
+    rebuilt = data.datamodel.DataModel(copy.deepcopy(datamodel.get_model()[1]))
+    rebuilt.update(full=True)
+    assert rebuilt.get_derived_state() == datamodel.get_derived_state()
+
+
+@pytest.mark.parametrize('model, path', [(make_steel_item([2]).get_model(), [0, 0, 0]),
+                                         (['Measurement', ['01/02/2016', []]], [0, 0])])
+def test_insert_updates_only_positions(stack, monkeypatch, model, path):
+    datamodel = make_billed_datamodel()
+    abstract = datamodel.cmbs[0][0][40]
+    total = abstract.get_total()
+    locks = datamodel.lock_state.get_paths()
+    calls = []
+    monkeypatch.setattr(data.bill.Bill, 'update', lambda *args, **kwargs: calls.append('bill'))
+    monkeypatch.setattr(data.bill.Bill, 'update_carried', lambda *args, **kwargs: calls.append('bill'))
+    monkeypatch.setattr(data.measurement.MeasurementItemAbstract, 'update', lambda *args, **kwargs: calls.append('abstract'))
+    
+    if len(path) == 3:
+        datamodel.add_measurement_item_at_node(model, path)
+    else:
+        datamodel.add_measurement_at_node(model, path)
+    assert not calls
+    
+    level = len(path) - 1
+    assert datamodel.lock_state.get_paths() == [lock[:level] + [lock[level] + 1] + lock[level+1:] for lock in locks]
+    labels = [record.get_model()[0] for record in abstract.records]
+    assert labels == ['Qty B/F ' + str(path) for path in datamodel.nodes.get_paths(abstract.mitems)]
+    assert abstract.get_total() == total
+    monkeypatch.undo()
+    assert datamodel.verify_update()
+
+
+def test_reference_index():
+    index = data.datamodel.ReferenceIndex()
+    index.set('bill', [1, 2, 2])
+    index.set('abstract', [2, 3])
+    
+    assert index.referrers[2] == {'bill': 2, 'abstract': 1}
+    assert index.get_referrers([2]) == {'bill', 'abstract'}
+    assert index.get_referrers([1, 4]) == {'bill'}
+    assert index.pop_changed() == {1, 2, 3}
+    assert index.pop_changed() == set()
+    assert index.verify({'bill': [1, 2, 2], 'abstract': [2, 3]})
+    assert not index.verify({'bill': [1, 2], 'abstract': [2, 3]})
+    
+    # Items becoming unrefered are reported once no referrer is left
+    index.set('bill', [2, 4])
+    assert index.referrers[2] == {'bill': 1, 'abstract': 1}
+    assert index.pop_changed() == {1, 4}
+    index.discard('abstract')
+    index.discard('abstract')
+    assert index.pop_changed() == {3}
+    assert sorted(index.get_refered()) == [2, 4]
+    assert not index.is_refered(3)
+    assert index.verify({'bill': [2, 4], 'abstract': []})
+
+
+def test_lock_state():
+    locks = data.datamodel.LockState([[0, 1, 2], [0, 0, 10]])
+    locks[[0, 0, 2]] = True
+    locks.add([1, 0, 0])
+    locks.discard([0, 1, 2])
+    locks.discard([5])
+    
+    assert locks[[0, 0, 2]] is True
+    assert locks[[0, 1, 2]] is False
+    assert [1, 0, 0] in locks and (1, 0, 0) in locks
+    # Paths are ordered numerically
+    assert locks.get_paths() == [[0, 0, 2], [0, 0, 10], [1, 0, 0]]
+    locks[[0, 0, 2]] = False
+    assert len(locks) == 2
+    
+    other = data.datamodel.LockState([[1, 0, 0], [2, 0, 0]])
+    assert (locks + other).get_paths() == [[0, 0, 10], [1, 0, 0], [2, 0, 0]]
+    assert (locks - other).get_paths() == [[0, 0, 10]]
+    assert locks.get_paths() == [[0, 0, 10], [1, 0, 0]]
+    locks |= other
+    assert len(locks) == 3
+    locks -= other
+    assert locks.get_paths() == [[0, 0, 10]]
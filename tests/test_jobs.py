@@ -0,0 +1,40 @@
+# Tests for cmbcompanion.jobs
+
+import os, types
+
+import pytest
+
+from cmbcompanion import jobs, misc
+
+from conftest import make_datamodel
+
+
+def make_project():
+    project_settings = dict((item_code, '') for item_code in misc.global_vars)
+    return types.SimpleNamespace(datamodel=make_datamodel(), project_settings=project_settings)
+
+
+def test_jobs_render_snapshot_into_own_folder(tmp_path, stack):
+    queue = jobs.JobQueue(str(tmp_path), 1, 10)
+    project = make_project()
+    folder_lock = queue.folder_locks[queue.get_folder('s')]
+    with folder_lock:
+        job_1 = queue.submit('s', 'cmb_xlsx', [0], project)
+        job_2 = queue.submit('s', 'cmb_xlsx', [1], project)
+        # Changes after submission are not seen by jobs
+        project.datamodel.delete_row_meas([1])
+    queue.executor.shutdown(wait=True)
+    
+    assert job_1.status == jobs.JOB_DONE and job_2.status == jobs.JOB_DONE
+    assert job_1.folder != job_2.folder
+    assert job_1.artifacts == ['cmb_1.xlsx']
+    assert job_2.artifacts == ['cmb_2.xlsx']
+    assert os.listdir(job_1.folder) == ['cmb_1.xlsx']
+    assert os.listdir(job_2.folder) == ['cmb_2.xlsx']
+
+
+def test_jobs_bad_path(tmp_path):
+    queue = jobs.JobQueue(str(tmp_path), 1, 10)
+    with pytest.raises(ValueError):
+        queue.submit('s', 'cmb', [2], make_project())
+    assert not queue.jobs
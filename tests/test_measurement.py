@@ -0,0 +1,72 @@
+# Tests for cmbcompanion.data.measurement
+
+from cmbcompanion import data
+
+
+def test_record_value_too_large_for_float():
+    item = data.measurement.MeasurementItemCustom(None, '_1_NLBH')
+    item.records.append_model(['a', '', '1' + '0'*400, '1', '1', '1'])
+    
+    assert item.records.get_data(0)[2] == 0
+    assert item.records.get_model(0)[2] == '1' + '0'*400
+    assert item.get_total() == [1]
+
+
+def test_record_total_too_large_for_float():
+    item = data.measurement.MeasurementItemCustom(None, '_1_NLBH')
+    item.records.append_model(['a', '', '1' + '0'*200, '1' + '0'*200, '1', '1'])
+    
+    assert item.records.get_data(0)[2] == float(10**200)
+    assert item.records.get_total(0) == [0]
+    
+    item.records.append_model(['a', '', '1e200', '1e200', '1', '1'])
+    assert item.records.get_total(1) == [0]
+
+
+def test_record_totals_evaluated_on_read(monkeypatch):
+    rows = [['bar', '2', '3', str(length), '2.25', '0', '0', '0', '0'] for length in range(1, 21)]
+    item = data.measurement.MeasurementItemCustom([[None], rows, '', [''], ['']*6 + ['1']*6],
+                                                  'civil_steel_table_lengths')
+    calls = []
+    total_func = item.records.total_func
+    monkeypatch.setattr(item.records, 'total_func', lambda values: calls.append(values) or total_func(values))
+    
+    # Item totals are evaluated over columns, record totals when read
+    item.set_values([(0, 3, '10'), (1, 4, '5')])
+    batch_total = item.get_total()
+    assert calls == []
+    assert item.records.get_total(0) == [60, 13.5, 0, 0, 0, 0]
+    assert len(calls) == 1
+    
+    monkeypatch.setattr(data.measurement.misc, 'numpy', None)
+    item.set_values([(0, 3, '10')])
+    assert item.get_total() == batch_total
+    assert len(calls) == len(rows) + 1
+
+
+def test_get_total_cached_until_modified(monkeypatch):
+    item = data.measurement.MeasurementItemCustom([[None], [['bar', '2', '3', '1.5', '2', '0', '0', '0', '0']], '', [''], 
+                                                   ['']*6 + ['1']*6], 'civil_steel_table_lengths')
+    calls = []
+    total_func_batch = item.total_func_batch
+    if total_func_batch is not None:
+        monkeypatch.setattr(item, 'total_func_batch', lambda *args: calls.append(1) or total_func_batch(*args))
+    total_func = item.total_func
+    monkeypatch.setattr(item, 'total_func', lambda *args: calls.append(1) or total_func(*args))
+    
+    assert item.get_total() == [21.0]
+    assert item.get_total() == [21.0]
+    assert len(calls) == 1
+    
+    # Writes through records, record lists and user data invalidate total
+    item[0].set_model(['bar', '2', '3', '1.5', '4', '0', '0', '0', '0'])
+    assert item.get_total() == [33.0]
+    item.append_record(data.measurement.RecordCustom(['bar', '1', '1', '1', '0', '0', '0', '0', '0'],
+                                                     item.cust_funcs, item.total_func_item, item.columntypes))
+    assert item.get_total() == [34.0]
+    item.user_data[6] = '2'
+    assert item.get_total() == [44.0]
+    item.remove_record(0)
+    assert item.get_total() == [2]
+    assert item.get_total() == [2]
+    assert len(calls) == 5
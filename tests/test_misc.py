@@ -0,0 +1,154 @@
+# Tests for cmbcompanion.misc
+
+import random, threading, time
+
+import pytest
+
+from cmbcompanion import misc
+
+
+@pytest.mark.parametrize('text', ['*'.join(['1' + '0'*1000]*5),
+                                  '(' + '9'*1000 + ')*(' + '9'*1000 + ')*' + '9'*1000,
+                                  '*'.join(['2']*5000)])
+def test_evaluate_rejects_huge_results(text):
+    start = time.perf_counter()
+    with pytest.raises(ValueError):
+        misc.evaluate(text)
+    assert time.perf_counter() - start < 1
+
+
+@pytest.mark.parametrize('text', ['2**2', '1e308*10', '1e400', '-1e400', '1e400-1e400', '1j'])
+def test_evaluate_rejects_powers_and_non_finite(text):
+    with pytest.raises(ValueError):
+        misc.evaluate(text)
+
+
+def test_evaluate_large_results():
+    assert misc.evaluate('1' + '0'*200 + '*1' + '0'*200) == 10**400
+    assert misc.evaluate('(1.5*2)*(1+2)') == 9.0
+    assert misc.evaluate('-(1-3)/8') == 0.25
+
+
+def clean_latex_replace(text):
+    """Reference escaping by a chain of replacements"""
+    for splchar, replspelchar in zip(['\\', '#', '$', '%', '^', '&', '_', '{', '}', '~', '\n'],
+                                     ['\\textbackslash ', '\\# ', '\\$ ', '\\% ', '\\textasciicircum ', '\\& ', '\\_ ',
+                                      '\\{ ', '\\} ', '\\textasciitilde ', '\\newline ']):
+        text = text.replace(splchar, replspelchar)
+    return text
+
+
+def test_clean_latex_matches_replacements():
+    rand = random.Random(1)
+    alphabet = 'ab 1.\\#$%^&_{}~\n\u00e9'
+    for count in range(5000):
+        text = ''.join(rand.choice(alphabet) for i in range(rand.randint(0, 20)))
+        assert misc.clean_latex(text) == clean_latex_replace(text)
+
+
+
+def make_latex_text(rand, names):
+    """Returns random latex code with placeholders"""
+    return ''.join(rand.choice(names + ['\\textbf{', '}', ' x ', '\n', '%'])
+                   for count in range(rand.randint(0, 12)))
+
+
+def test_latex_template_matches_replacements():
+    rand = random.Random(2)
+    names = ['$a$', '$b$', '$ab$', '$cmbrecords$', '$unknown$']
+    alphabet = 'ab 1.\\#$%^&_{}~\n'
+    for count in range(2000):
+        text = make_latex_text(rand, names)
+        dic_clean = dict((name, ''.join(rand.choice(alphabet) for i in range(rand.randint(0, 6)))) 
+                         for name in rand.sample(names[0:4], 2))
+        dic = dict((name, make_latex_text(rand, ['\\\\'])) for name in names[0:4] if name not in dic_clean)
+        # Reference rendering by a chain of replacements
+        expected = text
+        for name, value in dic_clean.items():
+            expected = expected.replace(name, clean_latex_replace(value))
+        for name, value in dic.items():
+            expected = expected.replace(name, value)
+        assert misc.LatexTemplate(text).render(dic_clean, dic) == expected
+
+
+def test_latex_file_matches_string_buffer(tmp_path):
+    rand = random.Random(3)
+    names = ['$a$', '$b$', '$cmbrecords$']
+    templates = dict()  # Filename of template mapped to its text
+    for count in range(3):
+        template = tmp_path / ('template_' + str(count) + '.tex')
+        templates[str(template)] = make_latex_text(rand, names)
+        template.write_text(templates[str(template)])
+    for count in range(200):
+        latex_file = misc.LatexFile(make_latex_text(rand, names))
+        expected = latex_file.get_buffer()  # Reference buffer held as a single string
+        for step in range(rand.randint(0, 10)):
+            operation = rand.randrange(6)
+            if operation == 0:
+                text = make_latex_text(rand, names)
+                latex_file += misc.LatexFile(text)
+                expected = expected + '\n' + text
+            elif operation == 1:
+                text = make_latex_text(rand, names)
+                latex_file = latex_file + misc.LatexFile(text)
+                expected = expected + '\n' + text
+            elif operation == 2:
+                template = rand.choice(sorted(templates))
+                latex_file.add_preffix_from_file(template)
+                expected = templates[template] + '\n' + expected
+            elif operation == 3:
+                template = rand.choice(sorted(templates))
+                latex_file.add_suffix_from_file(template)
+                expected = expected + '\n' + templates[template]
+            elif operation == 4:
+                dic = {rand.choice(names): rand.choice(['x_1', '#', '$a$ done'])}
+                latex_file.replace_and_clean(dic)
+                for name, value in dic.items():
+                    expected = expected.replace(name, clean_latex_replace(value))
+            else:
+                dic = {rand.choice(names): make_latex_text(rand, ['y'])}
+                latex_file.replace(dic)
+                for name, value in dic.items():
+                    expected = expected.replace(name, value)
+        filename = str(tmp_path / 'output.tex')
+        latex_file.write(filename)
+        with open(filename) as output:
+            assert output.read() == expected
+        assert latex_file.get_buffer() == expected
+
+
+def test_latex_scheduler_runs_referred_documents_first(tmp_path, monkeypatch):
+    scheduler = misc.LatexScheduler(str(tmp_path), workers=4)
+    scheduler.add_job('cmb_1.tex', ['abs_1.tex', 'abs_2.tex'])
+    scheduler.add_job('cmb_2.tex', ['abs_2.tex'])
+    scheduler.add_job('abs_1.tex', ['cmb_1.tex'], stage=1)
+    scheduler.add_job('abs_2.tex', ['cmb_1.tex', 'cmb_2.tex', 'abs_1.tex'], stage=1)
+    scheduler.add_job('bill_1.tex', stage=1)
+    events = []
+    lock = threading.Lock()
+    
+    def run_job(filename):
+        with lock:
+            events.append(('start', filename))
+        time.sleep(0.01)
+        with lock:
+            events.append(('end', filename))
+        return 0
+    monkeypatch.setattr(scheduler, 'run_job', run_job)
+    
+    assert scheduler.run() == (misc.CMB_OK, None)
+    # A document starts only once documents it reads in the same pass ended
+    for before, after in [('cmb_1.tex', 'abs_1.tex'), ('cmb_2.tex', 'abs_2.tex'), ('abs_1.tex', 'abs_2.tex')]:
+        assert events.index(('end', before)) < events.index(('start', after))
+    assert scheduler.get_layers(sorted(scheduler.jobs)) == [['cmb_1.tex', 'cmb_2.tex'], 
+                                                            ['abs_1.tex', 'bill_1.tex'], ['abs_2.tex']]
+
+
+def test_latex_scheduler_breaks_cycles(tmp_path, caplog):
+    scheduler = misc.LatexScheduler(str(tmp_path))
+    scheduler.add_job('abs_1.tex', ['abs_2.tex'])
+    scheduler.add_job('abs_2.tex', ['abs_1.tex', 'cmb_1.tex'])
+    scheduler.add_job('cmb_1.tex')
+    
+    assert scheduler.get_layers(sorted(scheduler.jobs)) == [['cmb_1.tex'], ['abs_1.tex'], ['abs_2.tex']]
+    assert 'Cyclic references' in caplog.text
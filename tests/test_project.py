@@ -0,0 +1,62 @@
+# Tests for cmbcompanion.Project
+
+import types
+
+import pytest
+
+import cmbcompanion
+from cmbcompanion import data
+
+from conftest import make_datamodel
+
+
+def make_project(path):
+    project = cmbcompanion.Project()
+    project.datamodel = make_datamodel()
+    item = project.datamodel.cmbs[path[0]][path[1]][path[2]]
+    project.global_settings['measitem_path'] = path
+    project.global_settings['measitem'] = data.measurement.MeasurementItemEdit(item)
+    return project
+
+
+def test_queued_edits_applied():
+    project = make_project([1, 0, 0])
+    project.queue_measitem_edit((1, 3, '2'))
+    project.queue_measitem_edit((0, 3, '5'))
+    
+    assert project.apply_measitem_edits() == [0, 1]
+    assert project.global_settings['measitem'].get_item().records[0].get_model()[3] == '5'
+    assert not project.measitem_edits
+
+
+def test_queued_edits_dropped_when_item_deleted():
+    project = make_project([1, 0, 0])
+    project.queue_measitem_edit((0, 3, '5'))
+    project.datamodel.delete_row_meas([1])
+    
+    assert project.apply_measitem_edits() == []
+    assert not project.global_settings['measitem'].is_modified()
+
+
+def test_queued_edits_dropped_for_other_item():
+    project = make_project([0, 0, 0])
+    project.queue_measitem_edit((1, 3, '5'))
+    item = project.datamodel.cmbs[0][0][1]
+    project.global_settings['measitem_path'] = [0, 0, 1]
+    project.global_settings['measitem'] = data.measurement.MeasurementItemEdit(item)
+    project.queue_measitem_edit((0, 3, '7'))
+    # Row 1 does not exist in new item and is dropped along with other edits of old item
+    assert project.apply_measitem_edits() == [0]
+    assert project.global_settings['measitem'].get_item().records[0].get_model()[3] == '7'
+
+
+def test_settings_view_read_only_and_live():
+    project = make_project([0, 0, 0])
+    settings = project.get_settings_view()
+    
+    assert isinstance(settings, types.MappingProxyType)
+    assert settings['measitem'] is project.global_settings['measitem']
+    with pytest.raises(TypeError):
+        settings['current_page'] = '/schedule'
+    project.global_settings['current_page'] = '/schedule'
+    assert settings['current_page'] == '/schedule'
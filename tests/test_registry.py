@@ -0,0 +1,50 @@
+# Tests for cmbcompanion.ProjectRegistry
+
+import os, time
+
+import cmbcompanion
+
+
+def test_evicted_project_reopened_and_file_removed(tmp_path):
+    registry = cmbcompanion.ProjectRegistry(str(tmp_path), 1, 3600)
+    with registry.session('a') as project:
+        project.project_settings['$cmbnameofwork$'] = 'Work A'
+    with registry.session('b'):
+        pass
+    filename = registry.get_session_filename('a')
+    assert list(registry.projects) == ['b']
+    assert not registry.evicting
+    assert os.path.exists(filename)
+    
+    with registry.session('a') as project:
+        assert project.project_settings['$cmbnameofwork$'] == 'Work A'
+        assert not os.path.exists(filename)
+    assert list(registry.projects) == ['a']
+
+
+def test_evict_skips_reclaimed_project(tmp_path):
+    registry = cmbcompanion.ProjectRegistry(str(tmp_path), 1, 3600)
+    with registry.session('a'):
+        pass
+    with registry.lock:
+        registry.projects['b'] = cmbcompanion.Project()
+        evicted = registry.select_evicted()
+    assert [session_id for session_id, project in evicted] == ['a']
+    # Session used again before its project is written
+    with registry.session('a'):
+        registry.evict(evicted)
+    assert 'a' in registry.projects
+    assert not os.path.exists(registry.get_session_filename('a'))
+
+
+def test_expired_session_files_removed(tmp_path):
+    expired = tmp_path / 'old.session'
+    expired.write_text('[]')
+    old = time.time() - 7200
+    os.utime(str(expired), (old, old))
+    recent = tmp_path / 'new.session'
+    recent.write_text('[]')
+    
+    cmbcompanion.ProjectRegistry(str(tmp_path), 1, 3600)
+    assert not expired.exists()
+    assert recent.exists()
@@ -0,0 +1,161 @@
+# Tests for rendering of CMBs and bills through misc.LatexScheduler, using a stub of pdflatex
+
+import os, copy, logging
+
+import pytest
+
+from cmbcompanion import misc
+
+from conftest import ROOT, make_billed_datamodel, make_datamodel, make_steel_item
+
+# Latex templates reduced to placeholders used by tests
+LATEX_TEMPLATES = {'abstractitem.tex': '$cmbitemno$ $cmbtotalqty$ $cmbrecords$',
+                   'abstractitemelement.tex': '$cmbqtybf$',
+                   'abstractopening.tex': '',
+                   'billitem.tex': '$cmbitemno$ $cmbtotalqty$',
+                   'billopening.tex': '',
+                   'end.tex': '',
+                   'endabstract.tex': '',
+                   'endbill.tex': '',
+                   'meascompletion.tex': '',
+                   'measgroup.tex': '',
+                   'measheading.tex': '',
+                   'preamble.tex': '$cmbexternaldocs$'}
+
+
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    """Output folder, with latex templates and pdflatex replaced by stubs"""
+    templates = tmp_path / 'latex'
+    templates.mkdir()
+    for name, text in LATEX_TEMPLATES.items():
+        (templates / name).write_text(text + '\n')
+    abs_path = misc.abs_path
+    monkeypatch.setattr(misc, 'abs_path', lambda *args: str(templates / args[1]) if args[0] == 'latex' else abs_path(*args))
+    monkeypatch.setitem(misc.global_settings_dict, 'latex_path', os.path.join(ROOT, 'tests', 'fake_latex.py'))
+    output = tmp_path / 'output'
+    output.mkdir()
+    return str(output)
+
+
+def read_calls(folder):
+    with open(os.path.join(folder, 'calls.log')) as calls:
+        return calls.read().split()
+
+
+def test_render_documents(folder, stack, caplog):
+    datamodel = make_billed_datamodel()
+    replacement_dict = dict((item_code, '') for item_code in misc.global_vars)
+    monitor = misc.RenderMonitor()
+    documents = ['cmb_1', 'abs_1', 'bill_1', 'abs_2', 'bill_2', 'abs_3', 'bill_3']
+    
+    code = datamodel.render_documents(folder, replacement_dict, [0], [0, 1, 2], monitor)
+    assert code == (misc.CMB_OK, None)
+    assert sorted(monitor.outputs) == sorted(os.path.join(folder, name + '.pdf') for name in documents)
+    assert all(os.path.exists(output) for output in monitor.outputs)
+    calls = read_calls(folder)
+    # Every document run, then run again till its references settle
+    assert set(calls) == set(documents)
+    assert calls.count('bill_1') == 2 and calls.count('cmb_1') >= 2
+    assert max(calls.count(name) for name in documents) <= misc.LATEX_MAX_PASSES
+    assert not [record for record in caplog.records if record.levelno >= logging.WARNING]
+    
+    # Unchanged documents are not run again
+    datamodel.render_documents(folder, replacement_dict, [0], [0, 1, 2])
+    assert read_calls(folder) == calls
+    
+    # Change of an item of last bill reruns documents showing it and those refering them
+    path = datamodel.nodes.get_paths(datamodel.bills[2].data.mitems[0:1])[0]
+    item = datamodel.cmbs[path[0]][path[1]][path[2]]
+    model = item.get_model()
+    edited = copy.deepcopy(model)
+    edited[1][1][0][3] = '100'
+    datamodel.edit_measurement_item(path, item, edited, model)
+    code = datamodel.render_documents(folder, replacement_dict, [0], [0, 1, 2])
+    assert code == (misc.CMB_OK, None)
+    rerun = read_calls(folder)[len(calls):]
+    assert {'cmb_1', 'abs_3', 'bill_3'} <= set(rerun) and 'bill_1' not in rerun
+
+
+def read_spreadsheet(filename):
+    import openpyxl
+    sheet = openpyxl.load_workbook(filename).active
+    return [[cell.value for cell in row] for row in sheet.iter_rows()]
+
+
+def test_cmb_spreadsheet_follows_abstracted_items(tmp_path, stack):
+    datamodel = make_datamodel()
+    # Abstract in CMB 2 of an item of CMB 1
+    datamodel.add_measurement_item_at_node(['MeasurementItemAbstract', [[[0, 0, 0]], 'Abstract']], [1, 0])
+    folder = str(tmp_path)
+    filename = datamodel.render_cmb_spreadsheet(folder, 1)
+    rows = read_spreadsheet(filename)
+    assert ['Qty B/F [0, 0, 0]' in str(row) for row in rows].count(True) == 1
+    
+    # Unchanged spreadsheet not written again
+    datamodel.render_cmb_spreadsheet(folder, 1)
+    assert datamodel.render_cache.get_statistics()['hits'] == 1
+    
+    # Change and move of abstracted item in another CMB
+    item = datamodel.cmbs[0][0][0]
+    model = item.get_model()
+    edited = copy.deepcopy(model)
+    edited[1][1][0][3] = '100'
+    datamodel.edit_measurement_item([0, 0, 0], item, edited, model)
+    datamodel.add_measurement_item_at_node(make_steel_item([1]).get_model(), [0, 0, 0])
+    datamodel.render_cmb_spreadsheet(folder, 1)
+    rows_new = read_spreadsheet(filename)
+    assert rows_new != rows
+    assert ['Qty B/F [0, 0, 1]' in str(row) for row in rows_new].count(True) == 1
+
+
+def get_cells(spreadsheet):
+    """Returns values and styles of cells along with merged cells of active sheet"""
+    sheet = spreadsheet.spreadsheet.active
+    cells = dict(((row, column), (cell.value, cell.font.b, cell.alignment.wrap_text, cell.alignment.horizontal)) 
+                 for (row, column), cell in sheet._cells.items() if cell.value is not None)
+    return cells, sorted(str(cells) for cells in sheet.merged_cell_ranges)
+
+
+def test_spreadsheet_written_in_place_matches_appended(stack):
+    datamodel = make_datamodel()
+    measurement = datamodel.cmbs[0][0]
+    # Children written into the sheet of their parent
+    spreadsheet = misc.Spreadsheet()
+    spreadsheet.add_merged_cell(value='Heading', bold=True, width=6, horizontal='center')
+    for slno, item in enumerate(measurement.items):
+        item.get_spreadsheet_buffer([0, 0, slno], datamodel.schedule, spreadsheet)
+    # Children written into sheets of their own and appended
+    spreadsheet_appended = misc.Spreadsheet()
+    spreadsheet_appended.add_merged_cell(value='Heading', bold=True, width=6, horizontal='center')
+    for slno, item in enumerate(measurement.items):
+        spreadsheet_appended.append(item.get_spreadsheet_buffer([0, 0, slno], datamodel.schedule))
+    
+    assert get_cells(spreadsheet) == get_cells(spreadsheet_appended)
+    assert spreadsheet.length() == spreadsheet_appended.length() == len(spreadsheet.sheet.rows)
+    assert any(bold for value, bold, wrap_text, horizontal in get_cells(spreadsheet)[0].values())
+
+
+def test_streaming_spreadsheet_matches_spreadsheet(tmp_path, stack):
+    import openpyxl
+    datamodel = make_billed_datamodel(items=10, bills=1)
+    cmb = datamodel.cmbs[0]
+    sheets = []
+    for spreadsheet in [misc.Spreadsheet(), misc.StreamingSpreadsheet()]:
+        filename = str(tmp_path / (type(spreadsheet).__name__ + '.xlsx'))
+        cmb.get_spreadsheet_buffer([0], datamodel.schedule, spreadsheet).save(filename)
+        sheet = openpyxl.load_workbook(filename).active
+        cells = [[(cell.value, cell.font.b, cell.alignment.wrap_text, cell.alignment.horizontal) 
+                  for cell in row if cell.value is not None] for row in sheet.iter_rows()]
+        # Trailing empty rows are not written to a write-only sheet
+        while not cells[-1]:
+            cells.pop()
+        widths = [sheet.column_dimensions[openpyxl.cell.get_column_letter(column)].width for column in range(1, 19)]
+        sheets.append((sheet.title, widths, sheet.merged_cell_ranges, cells))
+    
+    # Heading merged in a sheet is centered across cells in a write-only sheet
+    (title, widths, merged, cells), (title_streamed, widths_streamed, merged_streamed, cells_streamed) = sheets
+    assert [str(cells) for cells in merged] == ['A1:F1'] and not merged_streamed
+    assert cells_streamed[0] == [cells[0][0][0:3] + ('centerContinuous',)]
+    assert (title, widths, cells[1:]) == (title_streamed, widths_streamed, cells_streamed[1:])
+    assert len(cells) > 30
@@ -0,0 +1,75 @@
+# Tests for cmbcompanion.data.schedule
+
+from cmbcompanion import data, undo
+
+
+def make_schedule():
+    """Returns a schedule with a main item, its sub items and an item without quantity"""
+    return data.schedule.Schedule([data.schedule.ScheduleItem(*row) for row in [
+        ['1', 'Excavation in all soils', '', '0', '0'],
+        ['1.1', 'Ordinary soil', 'cum', '100', '50'],
+        ['1.2', 'Hard rock', 'cum', '400', '20'],
+        ['2', 'Reinforcement steel bars', 'kg', '60', '1000'],
+        ['3', 'Plain cement concrete', 'cum', '5000', '10']]])
+
+
+@undo.undoable
+def insert_item(schedule, row, item):
+    schedule.insert_item_at_index(row, item)
+    schedule.update_values()
+    yield 'Insert schedule item'
+    schedule.remove_item_at_index(row)
+    schedule.update_values()
+
+
+def test_index_follows_edits(stack):
+    schedule = make_schedule()
+    assert schedule.get_itemnos() == ['1.1', '1.2', '2', '3']
+    assert schedule.search('rock', 10) == ['1.2']
+
+    insert_item(schedule, 1, data.schedule.ScheduleItem('1.0', 'Rock cutting', 'cum', '300', '5'))
+    assert schedule.get_itemnos() == ['1.0', '1.1', '1.2', '2', '3']
+    assert schedule['1.2'] is schedule[3]
+    assert schedule.search('rock', 10) == ['1.0', '1.2']
+
+    stack.undo()
+    assert schedule.get_itemnos() == ['1.1', '1.2', '2', '3']
+    assert schedule['1.0'] is None and schedule['1.2'] is schedule[2]
+    assert schedule.search('rock', 10) == ['1.2']
+
+    stack.redo()
+    assert schedule['1.0'] is schedule[1]
+    schedule.remove_item_at_index(4)
+    schedule['3'] = data.schedule.ScheduleItem('4', 'Brick work', 'cum', '4000', '5')
+    schedule[4].extended_description = schedule[4].description
+    assert schedule.get_itemnos() == ['1.0', '1.1', '1.2', '4']
+    assert schedule['3'] is None
+    assert schedule.search('brick', 10) == ['4']
+
+    # Items edited in place are indexed once values are updated
+    schedule[4][0] = '5'
+    schedule.update_values()
+    assert schedule['5'] is schedule[4] and schedule['4'] is None
+    schedule.set_model([['6', 'Plastering', 'sqm', '200', '100']])
+    assert schedule.get_itemnos() == ['6']
+    assert schedule.search('', 10) == ['6']
+
+
+def test_search_ranking():
+    schedule = data.schedule.Schedule([data.schedule.ScheduleItem(*row) for row in [
+        ['A1', 'Steel in columns', 'kg', '60', '100'],
+        ['B1', 'Concrete in beams with steel', 'cum', '5000', '10'],
+        ['ST1', 'Structural steel work', 'kg', '80', '50'],
+        ['B2', 'Stone masonry', 'cum', '3000', '20'],
+        ['ST2', 'Steel doors', 'sqm', '2000', '10']]])
+    schedule.update_values()
+
+    # Itemno prefix matches first, then description word prefixes, each in schedule order
+    assert schedule.search('st', 10) == ['ST1', 'ST2', 'A1', 'B1', 'B2']
+    assert schedule.search(' ST ', 3) == ['ST1', 'ST2', 'A1']
+    assert schedule.search('st', 1) == ['ST1']
+    assert schedule.search('steel col', 10) == ['A1']
+    assert schedule.search('teel', 10) == []
+    assert schedule.search('b', 10) == ['B1', 'B2']
+    assert schedule.search('', 2) == ['A1', 'B1']
+    assert schedule.search('st', 0) == []
@@ -0,0 +1,93 @@
+# Tests for cmbcompanion.views through the Flask and Socket.IO test clients
+
+import time
+
+import pytest
+
+import cmbcompanion
+from cmbcompanion import data, misc, views
+
+from conftest import make_datamodel, make_steel_item
+
+SESSION_ID = 'test'
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """Project of test session editing a steel item of three records"""
+    registry = cmbcompanion.ProjectRegistry(str(tmp_path), 1, 3600)
+    monkeypatch.setattr(views, 'projects', registry)
+    with registry.session(SESSION_ID) as project:
+        project.datamodel = make_datamodel()
+        item = project.datamodel.cmbs[1][0][0]
+        item.append_record(make_steel_item([3])[0])
+        project.datamodel.update(full=True)
+        project.global_settings['measitem_path'] = [1, 0, 0]
+        project.global_settings['measitem'] = data.measurement.MeasurementItemEdit(project.datamodel.cmbs[1][0][0])
+    return project
+
+
+@pytest.fixture
+def client(project):
+    client = cmbcompanion.app.test_client()
+    with client.session_transaction() as session:
+        session['project_id'] = SESSION_ID
+    return client
+
+
+def test_measitem_records_paging(client, monkeypatch):
+    monkeypatch.setitem(cmbcompanion.app.config, 'MEASITEM_PAGE_SIZE', 2)
+    
+    def get_records(**args):
+        return client.get('/measitem/records', query_string=args).get_json()
+    
+    page = get_records()
+    assert page['start'] == 0 and page['length'] == 3
+    assert [record['values'][3] for record in page['records']] == ['4', '0.5']
+    assert [record['values'][3] for record in get_records(start=1, count=5)['records']] == ['0.5', '3']
+    assert get_records(start=-4, count=1)['start'] == 0
+    assert get_records(start=10)['start'] == 3 and get_records(start=10)['records'] == []
+    assert get_records(count=-1)['records'] == []
+    assert client.get('/measitem/records?start=a').status_code == 400
+
+
+def test_measitem_records_without_item(client, project):
+    del project.global_settings['measitem']
+    assert client.get('/measitem/records').status_code == 404
+
+
+def get_deltas(socket_client):
+    return [event['args'][0] for event in socket_client.get_received() if event['name'] == 'meas_item_delta']
+
+
+def test_measitem_edits_sent_as_deltas(client, project, monkeypatch):
+    monkeypatch.setitem(cmbcompanion.app.config, 'MEASITEM_EDIT_WINDOW', 0.5)
+    socket_client = cmbcompanion.socketio.test_client(cmbcompanion.app, flask_test_client=client)
+    assert socket_client.is_connected()
+    
+    # Burst of single cell edits applied together after edit window
+    socket_client.emit('measitem_value_changed', {'row': 0, 'column': 3, 'html': '5'})
+    socket_client.emit('measitem_value_changed', {'row': 2, 'column': 3, 'html': '<b>1</b>'})
+    socket_client.emit('measitem_value_changed', {'row': 9, 'column': 3, 'html': '1'})
+    assert get_deltas(socket_client) == []
+    for count in range(100):
+        time.sleep(0.05)
+        deltas = get_deltas(socket_client)
+        if deltas:
+            break
+    item = project.global_settings['measitem'].get_item()
+    assert [record['row'] for delta in deltas for record in delta['records']] == [0, 2]
+    assert deltas[0]['totals'] == [views.format_rendered_value(total) for total in item.get_total()]
+    assert [item[row].get_model()[3] for row in range(3)] == ['5', '0.5', '1']
+    assert set(deltas[0]['records'][0]['columns']) == set(str(column) for column, columntype in enumerate(item.columntypes) 
+                                                          if columntype == misc.MEAS_CUST)
+    
+    # Batch of edits applied at once
+    socket_client.emit('measitem_values_changed', {'edits': [{'row': 1, 'column': 3, 'html': '2'}, 
+                                                             {'row': 1, 'column': 1, 'html': '4'}]})
+    deltas = get_deltas(socket_client)
+    assert [[record['row'] for record in delta['records']] for delta in deltas] == [[1]]
+    assert item[1].get_model()[1:4] == ['4', '1', '2']
+    # Edits are not saved to data model till item is saved
+    assert project.datamodel.cmbs[1][0][0][1].get_model()[3] == '0.5'
+    socket_client.disconnect()